@@ -4,11 +4,12 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_bootstrap import Bootstrap5
 from app.config import config_by_name
+from app.sharding import BranchSession
 import os
 from datetime import datetime
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': BranchSession})  # Routes queries to the current branch's database
 migrate = Migrate()
 login_manager = LoginManager()
 bootstrap = Bootstrap5()
@@ -21,7 +22,9 @@ def create_app():
     env = os.environ.get('FLASK_ENV', 'development')
     app.config.from_object(config_by_name[env])
 
-    # Initialize extensions
+    # Initialize extensions (one database bind per extra branch)
+    from app import sharding
+    sharding.configure(app)
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
@@ -45,11 +48,61 @@ def create_app():
             return value.strftime(format)
         return value
 
+    # Per-branch databases: schema for extra branches, request routing by session branch
+    sharding.init_app(app)
+
     # Register blueprints
     from app.routes import bp as main_bp
     app.register_blueprint(main_bp)
 
+    # Async exports, dashboard data and JSON API when ASYNC_VIEWS is set
+    from app import async_views
+    async_views.init_app(app)
+
+    # Slow-query log with EXPLAIN capture
+    from app import slow_queries
+    slow_queries.init_app(app)
+
+    # On-demand request profiler (per endpoint, 1-in-N or admin X-Profile header)
+    from app import profiling
+    profiling.init_app(app)
+
+    # Fingerprinted static assets built by `flask build-assets`
+    from app import assets
+    assets.init_app(app)
+
+    # {% cache %} template tag for rendered fragments
+    from app import fragment_cache
+    fragment_cache.init_app(app)
+
+    # In-memory check-in queue flushed to attendance in batches
+    from app import checkin
+    checkin.init_app(app)
+
+    # gzip/brotli compression of HTML, JSON and CSV responses
+    from app import compression
+    compression.init_app(app)
+
     # Import models to ensure they are registered with SQLAlchemy
     from app import models
 
+    # CLI commands (cron jobs and build steps)
+    from app.overdue import sweep_overdue_command
+    from app.reminders import send_reminders_command
+    from app.risk import compute_risk_command
+    from app.assets import build_assets_command
+    from app.ledger import ledger_command
+    from app.archive import archive_attendance_command
+    from app.changes import export_changes_command
+    from app.backfill import backfill_command
+    app.cli.add_command(sweep_overdue_command)
+    app.cli.add_command(send_reminders_command)
+    app.cli.add_command(compute_risk_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(ledger_command)
+    app.cli.add_command(archive_attendance_command)
+    app.cli.add_command(export_changes_command)
+    app.cli.add_command(sharding.shards_command)
+    app.cli.add_command(backfill_command)
+
     return app
\ No newline at end of file
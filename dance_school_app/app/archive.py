@@ -0,0 +1,211 @@
+"""Attendance archival.
+
+``attendance`` only keeps the last ``ATTENDANCE_HOT_DAYS`` days. ``flask
+archive-attendance`` moves older rows, a month at a time, into monthly
+partitions:
+
+* PostgreSQL: ``attendance_archive`` is a natively range-partitioned table
+  with one ``attendance_archive_YYYY_MM`` partition per month, and rows are
+  moved with a single ``DELETE ... RETURNING`` feeding an ``INSERT``.
+* SQLite (and other databases): one plain ``attendance_YYYY_MM`` table per
+  month, filled with ``INSERT ... SELECT`` then ``DELETE`` in one transaction.
+
+``attendance_union`` returns a subquery over the hot table plus only the
+archive months that overlap the requested date range, with every filter
+pushed into each branch; a query for recent dates therefore reads the hot
+table alone. Exports and all-time aggregates use it to span both.
+
+Each process reflects the list of archived months once per engine and keeps
+it with the value of the ``attendance_archive`` row in ``job_checkpoint``.
+``archive_attendance`` gives that row a new value in the same transaction as
+each month it moves. ``archived_months`` reads it (one primary-key lookup)
+and reflects again only when it changed, so every worker sees a new archive
+month as soon as its rows leave the hot table.
+"""
+import re
+import uuid
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Column, Index, MetaData, Table, and_, inspect, select, text, union_all
+
+from app import db
+from app.models import Attendance, JobCheckpoint
+
+CHECKPOINT_NAME = 'attendance_archive'  # job_checkpoint row whose value changes whenever rows are archived
+ARCHIVE_PARENT = 'attendance_archive'  # PostgreSQL partitioned parent
+MONTH_TABLE = re.compile(r'^attendance_(?:archive_)?(\d{4})_(\d{2})$')
+COLUMNS = ('id', 'student_id', 'batch_id', 'date', 'present', 'notes', 'created_at', 'updated_at')
+
+_months_cache = {}  # Engine URL -> (archive version, archived months)
+
+
+def is_archive_table(name):
+    """True for tables created here rather than by the models (kept out of Alembic autogenerate)."""
+    return name == ARCHIVE_PARENT or bool(MONTH_TABLE.match(name))
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return date(day.year + (day.month == 12), day.month % 12 + 1, 1)
+
+
+def _is_postgres():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def _month_table(month, metadata=None):
+    """SQLite-style archive table for ``month``, mirroring the attendance columns."""
+    name = f'attendance_{month.year:04d}_{month.month:02d}'
+    metadata = metadata or MetaData()
+    columns = [Column(column.name, column.type, primary_key=column.primary_key) for column in Attendance.__table__.c]
+    return Table(name, metadata, *columns, Index(f'ix_{name}_student_date', 'student_id', 'date'))
+
+
+def _ensure_postgres_parent():
+    db.session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_PARENT} (
+            id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            batch_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            present BOOLEAN NOT NULL,
+            notes TEXT,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        ) PARTITION BY RANGE (date)"""))
+    db.session.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{ARCHIVE_PARENT}_student_date '
+                            f'ON {ARCHIVE_PARENT} (student_id, date)'))
+
+
+def _ensure_postgres_partition(month):
+    name = f'{ARCHIVE_PARENT}_{month.year:04d}_{month.month:02d}'
+    db.session.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {ARCHIVE_PARENT} "
+                            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"))
+
+
+def _archive_version():
+    return db.session.execute(select(JobCheckpoint.value).where(JobCheckpoint.name == CHECKPOINT_NAME)).scalar()
+
+
+def _bump_archive_version():
+    checkpoint = db.session.get(JobCheckpoint, CHECKPOINT_NAME)
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(name=CHECKPOINT_NAME, value='')
+        db.session.add(checkpoint)
+    checkpoint.value = uuid.uuid4().hex
+
+
+def archived_months():
+    """First day of every month that has an archive table or partition, oldest first (cached per engine)."""
+    key = db.session.get_bind().url.render_as_string()
+    version = _archive_version()
+    cached = _months_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    months = set()
+    for name in inspect(db.session.connection()).get_table_names():
+        found = MONTH_TABLE.match(name)
+        if found:
+            months.add(date(int(found.group(1)), int(found.group(2)), 1))
+    months = sorted(months)
+    _months_cache[key] = (version, months)
+    return months
+
+
+def archive_cutoff(today=None, hot_days=None):
+    today = today or datetime.utcnow().date()
+    hot_days = current_app.config['ATTENDANCE_HOT_DAYS'] if hot_days is None else hot_days
+    return today - timedelta(days=hot_days)
+
+
+def archive_attendance(cutoff, dry_run=False):
+    """Move attendance dated before ``cutoff`` into monthly archives; returns ``{month: rows}``."""
+    hot = Attendance.__table__
+    oldest = db.session.execute(select(db.func.min(hot.c.date))).scalar()
+    moved = {}
+    if oldest is None or oldest >= cutoff:
+        return moved
+    postgres = _is_postgres()
+    if postgres and not dry_run:
+        _ensure_postgres_parent()
+
+    month = _month_start(oldest)
+    while month < cutoff:
+        end = min(_next_month(month), cutoff)
+        in_range = and_(hot.c.date >= month, hot.c.date < end)
+        if dry_run:
+            count = db.session.execute(select(db.func.count()).select_from(hot).where(in_range)).scalar()
+        elif postgres:
+            _ensure_postgres_partition(month)
+            columns = ', '.join(COLUMNS)
+            count = db.session.execute(text(
+                f'WITH moved AS (DELETE FROM attendance WHERE date >= :start AND date < :end RETURNING {columns}) '
+                f'INSERT INTO {ARCHIVE_PARENT} ({columns}) SELECT {columns} FROM moved'),
+                {'start': month, 'end': end}).rowcount
+        else:
+            archive = _month_table(month)
+            archive.create(db.session.connection(), checkfirst=True)
+            db.session.execute(archive.insert().from_select(list(COLUMNS), select(*(hot.c[c] for c in COLUMNS))
+                                                            .where(in_range)))
+            count = db.session.execute(hot.delete().where(in_range)).rowcount
+        if count:
+            moved[month] = count
+        if not dry_run:
+            _bump_archive_version()
+            db.session.commit()  # One transaction per month keeps locks short
+        month = _next_month(month)
+    return moved
+
+
+def _branch(table, since, until, student_id, batch_id):
+    stmt = select(*(table.c[c] for c in COLUMNS))
+    if since is not None:
+        stmt = stmt.where(table.c.date >= since)
+    if until is not None:
+        stmt = stmt.where(table.c.date <= until)
+    if student_id is not None:
+        stmt = stmt.where(table.c.student_id == student_id)
+    if batch_id is not None:
+        stmt = stmt.where(table.c.batch_id == batch_id)
+    return stmt
+
+
+def attendance_union(since=None, until=None, student_id=None, batch_id=None):
+    """Subquery of attendance rows across hot and archived data, filtered inside every branch.
+
+    Columns: ``id, student_id, batch_id, date, present, notes, created_at, updated_at``.
+    """
+    branches = [_branch(Attendance.__table__, since, until, student_id, batch_id)]
+    months = [month for month in archived_months()
+              if (since is None or _next_month(month) > since) and (until is None or month <= until)]
+    if months:
+        if _is_postgres():
+            # The planner prunes partitions outside the date predicates
+            parent = Table(ARCHIVE_PARENT, MetaData(), *(Column(c.name, c.type) for c in Attendance.__table__.c))
+            branches.append(_branch(parent, since, until, student_id, batch_id))
+        else:
+            metadata = MetaData()
+            branches.extend(_branch(_month_table(month, metadata), since, until, student_id, batch_id)
+                            for month in months)
+    if len(branches) == 1:
+        return branches[0].subquery('attendance_all')
+    return union_all(*branches).subquery('attendance_all')
+
+
+@click.command('archive-attendance')
+@click.option('--days', type=int, default=None, help='Keep this many days hot (default ATTENDANCE_HOT_DAYS).')
+@click.option('--dry-run', is_flag=True, help='Only report how many rows would move.')
+@with_appcontext
+def archive_attendance_command(days, dry_run):
+    """Move attendance older than the hot horizon into monthly archive partitions."""
+    cutoff = archive_cutoff(hot_days=days)
+    moved = archive_attendance(cutoff, dry_run=dry_run)
+    for month, count in moved.items():
+        click.echo(f'{month:%Y-%m}: {count} row(s){" would be" if dry_run else ""} archived')
+    click.echo(f'{sum(moved.values())} row(s) older than {cutoff} {"to archive" if dry_run else "archived"}.')
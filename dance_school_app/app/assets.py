@@ -0,0 +1,189 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask build-assets`` vendors Chart.js into ``static/vendor``, minifies the
+CSS/JS under ``static``, writes content-hashed copies to ``static/dist`` with
+``.gz`` (and ``.br`` when the optional ``brotli`` package is installed)
+variants next to them, and records the mapping in ``static/dist/manifest.json``.
+
+At runtime ``url_for('static', filename='css/custom.css')`` resolves to the
+hashed copy when the manifest is enabled, and hashed files are served with a
+far-future immutable ``Cache-Control`` and the best precompressed variant the
+client accepts. Without a build everything falls back to the plain files.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import urllib.request
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip variants are always built
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+CHARTJS_FILENAME = 'vendor/chart.umd.min.js'
+CHARTJS_CDN = 'https://cdn.jsdelivr.net/npm/chart.js@{version}/dist/chart.umd.min.js'
+SOURCE_DIRS = ('css', 'js', 'vendor')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Precompressed variants in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    return re.sub(r'\s*([{};,>])\s*', r'\1', text).replace(';}', '}').strip()
+
+
+def _minify_js(text):
+    """Conservative JS minification: drop indentation, blank lines and whole-line comments.
+
+    Anything that needs a real parser (renaming, joining statements) is left
+    alone, so string and regex literals are never touched.
+    """
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+def _minify(relative_path, data):
+    if relative_path.startswith('vendor/') or '.min.' in relative_path:
+        return data
+    if relative_path.endswith('.css'):
+        return _minify_css(data.decode('utf-8')).encode('utf-8')
+    if relative_path.endswith('.js'):
+        return _minify_js(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def vendor_chartjs(static_folder, version, source=None, refresh=False):
+    """Copy or download Chart.js into ``static/vendor``; returns the destination path."""
+    destination = os.path.join(static_folder, CHARTJS_FILENAME)
+    if os.path.exists(destination) and not refresh and source is None:
+        return destination
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if source:
+        shutil.copyfile(source, destination)
+    else:
+        with urllib.request.urlopen(CHARTJS_CDN.format(version=version), timeout=30) as response, \
+                open(destination, 'wb') as out:
+            shutil.copyfileobj(response, out)
+    return destination
+
+
+def build_assets(static_folder):
+    """Minify, fingerprint and precompress static files; returns the manifest mapping."""
+    dist_root = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist_root):
+        shutil.rmtree(dist_root)
+
+    manifest = {}
+    for source_dir in SOURCE_DIRS:
+        source_root = os.path.join(static_folder, source_dir)
+        if not os.path.isdir(source_root):
+            continue
+        for folder, _, files in os.walk(source_root):
+            for name in sorted(files):
+                if not name.endswith(('.css', '.js')):
+                    continue
+                path = os.path.join(folder, name)
+                relative = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = _minify(relative, f.read())
+
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                stem, ext = os.path.splitext(relative)
+                hashed = f'{DIST_DIR}/{stem}.{digest}{ext}'
+                target = os.path.join(static_folder, hashed)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f:
+                    f.write(data)
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+                manifest[relative] = hashed
+
+    os.makedirs(dist_root, exist_ok=True)
+    with open(os.path.join(dist_root, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def send_fingerprinted(filename):
+    """Serve a hashed file with immutable caching and the best precompressed variant accepted."""
+    static_folder = current_app.static_folder
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(static_folder, filename, mimetype=mimetype)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Hook the manifest into ``url_for('static', ...)`` and the static file view."""
+    manifest = load_manifest(app.static_folder) if app.config['ASSETS_USE_MANIFEST'] else {}
+    app.extensions['assets_manifest'] = manifest
+
+    if manifest:
+        @app.url_defaults
+        def fingerprint_static_urls(endpoint, values):
+            if endpoint == 'static' and values.get('filename') in manifest:
+                values['filename'] = manifest[values['filename']]
+
+    serve_static = app.view_functions['static']
+
+    def static(filename):
+        if filename.startswith(DIST_DIR + '/'):
+            return send_fingerprinted(filename)
+        return serve_static(filename=filename)
+
+    app.view_functions['static'] = static
+
+    @app.template_global()
+    def chartjs_url():
+        """Local Chart.js once vendored by ``flask build-assets``, otherwise the CDN copy."""
+        if os.path.isfile(os.path.join(app.static_folder, CHARTJS_FILENAME)):
+            return url_for('static', filename=CHARTJS_FILENAME)
+        return CHARTJS_CDN.format(version=app.config['CHARTJS_VERSION'])
+
+
+@click.command('build-assets')
+@click.option('--chartjs', 'chartjs_source', type=click.Path(exists=True, dir_okay=False),
+              help='Vendor Chart.js from this local file instead of downloading it.')
+@click.option('--refresh-vendor', is_flag=True, help='Download Chart.js again even if already vendored.')
+@with_appcontext
+def build_assets_command(chartjs_source, refresh_vendor):
+    """Vendor Chart.js and build fingerprinted, precompressed static assets."""
+    static_folder = current_app.static_folder
+    try:
+        vendor_chartjs(static_folder, current_app.config['CHARTJS_VERSION'],
+                       source=chartjs_source, refresh=refresh_vendor)
+    except OSError as exc:
+        click.echo(f'Could not vendor Chart.js ({exc}); pages will keep using the CDN.', err=True)
+    manifest = build_assets(static_folder)
+    click.echo(f'Built {len(manifest)} asset(s){" with" if brotli else " without"} brotli variants.')
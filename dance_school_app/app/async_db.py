@@ -0,0 +1,95 @@
+"""Async database access for the async views.
+
+``AsyncDatabase`` runs the same SQLAlchemy Core statements the sync views use,
+on an async engine derived from the current branch's database URL (``sqlite``
+runs on ``aiosqlite``, ``postgresql`` on ``asyncpg``); each branch gets its own
+engine, created on first use. ``gather`` runs independent
+statements concurrently, each on its own connection, so a dashboard's summary
+cards cost roughly the slowest query instead of the sum of all of them.
+
+Flask runs every async view in a fresh event loop, and asyncpg connections
+cannot outlive the loop that opened them, so the engine uses ``NullPool``;
+keep PgBouncer (or similar) in front of PostgreSQL to make connects cheap.
+
+Without ``sqlalchemy[asyncio]`` or a driver for the configured database the
+statements run on the regular engine in worker threads (``asyncio.to_thread``),
+which still overlaps them.
+"""
+import asyncio
+import importlib.util
+import logging
+import threading
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+from app.sharding import current_branch, database_url, engine_for
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:  # greenlet missing: sqlalchemy[asyncio] not installed
+    create_async_engine = None
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {'sqlite': ('aiosqlite', 'sqlite+aiosqlite'), 'postgresql': ('asyncpg', 'postgresql+asyncpg')}
+
+
+def async_url(url):
+    """The async-driver equivalent of ``url``, or None if no async driver is installed for it."""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if create_async_engine is None or driver is None or importlib.util.find_spec(driver[0]) is None:
+        return None
+    return url.set(drivername=driver[1])
+
+
+class AsyncDatabase:
+    """Executes Core statements from async views, natively or on threads as a fallback."""
+
+    def __init__(self, app):
+        self.app = app
+        self._engines = {}  # Branch code -> async engine, or None to use threads
+        self._lock = threading.Lock()
+
+    def engine(self, branch):
+        with self._lock:
+            if branch not in self._engines:
+                url = async_url(database_url(branch))
+                self._engines[branch] = create_async_engine(url, poolclass=NullPool) if url is not None else None
+                if url is None:
+                    logger.info('No async database driver for branch %s; async views run queries on threads', branch)
+            return self._engines[branch]
+
+    async def fetch_all(self, stmt):
+        branch = current_branch()
+        engine = self.engine(branch)
+        if engine is None:
+            return await asyncio.to_thread(self._fetch_all_sync, branch, stmt)
+        async with engine.connect() as conn:
+            return (await conn.execute(stmt)).all()
+
+    async def fetch_scalar(self, stmt):
+        branch = current_branch()
+        engine = self.engine(branch)
+        if engine is None:
+            return await asyncio.to_thread(self._fetch_scalar_sync, branch, stmt)
+        async with engine.connect() as conn:
+            return (await conn.execute(stmt)).scalar_one()
+
+    async def gather(self, statements):
+        """Run ``{name: scalar statement}`` concurrently; returns ``{name: value}``."""
+        values = await asyncio.gather(*(self.fetch_scalar(stmt) for stmt in statements.values()))
+        return dict(zip(statements, values))
+
+    def _fetch_all_sync(self, branch, stmt):
+        with self.app.app_context(), engine_for(branch).connect() as conn:
+            return conn.execute(stmt).all()
+
+    def _fetch_scalar_sync(self, branch, stmt):
+        with self.app.app_context(), engine_for(branch).connect() as conn:
+            return conn.execute(stmt).scalar_one()
+
+
+def init_app(app):
+    app.extensions['async_db'] = AsyncDatabase(app)
@@ -0,0 +1,111 @@
+"""Async versions of the report exports, dashboard data and JSON API views.
+
+With ``ASYNC_VIEWS`` enabled (and ``flask[async]`` installed), ``init_app``
+replaces the sync view functions of these ``main`` endpoints with the
+coroutines below. Routes, URLs, decorators and responses stay the same: the
+statements come from ``app.read_models`` and ``app.charts``, the response
+builders from ``app.routes``, and only the query execution moves to
+``app.async_db``. ``/api/dashboard/summary`` runs its card counts
+concurrently.
+
+Flask still gives each request its own thread and runs the coroutine to
+completion inside it, so the gain is concurrency within a request rather than
+more requests per worker; serve the app with ``python serve.py`` as usual, or
+behind an ASGI server through ``asgi.py``.
+"""
+import logging
+
+from flask import current_app, jsonify
+from flask_login import current_user, login_required
+
+from app import async_db, charts, read_models, routes
+from app.routes import role_required
+
+try:
+    import asgiref
+except ImportError:
+    asgiref = None
+
+logger = logging.getLogger(__name__)
+
+
+def _db():
+    return current_app.extensions['async_db']
+
+
+async def _chart(query):
+    return routes.chart_response(query.shape(await _db().fetch_all(query.stmt)))
+
+
+@login_required
+@role_required(['admin'])
+async def export_students():
+    rows = await _db().fetch_all(read_models.student_query())
+    return routes.students_csv([read_models.StudentRow._make(row) for row in rows])
+
+
+@login_required
+@role_required(['admin'])
+async def export_attendance():
+    rows = await _db().fetch_all(read_models.attendance_query())
+    return routes.attendance_csv([read_models.AttendanceRow._make(row) for row in rows])
+
+
+@login_required
+async def get_batch_fee(batch_id):
+    rows = await _db().fetch_all(read_models.batch_query(batch_id))
+    return routes.batch_fee_json(read_models.BatchRow._make(rows[0]) if rows else None)
+
+
+@login_required
+async def get_all_batches():
+    rows = await _db().fetch_all(read_models.batch_query())
+    return routes.batches_json([read_models.BatchRow._make(row) for row in rows])
+
+
+@login_required
+async def dashboard_summary():
+    return jsonify(await _db().gather(charts.counts_for(current_user)))
+
+
+@login_required
+async def chart_students_by_class():
+    return await _chart(routes.students_by_class_query())
+
+
+@login_required
+async def chart_payments_by_status():
+    return await _chart(routes.payments_by_status_query())
+
+
+@login_required
+async def chart_students_per_batch():
+    return await _chart(routes.students_per_batch_query())
+
+
+@login_required
+async def chart_attendance_summary():
+    return await _chart(routes.attendance_summary_query())
+
+
+@login_required
+async def chart_attendance_30_days():
+    return await _chart(routes.attendance_30_days_query())
+
+
+ASYNC_VIEWS = {f'main.{view.__name__}': view for view in (
+    export_students, export_attendance, get_batch_fee, get_all_batches, dashboard_summary,
+    chart_students_by_class, chart_payments_by_status, chart_students_per_batch, chart_attendance_summary,
+    chart_attendance_30_days)}
+
+
+def init_app(app):
+    """Swap in the async views when ``ASYNC_VIEWS`` is set; call after the blueprint is registered."""
+    if not app.config['ASYNC_VIEWS']:
+        return
+    if asgiref is None:
+        logger.warning('ASYNC_VIEWS is set but asgiref is missing (pip install "flask[async]"); keeping sync views')
+        return
+    async_db.init_app(app)
+    for endpoint, view in ASYNC_VIEWS.items():
+        app.view_functions[endpoint] = view
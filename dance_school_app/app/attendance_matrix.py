@@ -0,0 +1,206 @@
+"""Monthly attendance register per batch.
+
+``build`` pivots one batch-month into a dense students x class-dates matrix.
+- Students are the current roster plus anyone with attendance that month,
+  ordered by name.
+- Dates are the days the timetable schedules the batch (``BatchSlot``) plus
+  any day with recorded attendance.
+- Cells are 1 (present), 0 (absent) or -1 (nothing recorded).
+
+The rows come from one query, a ``UNION ALL`` of the roster and the month's
+attendance (archived months included, see ``app.archive``). They are read
+into NumPy arrays and placed with ``searchsorted`` and one fancy-indexed
+assignment; row and column totals are array reductions.
+
+Matrices are cached as JSON in the fragment cache. The key includes a
+version read from the database: one aggregate query over indexed columns
+counts the batch-month's attendance and roster rows, takes their latest
+``updated_at`` and that of ``student``, and folds the batch's timetable
+weekdays into a bitmask. Any write that changes the register, whichever
+worker, process or bulk statement made it, therefore yields a new key, and
+stale entries are never read again.
+"""
+import csv
+import io
+import hashlib
+import json
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from flask import current_app
+from sqlalchemy import Integer, cast, distinct, func, literal, null, select, union_all
+
+from app import db
+from app.archive import attendance_union
+from app.models import BatchSlot, Student, StudentBatch
+from app.sharding import current_branch
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX export is optional
+    Workbook = None
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def scheduled_dates(weekdays, month):
+    """Every date in ``month`` falling on one of ``weekdays`` (0 = Monday)."""
+    days = np.arange(np.datetime64(month, 'D'), np.datetime64(month_end(month), 'D') + 1)
+    weekday = (days.astype(np.int64) - 4) % 7  # 1970-01-01 was a Thursday
+    return days[np.isin(weekday, list(weekdays))]
+
+
+class AttendanceMatrix:
+    """Students x dates register for one batch-month with per-row and per-column totals."""
+
+    def __init__(self, batch_id, month, student_ids, student_names, dates, cells):
+        self.batch_id = batch_id
+        self.month = month
+        self.student_ids = student_ids
+        self.student_names = student_names
+        self.dates = dates  # datetime64[D]
+        self.cells = cells  # int8: 1 present, 0 absent, -1 not recorded
+        present = cells == 1
+        recorded = cells >= 0
+        self.row_present = present.sum(axis=1)
+        self.row_recorded = recorded.sum(axis=1)
+        self.col_present = present.sum(axis=0)
+        self.col_recorded = recorded.sum(axis=0)
+
+    @property
+    def date_list(self):
+        return [day.item() for day in self.dates]
+
+    def rows(self):
+        """``(student_id, name, cells, present, recorded)`` per student, for templates and exports."""
+        for i, student_id in enumerate(self.student_ids):
+            yield (int(student_id), self.student_names[i], self.cells[i].tolist(),
+                   int(self.row_present[i]), int(self.row_recorded[i]))
+
+    def to_dict(self):
+        return {
+            'batch_id': self.batch_id,
+            'month': self.month.strftime('%Y-%m'),
+            'dates': [day.isoformat() for day in self.date_list],
+            'students': [{'id': student_id, 'name': name, 'cells': cells, 'present': present, 'recorded': recorded}
+                         for student_id, name, cells, present, recorded in self.rows()],
+            'column_present': self.col_present.tolist(),
+            'column_recorded': self.col_recorded.tolist(),
+            'total_present': int(self.row_present.sum()),
+            'total_recorded': int(self.row_recorded.sum()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        students = data['students']
+        dates = np.array(data['dates'], dtype='datetime64[D]')
+        cells = np.array([student['cells'] for student in students], dtype=np.int8).reshape(len(students), len(dates))
+        return cls(data['batch_id'], date.fromisoformat(data['month'] + '-01'),
+                   np.array([student['id'] for student in students], dtype=np.int64),
+                   [student['name'] for student in students], dates, cells)
+
+    def _header(self):
+        return ['Student ID', 'Student', *(day.strftime('%d %a') for day in self.date_list), 'Present', 'Recorded']
+
+    def _export_rows(self):
+        symbols = {1: 'P', 0: 'A', -1: ''}
+        yield self._header()
+        for student_id, name, cells, present, recorded in self.rows():
+            yield [student_id, name, *(symbols[cell] for cell in cells), present, recorded]
+        yield ['', 'Present', *self.col_present.tolist(), int(self.row_present.sum()), int(self.row_recorded.sum())]
+
+    def iter_csv(self):
+        """CSV text, one line at a time (for a streamed response)."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in self._export_rows():
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def to_xlsx(self):
+        """XLSX workbook bytes, or None without openpyxl."""
+        if Workbook is None:
+            return None
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(self.month.strftime('%Y-%m'))
+        for row in self._export_rows():
+            sheet.append(row)
+        output = io.BytesIO()
+        workbook.save(output)
+        return output.getvalue()
+
+
+def _register_query(batch_id, month):
+    attendance = attendance_union(since=month, until=month_end(month), batch_id=batch_id)
+    # One value column: presence as 0/1 for attendance rows, the weekday for timetable rows
+    recorded = select(attendance.c.student_id, Student.full_name, attendance.c.date, cast(attendance.c.present, Integer)) \
+        .join(Student, attendance.c.student_id == Student.id)
+    roster = select(StudentBatch.student_id, Student.full_name, null(), null()) \
+        .join(Student, StudentBatch.student_id == Student.id) \
+        .where(StudentBatch.batch_id == batch_id)
+    scheduled = select(literal(None), literal(None), null(), BatchSlot.weekday) \
+        .where(BatchSlot.batch_id == batch_id)
+    return union_all(recorded, roster, scheduled)
+
+
+def build(batch_id, month):
+    """Pivot one batch-month from a single query."""
+    frame = pd.read_sql(_register_query(batch_id, month), db.session.connection())
+    frame.columns = ['student_id', 'name', 'date', 'value']
+    weekdays = frame.loc[frame['student_id'].isna() & frame['value'].notna(), 'value'].astype(int).unique()
+    people = frame[frame['student_id'].notna()]
+    records = people[people['date'].notna()]
+
+    students = people.drop_duplicates('student_id').sort_values(['name', 'student_id'])
+    student_ids = students['student_id'].to_numpy(dtype=np.int64)
+    record_dates = pd.to_datetime(records['date']).to_numpy().astype('datetime64[D]')
+    dates = np.union1d(scheduled_dates(weekdays, month), record_dates)
+
+    cells = np.full((len(student_ids), len(dates)), -1, dtype=np.int8)
+    if len(records):
+        order = np.argsort(student_ids)
+        rows = order[np.searchsorted(student_ids, records['student_id'].to_numpy(dtype=np.int64), sorter=order)]
+        cells[rows, np.searchsorted(dates, record_dates)] = records['value'].to_numpy().astype(bool)
+    return AttendanceMatrix(batch_id, month, student_ids, students['name'].tolist(), dates, cells)
+
+
+def _version_query(batch_id, month):
+    attendance = attendance_union(since=month, until=month_end(month), batch_id=batch_id)
+    in_batch = StudentBatch.batch_id == batch_id
+    weekday_bit = literal(1, Integer).op('<<', return_type=Integer)(BatchSlot.weekday)
+    return select(func.count(attendance.c.id), func.max(attendance.c.updated_at),
+                  select(func.count(StudentBatch.id)).where(in_batch).scalar_subquery(),
+                  select(func.max(StudentBatch.updated_at)).where(in_batch).scalar_subquery(),
+                  # Any renamed student, not just this register's: one index lookup instead of a join
+                  select(func.max(Student.updated_at)).scalar_subquery(),
+                  select(func.coalesce(func.sum(distinct(weekday_bit)), 0))
+                  .where(BatchSlot.batch_id == batch_id).scalar_subquery())
+
+
+def version(batch_id, month):
+    """Digest of everything the batch-month's register is built from, read in one query."""
+    row = db.session.execute(_version_query(batch_id, month)).one()
+    return hashlib.sha1(repr(tuple(row)).encode('utf-8')).hexdigest()[:16]
+
+
+def cached(batch_id, month):
+    """The batch-month matrix, from the cache unless its data changed since it was built."""
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is None:
+        return build(batch_id, month)
+    key = f'attendance_matrix:{current_branch()}:{batch_id}:{month:%Y-%m}:{version(batch_id, month)}'
+    data = cache.get(key)
+    if data is not None:
+        return AttendanceMatrix.from_dict(json.loads(data))
+    matrix = build(batch_id, month)
+    cache.set(key, json.dumps(matrix.to_dict()), current_app.config['ATTENDANCE_MATRIX_CACHE_SECONDS'])
+    return matrix
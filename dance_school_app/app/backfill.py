@@ -0,0 +1,210 @@
+"""Batched, resumable backfills for large tables.
+
+A ``Backfill`` updates a table in keyset-ordered chunks (``key > last``, then
+``ORDER BY key LIMIT n``) with one short transaction per chunk, so no chunk
+holds row locks for long and an ``attendance`` or ``payment`` backfill over
+millions of rows never blocks the app. After each chunk the last key done,
+the rows changed and the key range are saved in ``job_checkpoint`` under
+``backfill:<name>``, in the same transaction as the chunk. A run that is
+interrupted (crash, deploy, Ctrl-C, ``--max-seconds``) resumes after the last
+committed chunk.
+
+The chunk size adapts so that each chunk takes about
+``BACKFILL_TARGET_SECONDS``, and the runner sleeps ``BACKFILL_PAUSE`` seconds
+between chunks to leave room for application traffic. Rows are handled up to
+the largest key that existed when the run started; rows inserted after that
+are expected to be written correctly by the application already.
+
+Declare backfills in the Alembic revision that needs them, in a revision of
+their own after the one that adds the column::
+
+    from app.backfill import Backfill
+
+    attendance = sa.table('attendance', sa.column('id'), sa.column('source'))
+    attendance_source = Backfill('attendance_source', attendance, values={'source': 'staff'},
+                                 where=attendance.c.source.is_(None))
+
+    def upgrade():
+        attendance_source.run_in_migration(op)
+
+``flask db upgrade`` then runs it in chunks (re-running the upgrade after a
+crash resumes it), and ``flask backfill run attendance_source`` runs or
+resumes it on its own, e.g. ahead of a deploy. Backfills should be
+idempotent (``where`` excludes rows already done), since a run restarted with
+``--restart`` starts from the first key again.
+"""
+import json
+import logging
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select, update
+
+from app import db
+from app.models import JobCheckpoint
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PREFIX = 'backfill:'
+MIN_CHUNK_SIZE = 10
+
+BACKFILLS = {}  # Name -> Backfill, filled as revisions declaring backfills are imported
+
+
+class Backfill:
+    """Sets ``values`` on rows of ``table`` matching ``where``, one key range at a time.
+
+    For anything more involved than a single UPDATE per chunk, subclass and
+    override ``apply``.
+    """
+
+    def __init__(self, name, table, values=None, where=None, key='id'):
+        self.name = name
+        self.table = table
+        self.values = values or {}
+        self.where = where
+        self.key = table.c[key]
+        BACKFILLS[name] = self
+
+    def _criteria(self, lower, upper):
+        criteria = [self.key <= upper]
+        if lower is not None:  # None before the first chunk
+            criteria.append(self.key > lower)
+        if self.where is not None:
+            criteria.append(self.where)
+        return criteria
+
+    def apply(self, connection, lower, upper):
+        """Backfill rows with ``lower < key <= upper``; returns the number of rows changed."""
+        return connection.execute(update(self.table).where(*self._criteria(lower, upper)).values(self.values)).rowcount
+
+    def _next_upper(self, connection, lower, last_key, size):
+        """Key closing the next chunk of up to ``size`` pending rows after ``lower``, or None when done."""
+        keys = select(self.key).where(*self._criteria(lower, last_key)).order_by(self.key).limit(size).subquery()
+        return connection.execute(select(func.max(keys.c[0]))).scalar()
+
+    def run(self, connection, chunk_size=1000, pause=0.0, target_seconds=0.5, max_seconds=None, restart=False,
+            progress=None):
+        """Process chunks on ``connection`` until done or ``max_seconds`` pass; returns the saved state."""
+        with connection.begin():
+            state = None if restart else load_state(connection, self.name)
+            if state is None:
+                high = connection.execute(select(func.max(self.key))).scalar()
+                state = {'last': None, 'max': high, 'rows': 0, 'chunks': 0, 'done': high is None}
+                if state['done']:  # Empty table: record it so ``backfill list`` shows it finished
+                    save_state(connection, self.name, state)
+        if state['done']:
+            return state
+        started = time.monotonic()
+        size = chunk_size
+        while not state['done']:
+            if max_seconds is not None and time.monotonic() - started >= max_seconds:
+                break
+            chunk_started = time.monotonic()
+            with connection.begin():
+                upper = self._next_upper(connection, state['last'], state['max'], size)
+                if upper is None:
+                    state['done'] = True
+                else:
+                    state['rows'] += self.apply(connection, state['last'], upper)
+                    state['last'] = upper
+                    state['chunks'] += 1
+                save_state(connection, self.name, state)
+            elapsed = time.monotonic() - chunk_started
+            if progress is not None:
+                progress(state, size, elapsed)
+            # Keep chunk transactions near the target duration
+            if elapsed > target_seconds:
+                size = max(MIN_CHUNK_SIZE, size // 2)
+            elif elapsed < target_seconds / 4:
+                size = min(chunk_size * 10, size * 2)
+            if pause and not state['done']:
+                time.sleep(pause)
+        return state
+
+    def run_in_migration(self, op, **options):
+        """Run from an Alembic revision, committing chunk by chunk instead of holding the migration transaction."""
+        context = op.get_context()
+        if context.as_sql:
+            logger.warning('Offline migration: run "flask backfill run %s" against the database instead', self.name)
+            return None
+        config = current_app.config
+        options = {'chunk_size': config['BACKFILL_CHUNK_SIZE'], 'pause': config['BACKFILL_PAUSE'],
+                   'target_seconds': config['BACKFILL_TARGET_SECONDS'], **options}
+        # Commits the revisions applied so far; chunks then run on their own connection
+        with context.autocommit_block(), op.get_bind().engine.connect() as connection:
+            return self.run(connection, progress=_log_progress(self.name), **options)
+
+
+def load_state(connection, name):
+    table = JobCheckpoint.__table__
+    value = connection.execute(select(table.c.value).where(table.c.name == CHECKPOINT_PREFIX + name)).scalar()
+    return json.loads(value) if value else None
+
+
+def save_state(connection, name, state):
+    table = JobCheckpoint.__table__
+    values = {'value': json.dumps(state), 'updated_at': datetime.utcnow()}
+    if connection.execute(update(table).where(table.c.name == CHECKPOINT_PREFIX + name).values(values)).rowcount == 0:
+        connection.execute(insert(table).values(name=CHECKPOINT_PREFIX + name, **values))
+
+
+def _describe(state, size=None, elapsed=None):
+    done = 'done' if state['done'] else f"at key {state['last']} of {state['max']}"
+    chunk = f', chunk of {size} took {elapsed:.2f}s' if size is not None else ''
+    return f"{state['rows']} row(s) in {state['chunks']} chunk(s), {done}{chunk}"
+
+
+def _log_progress(name):
+    def report(state, size, elapsed):
+        logger.info('Backfill %s: %s', name, _describe(state, size, elapsed))
+    return report
+
+
+def load_backfills():
+    """Import every migration revision so the backfills they declare are registered."""
+    from alembic.script import ScriptDirectory
+    script = ScriptDirectory.from_config(current_app.extensions['migrate'].migrate.get_config())
+    for _ in script.walk_revisions():  # Building the revision map imports each revision file
+        pass
+    return BACKFILLS
+
+
+@click.group('backfill')
+def backfill_command():
+    """Run, resume and inspect batched backfills."""
+
+
+@backfill_command.command('list')
+@with_appcontext
+def list_command():
+    """Show every backfill declared in the migrations and its progress."""
+    with db.session.get_bind().connect() as connection:
+        for name in sorted(load_backfills()):
+            state = load_state(connection, name)
+            click.echo(f'{name}: {_describe(state) if state else "not started"}')
+
+
+@backfill_command.command('run')
+@click.argument('name')
+@click.option('--chunk-size', type=int, default=None, help='Initial rows per chunk (default BACKFILL_CHUNK_SIZE).')
+@click.option('--pause', type=float, default=None, help='Seconds to sleep between chunks (default BACKFILL_PAUSE).')
+@click.option('--max-seconds', type=float, default=None, help='Stop after this long; the next run resumes.')
+@click.option('--restart', is_flag=True, help='Ignore saved progress and start from the first key.')
+@with_appcontext
+def run_command(name, chunk_size, pause, max_seconds, restart):
+    """Run or resume one backfill on the current branch's database."""
+    backfill = load_backfills().get(name)
+    if backfill is None:
+        raise click.BadParameter(f'Unknown backfill {name!r}.', param_hint='NAME')
+    config = current_app.config
+    with db.session.get_bind().connect() as connection:
+        state = backfill.run(connection, chunk_size=chunk_size or config['BACKFILL_CHUNK_SIZE'],
+                             pause=config['BACKFILL_PAUSE'] if pause is None else pause,
+                             target_seconds=config['BACKFILL_TARGET_SECONDS'], max_seconds=max_seconds,
+                             restart=restart,
+                             progress=lambda state, size, elapsed: click.echo(_describe(state, size, elapsed)))
+    click.echo(json.dumps(state))
@@ -0,0 +1,179 @@
+"""Incremental change feed for warehouse sync.
+
+``student``, ``batch``, ``student_batch``, ``attendance`` and ``payment`` carry
+``created_at``/``updated_at`` (indexed). The feed walks each table in
+``(updated_at, id)`` order and returns rows changed after a cursor, one page at
+a time; the cursor is an opaque URL-safe token recording the last
+``(updated_at, id)`` seen per table.
+
+Deletes are reported from ``deleted_row`` tombstones, under ``deleted`` as
+``{"table", "id", "deleted_at"}`` after the table pages. Tombstones are
+written in the deleting transaction for ORM deletes, both ``session.delete``
+and bulk ``delete(Model)`` statements (e.g. ``enrollment.transfer``). Core
+deletes against the table are not recorded. Attendance moved out by ``flask
+archive-attendance`` is therefore not reported as deleted; archived rows never
+change again.
+
+``updated_at`` is stamped when a row is written, not when its transaction
+commits, so a slow transaction can commit rows older than a cursor that has
+already moved past them. Rows are only emitted once they are
+``CHANGE_FEED_LAG_SECONDS`` old. Each new pull also starts every table
+``CHANGE_FEED_OVERLAP_SECONDS`` before its cursor position, so rows committed
+within that window are still delivered. Rows in the window are sent again;
+consumers upsert by id. Pages within one pull (``has_more`` true) continue
+exactly where the previous page stopped.
+
+Consumers poll ``/api/changes?since=<cursor>`` (admin login) until
+``has_more`` is false, or run ``flask export-changes --cursor-file ...``
+nightly, which appends JSON Lines and stores the next cursor.
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, event, insert, literal, or_, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Student, Batch, StudentBatch, Attendance, Payment, DeletedRow
+
+FEED_MODELS = (Student, Batch, StudentBatch, Attendance, Payment)
+FEED_TABLES = {model.__tablename__: model.__table__ for model in FEED_MODELS}
+TOMBSTONES = DeletedRow.__table__
+
+
+class CursorError(ValueError):
+    """Raised for a change-feed cursor that cannot be decoded."""
+
+
+def encode_cursor(positions, pulled=()):
+    """``{table: (stamp, id)}`` and the tables already read in the current pull to an opaque token."""
+    payload = {'positions': {table: [stamp.isoformat(), row_id] for table, (stamp, row_id) in positions.items()},
+               'pulled': sorted(pulled)}
+    return base64.urlsafe_b64encode(json.dumps(payload, sort_keys=True).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Return ``(positions, pulled)`` from a token; an empty token starts from the beginning."""
+    if not token:
+        return {}, set()
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        positions = {table: (datetime.fromisoformat(stamp), int(row_id))
+                     for table, (stamp, row_id) in payload['positions'].items()
+                     if table in FEED_TABLES or table == TOMBSTONES.name}
+        return positions, set(payload['pulled'])
+    except (binascii.Error, ValueError, TypeError, AttributeError, KeyError):
+        raise CursorError('Invalid change cursor.')
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _tombstone(row):
+    return {'table': row['table_name'], 'id': row['row_id'], 'deleted_at': row['deleted_at'].isoformat()}
+
+
+def changes_since(cursor=None, limit=1000):
+    """Return ``(changes, next_cursor, has_more)`` for up to ``limit`` changed rows.
+
+    ``changes`` maps table name to a list of row dicts, plus ``deleted`` for
+    tombstones; tables are drained in a fixed order, each in ``(updated_at,
+    id)`` order.
+    """
+    positions, pulled = decode_cursor(cursor)
+    config = current_app.config
+    horizon = datetime.utcnow() - timedelta(seconds=config['CHANGE_FEED_LAG_SECONDS'])
+    overlap = timedelta(seconds=config['CHANGE_FEED_OVERLAP_SECONDS'])
+    streams = [(name, table, table.c.updated_at) for name, table in FEED_TABLES.items()]
+    streams.append((TOMBSTONES.name, TOMBSTONES, TOMBSTONES.c.deleted_at))
+    changes, remaining, has_more = {}, limit, False
+    for name, table, stamp_column in streams:
+        if remaining == 0:
+            has_more = True
+            break
+        stmt = select(table).where(stamp_column < horizon).order_by(stamp_column, table.c.id).limit(remaining + 1)
+        if name in positions:
+            stamp, row_id = positions[name]
+            if name in pulled:
+                stmt = stmt.where(or_(stamp_column > stamp, and_(stamp_column == stamp, table.c.id > row_id)))
+            else:  # First page of this table in a new pull: re-read the overlap window
+                stmt = stmt.where(stamp_column >= stamp - overlap)
+        pulled.add(name)
+        rows = db.session.execute(stmt).mappings().all()
+        if len(rows) > remaining:
+            rows, has_more = rows[:remaining], True
+        if rows:
+            if table is TOMBSTONES:
+                changes['deleted'] = [_tombstone(row) for row in rows]
+            else:
+                changes[name] = [{key: _jsonable(value) for key, value in row.items()} for row in rows]
+            positions[name] = (rows[-1][stamp_column.name], rows[-1]['id'])
+            remaining -= len(rows)
+        if has_more:
+            break
+    return changes, encode_cursor(positions, pulled if has_more else ()), has_more
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_deletes(session, flush_context):
+    rows = [{'table_name': obj.__tablename__, 'row_id': obj.id, 'deleted_at': datetime.utcnow()}
+            for obj in session.deleted if isinstance(obj, FEED_MODELS)]
+    if rows:
+        session.connection().execute(insert(TOMBSTONES), rows)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _record_bulk_deletes(orm_execute_state):
+    # Core deletes are left alone: attendance archival moves rows rather than deleting them
+    if not (orm_execute_state.is_delete and orm_execute_state.is_orm_statement):
+        return
+    statement = orm_execute_state.statement
+    table = statement.table
+    if table.name not in FEED_TABLES:
+        return
+    doomed = select(literal(table.name), table.c.id, literal(datetime.utcnow()))
+    if statement.whereclause is not None:
+        doomed = doomed.where(statement.whereclause)
+    orm_execute_state.session.execute(insert(TOMBSTONES).from_select(['table_name', 'row_id', 'deleted_at'], doomed))
+
+
+@click.command('export-changes')
+@click.option('--since', 'cursor', default=None, help='Cursor from the previous export (default: everything).')
+@click.option('--cursor-file', type=click.Path(dir_okay=False),
+              help='Read the starting cursor from this file and write the next cursor back on success.')
+@click.option('--output', type=click.File('a', encoding='utf-8'), default='-',
+              help='Append JSON Lines ({"table": ..., "row": {...}} or {"table": ..., "deleted": id}) here '
+                   '(default stdout).')
+@click.option('--page-size', type=int, default=None, help='Rows per page (default CHANGE_FEED_PAGE_SIZE).')
+@with_appcontext
+def export_changes_command(cursor, cursor_file, output, page_size):
+    """Export rows changed since a cursor as JSON Lines."""
+    if cursor is None and cursor_file and os.path.exists(cursor_file):
+        with open(cursor_file, encoding='utf-8') as f:
+            cursor = f.read().strip() or None
+    page_size = page_size or current_app.config['CHANGE_FEED_PAGE_SIZE']
+    total = 0
+    while True:
+        changes, cursor, has_more = changes_since(cursor, page_size)
+        for table, rows in changes.items():
+            for row in rows:
+                if table == 'deleted':
+                    line = {'table': row['table'], 'deleted': row['id']}
+                else:
+                    line = {'table': table, 'row': row}
+                output.write(json.dumps(line) + '\n')
+            total += len(rows)
+        if not has_more:
+            break
+    output.flush()
+    if cursor_file:
+        with open(cursor_file, 'w', encoding='utf-8') as f:
+            f.write(cursor)
+    click.echo(f'{total} changed row(s); next cursor: {cursor}', err=True)
@@ -0,0 +1,135 @@
+"""Dashboard chart and summary-card data.
+
+Each chart function builds a single aggregate statement and returns it as a
+``ChartQuery`` together with the function that shapes its rows into
+``{'labels': [...], 'data': [...]}``; ``run`` executes one on the request's
+session and ``app.async_views`` executes the same statements on the async
+engine. The dashboards render without any chart data and fetch each panel from
+its ``/api/charts/*`` endpoint, so a slow aggregate only delays its own panel.
+
+``counts_for`` returns the independent scalar statements behind a user's
+summary cards, keyed by card. ``run_counts`` runs them one after another; the
+async path runs them concurrently.
+"""
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple
+
+from sqlalchemy import Select, func, select
+
+from app import db
+from app.archive import archive_cutoff, attendance_union
+from app.models import Student, Staff, Batch, StudentBatch, Attendance, Payment, StudentBalance, \
+    OPEN_PAYMENT_STATUSES
+
+
+class ChartQuery(NamedTuple):
+    """An aggregate statement and the function turning its rows into chart data."""
+    stmt: Select
+    shape: Callable
+
+
+def _series(rows):
+    return {'labels': [row[0] for row in rows], 'data': [row[1] for row in rows]}
+
+
+def _present_absent(rows):
+    return _series([('Present' if present else 'Absent', count) for present, count in rows])
+
+
+def _daily_presence(rows):
+    return _series([(day.strftime('%Y-%m-%d'), 1 if present else 0) for day, present in rows])
+
+
+def run(query):
+    return query.shape(db.session.execute(query.stmt).all())
+
+
+def students_by_class():
+    return ChartQuery(select(Student.class_type, func.count(Student.id)).group_by(Student.class_type), _series)
+
+
+def payments_by_status(student_id=None, staff_id=None):
+    """Payment counts per status, optionally limited to one student or one instructor's batches."""
+    stmt = select(Payment.status, func.count(Payment.id)).group_by(Payment.status)
+    if student_id is not None:
+        stmt = stmt.where(Payment.student_id == student_id)
+    if staff_id is not None:
+        stmt = stmt.join(Batch, Payment.batch_id == Batch.id).where(Batch.staff_id == staff_id)
+    return ChartQuery(stmt, _series)
+
+
+def students_per_batch(staff_id=None):
+    stmt = select(Batch.name, func.count(StudentBatch.student_id)) \
+        .join(StudentBatch, StudentBatch.batch_id == Batch.id).group_by(Batch.name)
+    if staff_id is not None:
+        stmt = stmt.where(Batch.staff_id == staff_id)
+    return ChartQuery(stmt, _series)
+
+
+def attendance_summary(staff_id=None):
+    """Present vs absent counts since the archive cutoff across an instructor's batches (or all batches).
+
+    Bounded to the hot horizon so a dashboard load never scans the archive months.
+    """
+    attendance = attendance_union(since=archive_cutoff())
+    stmt = select(attendance.c.present, func.count()).group_by(attendance.c.present)
+    if staff_id is not None:
+        stmt = stmt.join(Batch, attendance.c.batch_id == Batch.id).where(Batch.staff_id == staff_id)
+    return ChartQuery(stmt, _present_absent)
+
+
+def attendance_last_30_days(student_id):
+    """One point per attendance record in the last 30 days: 1 present, 0 absent."""
+    since = datetime.utcnow().date() - timedelta(days=30)
+    return ChartQuery(select(Attendance.date, Attendance.present)
+                      .where(Attendance.student_id == student_id, Attendance.date >= since)
+                      .order_by(Attendance.date), _daily_presence)
+
+
+def admin_counts():
+    return {
+        'total_students': select(func.count(Student.id)),
+        'total_staff': select(func.count(Staff.id)),
+        'total_batches': select(func.count(Batch.id)),
+        'unpaid_payments': select(func.count(Payment.id)).where(Payment.status.in_(OPEN_PAYMENT_STATUSES)),
+        'outstanding_minor': select(func.coalesce(func.sum(StudentBalance.outstanding_minor), 0)),
+    }
+
+
+def staff_counts(staff_id):
+    own_batches = select(Batch.id).where(Batch.staff_id == staff_id)
+    return {
+        'total_students': select(func.count(func.distinct(StudentBatch.student_id)))
+        .where(StudentBatch.batch_id.in_(own_batches)),
+        'total_batches': select(func.count(Batch.id)).where(Batch.staff_id == staff_id),
+        'unpaid_payments': select(func.count(Payment.id))
+        .where(Payment.batch_id.in_(own_batches), Payment.status.in_(OPEN_PAYMENT_STATUSES)),
+    }
+
+
+def student_counts(student_id):
+    """Enrolled batches, open payments, present days in the last 30 days and balance due."""
+    thirty_days_ago = datetime.utcnow().date() - timedelta(days=30)
+    return {
+        'total_batches': select(func.count(StudentBatch.id)).where(StudentBatch.student_id == student_id),
+        'unpaid_payments': select(func.count(Payment.id))
+        .where(Payment.student_id == student_id, Payment.status.in_(OPEN_PAYMENT_STATUSES)),
+        'recent_attendance': select(func.count(Attendance.id))
+        .where(Attendance.student_id == student_id, Attendance.date >= thirty_days_ago,
+               Attendance.present.is_(True)),
+        'balance_minor': select(func.coalesce(func.sum(StudentBalance.outstanding_minor), 0))
+        .where(StudentBalance.student_id == student_id),
+    }
+
+
+def counts_for(user):
+    """Summary-card statements for ``user``'s dashboard."""
+    if user.role == 'admin':
+        return admin_counts()
+    if user.role == 'staff':
+        return staff_counts(user.staff.id)
+    return student_counts(user.student.id)
+
+
+def run_counts(statements):
+    return {name: db.session.execute(stmt).scalar_one() for name, stmt in statements.items()}
@@ -0,0 +1,204 @@
+"""Self check-in for class-start bursts.
+
+Staff open a batch session and display its signed session token (e.g. as a QR
+code on a kiosk). Students check in by posting that token to ``/api/checkin``
+together with either their own signed student token (kiosk scanning a card)
+or their logged-in session (phone scanning the QR code). Tokens are verified
+by signature alone; accepting a check-in costs one indexed enrollment lookup,
+so a student who is not in the batch is told so straight away.
+
+Accepted check-ins go into an in-memory ``CheckinQueue`` that deduplicates
+repeats. A single background flusher per worker process writes the queue to
+``attendance`` every ``CHECKIN_FLUSH_INTERVAL`` seconds (sooner once
+``CHECKIN_MAX_BATCH`` check-ins are waiting) as one batched upsert, so a burst
+of hundreds of check-ins becomes a few short write transactions instead of
+hundreds of competing ones. Enrollment is checked again at flush time, in
+case the student left the batch meanwhile. Anything still queued is flushed
+at exit.
+
+Both tokens carry the branch they were issued in, and each branch's check-ins
+are flushed to that branch's database in their own transaction.
+"""
+import atexit
+import logging
+import threading
+from datetime import date, datetime
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.models import Attendance, StudentBatch
+from app.sharding import current_branch, engine_for, use_branch
+
+logger = logging.getLogger(__name__)
+
+SESSION_SALT = 'checkin-session'
+STUDENT_SALT = 'checkin-student'
+
+
+class CheckinError(ValueError):
+    """Raised when a check-in token is missing, forged or expired."""
+
+
+def _serializer(app, salt):
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=salt)
+
+
+def session_token(app, batch_id, session_date=None):
+    """Signed token identifying one batch's class on one day in the current branch."""
+    session_date = session_date or datetime.utcnow().date()
+    return _serializer(app, SESSION_SALT).dumps({'r': current_branch(), 'b': batch_id,
+                                                 'd': session_date.isoformat()})
+
+
+def student_token(app, student_id):
+    """Long-lived signed token identifying a student of the current branch (printed on a card or shown in the app)."""
+    return _serializer(app, STUDENT_SALT).dumps({'r': current_branch(), 's': student_id})
+
+
+def read_session_token(app, token):
+    """Return ``(branch, batch_id, date)`` from a session token."""
+    try:
+        payload = _serializer(app, SESSION_SALT).loads(token, max_age=app.config['CHECKIN_SESSION_MAX_AGE'])
+    except SignatureExpired:
+        raise CheckinError('This check-in code has expired.')
+    except (BadSignature, TypeError):
+        raise CheckinError('Invalid check-in code.')
+    return payload.get('r', app.config['PRIMARY_BRANCH']), payload['b'], date.fromisoformat(payload['d'])
+
+
+def read_student_token(app, token):
+    """Return ``(branch, student_id)`` from a student token."""
+    try:
+        payload = _serializer(app, STUDENT_SALT).loads(token)
+        return payload.get('r', app.config['PRIMARY_BRANCH']), payload['s']
+    except (BadSignature, TypeError, KeyError):
+        raise CheckinError('Invalid student token.')
+
+
+def check_enrolled(branch, student_id, batch_id):
+    """Raise ``CheckinError`` unless the student is enrolled in the batch in ``branch``'s database."""
+    try:
+        engine_for(branch)
+    except LookupError:
+        raise CheckinError('This check-in code belongs to an unknown branch.')
+    with use_branch(branch):
+        enrolled = db.session.execute(select(StudentBatch.id)
+                                      .where(StudentBatch.student_id == student_id,
+                                             StudentBatch.batch_id == batch_id)).first()
+    if enrolled is None:
+        raise CheckinError('You are not enrolled in this batch.')
+
+
+def _upsert_statement(dialect_name):
+    dialect_insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(dialect_name)
+    if dialect_insert is None:
+        return None
+    table = Attendance.__table__
+    return dialect_insert(table).on_conflict_do_update(
+        index_elements=[table.c.student_id, table.c.batch_id, table.c.date],
+        set_={'present': True, 'updated_at': datetime.utcnow()})
+
+
+class CheckinQueue:
+    """Deduplicating in-memory queue of ``(branch, student_id, batch_id, date)`` check-ins with a lazy flusher thread."""
+
+    def __init__(self, app, interval=0.25, max_batch=500):
+        self.app = app
+        self.interval = interval
+        self.max_batch = max_batch
+        self._pending = set()
+        self._seen = set()  # Everything accepted today, so repeats are answered without queueing
+        self._seen_date = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def add(self, branch, student_id, batch_id, session_date):
+        """Queue a check-in; returns False if it was already accepted."""
+        key = (branch, student_id, batch_id, session_date)
+        with self._lock:
+            today = datetime.utcnow().date()
+            if self._seen_date != today:
+                self._seen.clear()
+                self._seen_date = today
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            self._pending.add(key)
+            if len(self._pending) >= self.max_batch:
+                self._wake.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='checkin-flusher', daemon=True)
+                self._thread.start()
+        return True
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        return pending
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:  # Keep the flusher alive; the batch is re-queued for the next tick
+                logger.exception('Check-in flush failed')
+
+    def flush(self):
+        """Write all queued check-ins, one transaction per branch; returns the number written."""
+        pending = self._take()
+        if not pending:
+            return 0
+        by_branch = {}
+        for branch, *key in pending:
+            by_branch.setdefault(branch, set()).add(tuple(key))
+        written, failed = 0, None
+        for branch, keys in by_branch.items():
+            with self.app.app_context(), use_branch(branch):
+                try:
+                    written += self._write(keys)
+                    db.session.commit()
+                except Exception as exc:
+                    db.session.rollback()
+                    with self._lock:
+                        self._pending |= {(branch, *key) for key in keys}
+                    failed = exc
+                finally:
+                    db.session.remove()
+        if failed is not None:
+            raise failed
+        return written
+
+    def _write(self, pending):
+        batch_ids = {batch_id for _, batch_id, _ in pending}
+        enrolled = set(db.session.execute(select(StudentBatch.student_id, StudentBatch.batch_id)
+                                          .where(StudentBatch.batch_id.in_(batch_ids))).tuples())
+        rows = [{'student_id': student_id, 'batch_id': batch_id, 'date': session_date, 'present': True}
+                for student_id, batch_id, session_date in pending if (student_id, batch_id) in enrolled]
+        if not rows:
+            return 0
+        upsert = _upsert_statement(db.session.get_bind().dialect.name)
+        if upsert is not None:
+            db.session.execute(upsert, rows)
+            return len(rows)
+        table = Attendance.__table__
+        for row in rows:
+            result = db.session.execute(update(table).where(table.c.student_id == row['student_id'],
+                                                            table.c.batch_id == row['batch_id'],
+                                                            table.c.date == row['date'])
+                                         .values(present=True, updated_at=datetime.utcnow()))
+            if result.rowcount == 0:
+                db.session.execute(insert(table).values(**row))
+        return len(rows)
+
+
+def init_app(app):
+    """Create the per-process check-in queue; its flusher thread starts on the first check-in."""
+    app.extensions['checkin'] = CheckinQueue(app, interval=app.config['CHECKIN_FLUSH_INTERVAL'],
+                                             max_batch=app.config['CHECKIN_MAX_BATCH'])
@@ -0,0 +1,208 @@
+"""Streaming response compression.
+
+``CompressionMiddleware`` wraps the WSGI app and compresses text responses
+(HTML, JSON, CSV, ...) with brotli or gzip, whichever the client prefers in
+``Accept-Encoding``. Bodies are compressed chunk by chunk as the app yields
+them and flushed every ``FLUSH_BYTES`` of input, so streamed exports start
+arriving immediately and are never buffered whole. Responses that are already
+encoded, too small, partial or marked ``no-transform`` pass through untouched.
+
+Per-endpoint totals (responses, bytes in/out, compression CPU time) are kept in
+``app.extensions['compression'].stats`` and shown at ``/admin/compression-stats``.
+Brotli needs the optional ``brotli`` package; without it only gzip is offered.
+"""
+import threading
+import time
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip is always available
+    brotli = None
+
+FLUSH_BYTES = 16 * 1024  # Input bytes between sync flushes of a streamed body
+SKIP_STATUSES = (204, 206, 304)
+
+
+def _parse_accept_encoding(header):
+    """Return ``{coding: quality}`` from an ``Accept-Encoding`` header."""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.lower()] = quality
+    return accepted
+
+
+class GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStream:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionStats:
+    """Thread-safe per-endpoint compression totals."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, endpoint, encoding, bytes_in, bytes_out, cpu_seconds):
+        with self._lock:
+            totals = self._totals.setdefault(endpoint, {'responses': 0, 'bytes_in': 0, 'bytes_out': 0,
+                                                        'cpu_seconds': 0.0, 'encodings': {}})
+            totals['responses'] += 1
+            totals['bytes_in'] += bytes_in
+            totals['bytes_out'] += bytes_out
+            totals['cpu_seconds'] += cpu_seconds
+            totals['encodings'][encoding] = totals['encodings'].get(encoding, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            report = {}
+            for endpoint, totals in self._totals.items():
+                entry = dict(totals, encodings=dict(totals['encodings']))
+                entry['ratio'] = round(totals['bytes_out'] / totals['bytes_in'], 4) if totals['bytes_in'] else None
+                entry['cpu_ms_per_response'] = round(totals['cpu_seconds'] * 1000 / totals['responses'], 3)
+                report[endpoint] = entry
+            return report
+
+
+class CompressionMiddleware:
+    """WSGI middleware negotiating gzip/brotli and compressing response bodies incrementally."""
+
+    def __init__(self, wsgi_app, level=6, min_size=500, mimetypes=(), stats=None):
+        self.wsgi_app = wsgi_app
+        self.level = level
+        self.min_size = min_size
+        self.mimetypes = frozenset(mimetypes)
+        self.stats = stats or CompressionStats()
+
+    def _negotiate(self, environ):
+        accepted = _parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and accepted.get('br', 0) > 0:
+            return 'br'
+        if accepted.get('gzip', 0) > 0:
+            return 'gzip'
+        return None
+
+    def _should_compress(self, status, headers):
+        if int(status.split(' ', 1)[0]) in SKIP_STATUSES:
+            return False
+        names = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in names or 'content-range' in names:
+            return False
+        if 'no-transform' in names.get('cache-control', ''):
+            return False
+        if names.get('content-type', '').split(';', 1)[0].strip().lower() not in self.mimetypes:
+            return False
+        length = names.get('content-length')
+        return length is None or int(length) >= self.min_size
+
+    def __call__(self, environ, start_response):
+        encoding = self._negotiate(environ)
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+
+        state = {}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            state['compress'] = self._should_compress(status, headers)
+            if state['compress']:
+                headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+                vary = [value for name, value in headers if name.lower() == 'vary']
+                headers = [(name, value) for name, value in headers if name.lower() != 'vary']
+                headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+                headers.append(('Content-Encoding', encoding))
+                # The compressed body is a different representation: strong ETags become weak
+                headers = [(name, 'W/' + value if name.lower() == 'etag' and not value.startswith('W/') else value)
+                           for name, value in headers]
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.wsgi_app(environ, compressing_start_response)
+        if state.get('compress') is False:
+            return app_iter
+        return self._stream(app_iter, encoding, environ, state)
+
+    def _stream(self, app_iter, encoding, environ, state):
+        stream = None
+        bytes_in = bytes_out = pending = 0
+        cpu = 0.0
+        try:
+            for chunk in app_iter:
+                if not state.get('compress'):
+                    yield chunk
+                    continue
+                if stream is None:
+                    stream = BrotliStream(self.level) if encoding == 'br' else GzipStream(self.level)
+                started = time.thread_time()
+                out = stream.compress(chunk)
+                bytes_in += len(chunk)
+                pending += len(chunk)
+                if pending >= FLUSH_BYTES:
+                    out += stream.flush()
+                    pending = 0
+                cpu += time.thread_time() - started
+                if out:
+                    bytes_out += len(out)
+                    yield out
+            if state.get('compress'):
+                if stream is None:
+                    stream = BrotliStream(self.level) if encoding == 'br' else GzipStream(self.level)
+                started = time.thread_time()
+                out = stream.finish()
+                cpu += time.thread_time() - started
+                bytes_out += len(out)
+                self.stats.record(environ.get('app.endpoint') or '<unmatched>', encoding, bytes_in, bytes_out, cpu)
+                yield out
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def init_app(app):
+    """Wrap ``app.wsgi_app`` in the compression middleware when ``COMPRESSION_ENABLED`` is set."""
+    if not app.config['COMPRESSION_ENABLED']:
+        return
+    middleware = CompressionMiddleware(app.wsgi_app, level=app.config['COMPRESSION_LEVEL'],
+                                       min_size=app.config['COMPRESSION_MIN_SIZE'],
+                                       mimetypes=app.config['COMPRESSION_MIMETYPES'])
+    app.wsgi_app = middleware
+    app.extensions['compression'] = middleware
+
+    @app.before_request
+    def tag_endpoint():
+        # Lets the middleware attribute compression stats to the Flask endpoint
+        request.environ['app.endpoint'] = request.endpoint
@@ -26,13 +26,100 @@ class Config:
     # Flask-Bootstrap settings
     BOOTSTRAP_SERVE_LOCAL = True  # Serve Bootstrap files locally for offline development
 
-    # Optional: Flask-Mail settings (for future email reminders)
-    # MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.example.com')
-    # MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
-    # MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'True').lower() == 'true'
-    # MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
-    # MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
-    # MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'no-reply@danceschool.com')
+    # Static asset pipeline (flask build-assets)
+    ASSETS_USE_MANIFEST = True  # Serve fingerprinted, precompressed copies from static/dist when built
+    CHARTJS_VERSION = '4.4.4'  # Chart.js release vendored into static/vendor
+
+    # Dashboard chart panels (/api/charts/*)
+    CHART_CACHE_SECONDS = 60  # Browser cache lifetime before revalidating by ETag
+
+    # Branches, one database each (app/sharding.py, flask shards upgrade)
+    PRIMARY_BRANCH = os.environ.get('PRIMARY_BRANCH', 'main')  # Branch stored in SQLALCHEMY_DATABASE_URI
+    BRANCH_DATABASES = dict(item.split('=', 1) for item in os.environ.get('BRANCH_DATABASES', '').split(',') if item)  # code=url,...
+    BRANCH = os.environ.get('BRANCH')  # Branch used by CLI commands and background jobs (default PRIMARY_BRANCH)
+    SHARD_FANOUT_WORKERS = 8  # Branches queried in parallel by cross-branch admin reports
+
+    # Async views for exports, dashboard data and /api/* (needs flask[async]; see app/async_views.py)
+    ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False').lower() == 'true'
+
+    # Slow-query log (app/slow_queries.py, /admin/slow-queries)
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))  # 0 disables statement timing
+    SLOW_QUERY_EXPLAIN = True  # Capture the plan of slow SELECTs
+    SLOW_QUERY_EXPLAIN_INTERVAL = 3600  # Seconds before a fingerprint's plan is captured again
+    SLOW_QUERY_MAX_FINGERPRINTS = 500  # Distinct statements aggregated per worker
+    SLOW_QUERY_LOG_FILE = os.environ.get('SLOW_QUERY_LOG_FILE')  # Also append each slow query here as JSON Lines
+
+    # On-demand request profiler (app/profiling.py, /admin/profiles)
+    PROFILER_ENDPOINTS = [name for name in os.environ.get('PROFILER_ENDPOINTS', '').split(',') if name]  # e.g. main.payment_list
+    PROFILER_SAMPLE_RATE = int(os.environ.get('PROFILER_SAMPLE_RATE', 0))  # Profile 1 in N requests; 0 disables
+    PROFILER_HEADER = 'X-Profile'  # Admins profile any request by sending this header ('sample' or 'cprofile')
+    PROFILER_MODE = 'sample'  # 'sample' (low overhead, flame-graph stacks) or 'cprofile' (exact call counts)
+    PROFILER_INTERVAL = 0.005  # Seconds between stack samples
+    PROFILER_DIR = os.environ.get('PROFILER_DIR')  # Defaults to <instance folder>/profiles
+    PROFILER_KEEP = 200  # Captures kept on disk; older ones are deleted
+
+    # Production server (python serve.py); command-line flags override these
+    SERVER_BIND = os.environ.get('SERVER_BIND', '0.0.0.0:8000')
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', os.cpu_count() or 1))
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 4))  # Request threads per worker
+    SERVER_MAX_REQUESTS = 5000  # Recycle a worker after this many requests to cap memory growth
+    SERVER_MAX_REQUESTS_JITTER = 500  # Spread recycling so workers do not restart together
+    SERVER_TIMEOUT = 30  # Seconds without a heartbeat before a worker is killed and replaced
+    SERVER_GRACEFUL_TIMEOUT = 30  # Seconds to let in-flight requests finish on stop or reload
+
+    # Batched backfills (app/backfill.py, flask backfill run)
+    BACKFILL_CHUNK_SIZE = 1000  # Initial rows per chunk transaction
+    BACKFILL_TARGET_SECONDS = 0.5  # Chunk size adapts so each chunk transaction takes about this long
+    BACKFILL_PAUSE = 0.05  # Seconds between chunks, leaving room for application writes
+
+    # Attendance archival (flask archive-attendance)
+    ATTENDANCE_HOT_DAYS = 180  # Days kept in the attendance table; older rows move to monthly archives
+
+    # Change feed (/api/changes, flask export-changes)
+    CHANGE_FEED_PAGE_SIZE = 1000  # Maximum rows per page
+    CHANGE_FEED_LAG_SECONDS = 5  # Rows newer than this wait for the next poll, so in-flight commits are not skipped
+    CHANGE_FEED_OVERLAP_SECONDS = 300  # Each new pull re-reads this much before its cursor, for late commits
+
+    # Self check-in API (/api/checkin)
+    CHECKIN_FLUSH_INTERVAL = 0.25  # Seconds between batched attendance upserts
+    CHECKIN_MAX_BATCH = 500  # Flush early once this many check-ins are queued
+    CHECKIN_SESSION_MAX_AGE = 3 * 3600  # Seconds a batch session's check-in code stays valid
+
+    # Rendered-fragment cache ({% cache %} template tag)
+    FRAGMENT_CACHE_ENABLED = True
+    FRAGMENT_CACHE_DEFAULT_TTL = 300  # Seconds; data changes invalidate sooner through table version tokens
+    FRAGMENT_CACHE_MAX_ENTRIES = 512
+    FRAGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024  # Total size of cached HTML held by each worker
+    FRAGMENT_CACHE_DIR = os.environ.get('FRAGMENT_CACHE_DIR')  # Store shared by all workers; defaults to <instance folder>/fragment_cache
+
+    # Monthly attendance matrix (/batch/<id>/attendance/matrix)
+    ATTENDANCE_MATRIX_CACHE_SECONDS = 3600  # Keys change with the data; this only bounds how long unused ones stay
+
+    # Offline attendance (/attendance/offline)
+    OFFLINE_SYNC_MAX_RECORDS = 2000  # Marks accepted per sync request
+    OFFLINE_SYNC_MAX_AGE_DAYS = 30  # Marks dated earlier, or on archived days, are rejected
+
+    # Response compression middleware
+    COMPRESSION_ENABLED = True
+    COMPRESSION_LEVEL = 6  # gzip 1-9 / brotli 0-11; 6 balances ratio and CPU for HTML tables
+    COMPRESSION_MIN_SIZE = 500  # Bytes; smaller bodies are not worth the CPU or framing overhead
+    COMPRESSION_MIMETYPES = ['text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript',
+                             'application/javascript', 'application/json', 'image/svg+xml']
+
+    # Mail settings (used by payment reminders)
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.example.com')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'True').lower() == 'true'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'no-reply@danceschool.com')
+    MAIL_TIMEOUT = 30  # Seconds before an SMTP operation is abandoned
+
+    # Payment reminder settings
+    REMINDER_WORKERS = int(os.environ.get('REMINDER_WORKERS', 4))  # Sender threads, one SMTP connection each
+    REMINDER_BATCH_SIZE = 50  # Messages handed to a worker at a time
+    REMINDER_RATE_LIMIT = float(os.environ.get('REMINDER_RATE_LIMIT', 5))  # Messages per second across all workers
+    REMINDER_MAX_RETRIES = 3  # Attempts per message on transient SMTP errors
 
     # Optional: File upload settings (for profile pictures, if implemented)
     # UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static/uploads')
@@ -42,6 +129,7 @@ class DevelopmentConfig(Config):
     """Development-specific configuration."""
     DEBUG = True
     SQLALCHEMY_ECHO = True  # Log SQL queries for debugging
+    ASSETS_USE_MANIFEST = False  # Always serve the editable source files
 
 class ProductionConfig(Config):
     """Production-specific configuration."""
@@ -0,0 +1,103 @@
+"""Bulk enrollment and roster transfer.
+
+Each operation is a fixed number of set-based statements in one transaction,
+however many enrollments it touches, so a term rollover moving thousands of
+students is one request.
+
+* ``enroll`` inserts every requested (student, batch) pair with a single
+  ``INSERT ... SELECT ... ON CONFLICT DO NOTHING``. Selecting from
+  ``student`` and ``batch`` drops unknown ids, and pairs that already exist
+  are skipped instead of failing on ``uix_student_batch``.
+* ``transfer`` moves a batch's roster (or part of it) to another batch with
+  one ``UPDATE``. Students already enrolled in the target are removed from
+  the source with one ``DELETE``. With ``copy=True`` the roster is instead
+  added to the target, like ``enroll``, and the source is left alone.
+
+Attendance and payments stay with the batch they were recorded for.
+"""
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import delete, exists, func, insert, literal, select, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.models import Batch, Student, StudentBatch
+
+ON_CONFLICT_INSERT = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+class EnrollmentSummary(NamedTuple):
+    requested: int  # Pairs of existing students and batches asked for
+    enrolled: int  # Newly created enrollments
+    already_enrolled: int
+
+    def message(self):
+        return f'{self.enrolled} enrollment(s) added, {self.already_enrolled} already existed.'
+
+
+class TransferSummary(NamedTuple):
+    moved: int  # Enrollments now in the target batch that were not before
+    already_enrolled: int  # Students of the selection already in the target batch
+    removed: int  # Source enrollments deleted because the student was already in the target
+
+    def message(self):
+        return (f'{self.moved} student(s) transferred, {self.already_enrolled} already in the target batch'
+                + (f' ({self.removed} removed from the source batch).' if self.removed else '.'))
+
+
+def _insert_pairs(pairs, requested):
+    """Insert the ``(student_id, batch_id)`` rows selected by ``pairs``, skipping existing enrollments."""
+    now = datetime.utcnow()
+    columns = ['student_id', 'batch_id', 'created_at', 'updated_at']
+    # SQLite needs a WHERE on INSERT ... SELECT before ON CONFLICT, or it parses ON as a join constraint
+    source = select(pairs.c.student_id, pairs.c.batch_id, literal(now), literal(now)).where(true())
+    dialect_insert = ON_CONFLICT_INSERT.get(db.session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(StudentBatch).from_select(columns, source) \
+            .on_conflict_do_nothing(index_elements=['student_id', 'batch_id'])
+    else:
+        # No ON CONFLICT: leave out the pairs that exist already
+        enrolled = exists().where(StudentBatch.student_id == pairs.c.student_id,
+                                  StudentBatch.batch_id == pairs.c.batch_id)
+        stmt = insert(StudentBatch).from_select(columns, source.where(~enrolled))
+    enrolled = db.session.execute(stmt).rowcount
+    return EnrollmentSummary(requested, enrolled, requested - enrolled)
+
+
+def enroll(student_ids, batch_ids):
+    """Enroll every student in ``student_ids`` in every batch in ``batch_ids``; the caller commits."""
+    pairs = select(Student.id.label('student_id'), Batch.id.label('batch_id')) \
+        .join(Batch, true()) \
+        .where(Student.id.in_(set(student_ids)), Batch.id.in_(set(batch_ids))).subquery()  # Every combination
+    requested = db.session.execute(select(func.count()).select_from(pairs)).scalar_one()
+    if not requested:
+        return EnrollmentSummary(0, 0, 0)
+    return _insert_pairs(pairs, requested)
+
+
+def transfer(source_id, target_id, student_ids=None, copy=False):
+    """Move (or copy) the enrollments of ``source_id``, or only ``student_ids``, to ``target_id``; the caller commits."""
+    if source_id == target_id:
+        raise ValueError('Choose a different batch to transfer to.')
+    selected = [StudentBatch.batch_id == source_id]
+    if student_ids is not None:
+        selected.append(StudentBatch.student_id.in_(set(student_ids)))
+    in_target = select(StudentBatch.student_id).where(StudentBatch.batch_id == target_id).scalar_subquery()
+
+    if copy:
+        pairs = select(StudentBatch.student_id.label('student_id'), literal(target_id).label('batch_id')) \
+            .where(*selected).subquery()
+        requested = db.session.execute(select(func.count()).select_from(pairs)).scalar_one()
+        summary = _insert_pairs(pairs, requested)
+        return TransferSummary(summary.enrolled, summary.already_enrolled, 0)
+
+    # Students already in the target cannot be moved there (uix_student_batch); drop their source enrollment
+    moved = db.session.execute(update(StudentBatch)
+                               .where(*selected, StudentBatch.student_id.not_in(in_target))
+                               .values(batch_id=target_id, updated_at=datetime.utcnow())
+                               .execution_options(synchronize_session=False)).rowcount
+    removed = db.session.execute(delete(StudentBatch)
+                                 .where(*selected, StudentBatch.student_id.in_(in_target))
+                                 .execution_options(synchronize_session=False)).rowcount
+    return TransferSummary(moved, removed, removed)
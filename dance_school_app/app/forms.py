@@ -1,13 +1,16 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, IntegerField, SelectField, BooleanField, DateField, FloatField, TextAreaField
-from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import Form, StringField, PasswordField, SubmitField, IntegerField, SelectField, SelectMultipleField, BooleanField, DateField, FloatField, TextAreaField, TimeField, FieldList, FormField
+from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, ValidationError
 from app.models import Staff, Student, Batch, StudentBatch
+from app.timetable import WEEKDAYS
 from datetime import datetime
 
 class LoginForm(FlaskForm):
     """Form for user login (admin, staff, student)."""
     username = StringField('Username', validators=[DataRequired(message="Username is required.")])
     password = PasswordField('Password', validators=[DataRequired(message="Password is required.")])
+    branch = SelectField('Branch', validate_choice=False)  # Choices set in the view; shown with several branches
     submit = SubmitField('Login')
 
 class StudentRegistrationForm(FlaskForm):
@@ -44,12 +47,31 @@ class StaffRegistrationForm(FlaskForm):
     ])
     submit = SubmitField('Register Staff')
 
+class BatchSlotForm(Form):
+    """One weekly class time in the batch form; rows left blank are ignored."""
+    weekday = SelectField('Day', coerce=int, choices=list(enumerate(WEEKDAYS)), default=0)
+    start_time = TimeField('Start', validators=[Optional()])
+    end_time = TimeField('End', validators=[Optional()])
+    room = StringField('Room', validators=[Optional(), Length(max=50)])
+
+    # Only run for filled-in times (Optional stops the chain on blanks)
+    def validate_start_time(self, field):
+        if self.end_time.data is None:
+            raise ValidationError('Enter an end time as well.')
+
+    def validate_end_time(self, field):
+        if self.start_time.data is None:
+            raise ValidationError('Enter a start time as well.')
+        if field.data <= self.start_time.data:
+            raise ValidationError('The class must end after it starts.')
+
 class BatchForm(FlaskForm):
     """Form for creating a new batch (by admin only)."""
     name = StringField('Batch Name', validators=[DataRequired(message="Batch name is required.")])
     staff_id = SelectField('Assigned Staff', coerce=int, validators=[DataRequired(message="Please select a staff member.")])
     fee_monthly = FloatField('Monthly Fee', validators=[DataRequired(message="Monthly fee is required.")])
     fee_quarterly = FloatField('Quarterly Fee', validators=[Optional()])
+    slots = FieldList(FormField(BatchSlotForm), min_entries=3, max_entries=14)
     submit = SubmitField('Create Batch')
 
     def __init__(self, *args, **kwargs):
@@ -57,13 +79,21 @@ class BatchForm(FlaskForm):
         self.staff_id.choices = [(s.id, s.name) for s in Staff.query.order_by(Staff.name).all()]
 
 class AssignStudentForm(FlaskForm):
-    """Form for assigning a student to a batch (by admin or staff)."""
-    student_id = SelectField('Student', coerce=int, validators=[DataRequired(message="Please select a student.")])
-    submit = SubmitField('Assign Student')
+    """Form for enrolling students in a batch (by admin or staff); choices are set in the view."""
+    student_ids = SelectMultipleField('Students', coerce=int, validators=[DataRequired(message="Please select at least one student.")])
+    submit = SubmitField('Assign Students')
 
-    def __init__(self, *args, **kwargs):
-        super(AssignStudentForm, self).__init__(*args, **kwargs)
-        self.student_id.choices = [(s.id, s.full_name) for s in Student.query.order_by(Student.full_name).all()]
+class EnrollBatchesForm(FlaskForm):
+    """Form for enrolling one student in several batches (by admin or staff); choices are set in the view."""
+    batch_ids = SelectMultipleField('Batches', coerce=int, validators=[DataRequired(message="Please select at least one batch.")])
+    submit = SubmitField('Enroll')
+
+class TransferRosterForm(FlaskForm):
+    """Form for moving or copying a batch roster to another batch (by admin only); choices are set in the view."""
+    target_batch_id = SelectField('Target Batch', coerce=int, validators=[DataRequired(message="Please select a batch.")])
+    student_ids = SelectMultipleField('Students (leave empty for the whole roster)', coerce=int, validators=[Optional()])
+    copy = BooleanField('Keep the students in this batch too (copy instead of move)')
+    submit = SubmitField('Transfer')
 
 class AttendanceForm(FlaskForm):
     """Form for marking attendance for a student in a batch (by admin or staff)."""
@@ -79,7 +109,8 @@ class PaymentForm(FlaskForm):
     status = SelectField('Status', choices=[
         ('paid', 'Paid'),
         ('unpaid', 'Unpaid'),
-        ('partial', 'Partial')
+        ('partial', 'Partial'),
+        ('overdue', 'Overdue')
     ], validators=[DataRequired()])
     submit = SubmitField('Update Payment')
 
@@ -112,4 +143,16 @@ class PublicStudentRegistrationForm(FlaskForm):
         DataRequired(message="Please confirm the password."),
         EqualTo('password', message="Passwords must match.")
     ])
-    submit = SubmitField('Register')
\ No newline at end of file
+    submit = SubmitField('Register')
+
+class StatementUploadForm(FlaskForm):
+    """Form for uploading a bank/UPI statement CSV for reconciliation (by admin or staff)."""
+    statement = FileField('Statement (CSV)', validators=[
+        FileRequired(message="Please choose a statement file."),
+        FileAllowed(['csv'], message="Statements must be CSV files.")
+    ])
+    submit = SubmitField('Match Payments')
+
+class ReconcileConfirmForm(FlaskForm):
+    """Form for confirming reviewed statement matches; the selected matches are posted as checkboxes."""
+    submit = SubmitField('Mark Selected as Paid')
\ No newline at end of file
@@ -0,0 +1,289 @@
+"""Rendered-fragment caching for templates.
+
+Wrap an expensive template section in::
+
+    {% cache 'batch_rows', 300, 'batch', 'staff', 'student_batch' %}
+        ...
+    {% endcache %}
+
+The arguments are a fragment name, a TTL in seconds and the tables whose data
+the section renders. The cache key combines the name, a version token for each
+listed table, the branch and the viewer's scope (``admin``, ``staff:<id>`` or
+``student:<id>``), so one user never sees a fragment rendered for another and
+no explicit invalidation is needed: any commit that inserts, updates or
+deletes rows of a table (through the ORM or a bulk statement on the session)
+gives that table a new version token in its branch, and fragments keyed by the old token are
+simply never read again. Raw SQL text is not tracked.
+
+Fragments live in an in-process LRU bounded by entry count and total size.
+Version tokens and fragments are also kept in a file-based store under
+``FRAGMENT_CACHE_DIR`` (default ``<instance>/fragment_cache``), shared by
+every worker on the host. A commit handled by one worker therefore
+invalidates the fragments cached by all of them. Fragment keys embed the
+version tokens, so the local LRU never serves a stale copy. Expired files
+are pruned from the store about once a minute.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.sharding import current_branch
+
+VERSION_PREFIX = 'version:'
+CHANGED_TABLES = 'fragment_cache_changed_tables'  # Key in Session.info
+
+
+class LRUBackend:
+    """Thread-safe in-process LRU bounded by entry count and total value size."""
+
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class FileBackend:
+    """One file per key in a shared directory; writes are atomic renames so readers never see partial files.
+
+    Each file's mtime is set to its expiry time, so ``prune`` can drop expired
+    entries without opening them.
+    """
+
+    PRUNE_INTERVAL = 60  # Seconds between sweeps for expired files, per process
+    NO_EXPIRY = 10 * 365 * 24 * 3600  # mtime offset for entries without a TTL (version tokens)
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._next_prune = time.monotonic() + self.PRUNE_INTERVAL
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires_at, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            mtime = expires_at or time.time() + self.NO_EXPIRY
+            os.utime(tmp_path, (mtime, mtime))
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        if time.monotonic() >= self._next_prune:
+            self._next_prune = time.monotonic() + self.PRUNE_INTERVAL
+            self.prune()
+
+    def prune(self):
+        """Delete entries whose expiry (their mtime) has passed."""
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            # Temp files are mid-write in another worker unless they are old
+            cutoff = now - self.PRUNE_INTERVAL if entry.name.endswith('.tmp') else now
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass  # Replaced or removed by another worker meanwhile
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class FragmentCache:
+    """Versioned fragment store: a local LRU in front of an optional shared backend."""
+
+    def __init__(self, local, shared=None, default_ttl=300):
+        self.local = local
+        self.shared = shared
+        self.default_ttl = default_ttl
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, self.default_ttl)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.default_ttl
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+
+    def version(self, table):
+        """Current version token of ``table``; a missing token (evicted, first use) starts a new one."""
+        store = self.shared or self.local
+        token = store.get(VERSION_PREFIX + table)
+        if token is None:
+            token = self.bump([table])[table]
+        return token
+
+    def bump(self, tables):
+        store = self.shared or self.local
+        tokens = {}
+        for table in tables:
+            tokens[table] = uuid.uuid4().hex
+            store.set(VERSION_PREFIX + table, tokens[table])
+        return tokens
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+def _viewer_scope():
+    if not current_user or not current_user.is_authenticated:
+        return 'anonymous'
+    if current_user.role == 'staff' and current_user.staff:
+        return f'staff:{current_user.staff.id}'
+    if current_user.role == 'student' and current_user.student:
+        return f'student:{current_user.student.id}'
+    return current_user.role
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja ``{% cache name, ttl, 'table', ... %}...{% endcache %}`` tag."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, name, ttl=None, *tables, caller):
+        cache = current_app.extensions.get('fragment_cache')
+        if cache is None:
+            return caller()
+        branch = current_branch()
+        versions = ','.join(f'{table}={cache.version(_branch_table(table, branch))}' for table in sorted(tables))
+        key = f'fragment:{name}:{branch}:{_viewer_scope()}:{versions}'
+        html = cache.get(key)
+        if html is None:
+            html = str(caller())
+            cache.set(key, html, ttl)
+        return Markup(html)
+
+
+def _branch_table(table, branch=None):
+    """Version tokens are per branch: each branch's tables live in their own database."""
+    return f'{branch or current_branch()}.{table}'
+
+
+def _table_names(mapper):
+    return [_branch_table(table.name) for table in mapper.tables]
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed_tables(session, flush_context):
+    changed = session.info.setdefault(CHANGED_TABLES, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        changed.update(_table_names(obj.__mapper__))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_tables(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and getattr(table, 'name', None):
+        orm_execute_state.session.info.setdefault(CHANGED_TABLES, set()).add(_branch_table(table.name))
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed_tables(session):
+    changed = session.info.pop(CHANGED_TABLES, None)
+    if changed and has_app_context():
+        cache = current_app.extensions.get('fragment_cache')
+        if cache is not None:
+            cache.bump(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_tables(session):
+    session.info.pop(CHANGED_TABLES, None)
+
+
+def init_app(app):
+    """Register the ``{% cache %}`` tag and build the cache from ``FRAGMENT_CACHE_*`` settings."""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if not app.config['FRAGMENT_CACHE_ENABLED']:
+        return
+    local = LRUBackend(app.config['FRAGMENT_CACHE_MAX_ENTRIES'], app.config['FRAGMENT_CACHE_MAX_BYTES'])
+    directory = app.config['FRAGMENT_CACHE_DIR'] or os.path.join(app.instance_path, 'fragment_cache')
+    app.extensions['fragment_cache'] = FragmentCache(local, FileBackend(directory),
+                                                     default_ttl=app.config['FRAGMENT_CACHE_DEFAULT_TTL'])
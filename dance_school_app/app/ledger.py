@@ -0,0 +1,192 @@
+"""Per-student balance ledger.
+
+``student_balance`` holds one row per (student, batch) with billed, paid and
+outstanding totals in integer minor units (cents/paise), so balance lookups
+read a handful of rows instead of summing ``Payment.amount`` floats.
+
+Whenever a payment is created or changed, the caller passes its state before
+and after the change to ``record_change``; the difference is applied as an
+atomic ``col = col + delta`` upsert inside the caller's transaction, so the
+ledger commits (or rolls back) together with the payment. ``flask ledger
+verify`` recomputes the totals from ``payment`` and reports drift, and
+``flask ledger rebuild`` rewrites the table from scratch.
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NamedTuple
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.models import Payment, StudentBalance, OPEN_PAYMENT_STATUSES
+
+TOTAL_COLUMNS = ('billed_minor', 'paid_minor', 'outstanding_minor')
+
+
+class PaymentState(NamedTuple):
+    """The parts of a payment that affect balances."""
+    student_id: int
+    batch_id: int
+    amount: float
+    status: str
+
+    @classmethod
+    def of(cls, payment):
+        return cls(payment.student_id, payment.batch_id, payment.amount, payment.status)
+
+
+def to_minor(amount):
+    """Convert a money amount to integer minor units without float drift."""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor):
+    """Convert minor units back to a ``Decimal`` amount for display."""
+    return Decimal(minor or 0).scaleb(-2)
+
+
+def _totals(state):
+    minor = to_minor(state.amount)
+    return (minor,
+            minor if state.status == 'paid' else 0,
+            minor if state.status in OPEN_PAYMENT_STATUSES else 0)
+
+
+def _add(deltas, state, sign):
+    key = (state.student_id, state.batch_id)
+    deltas[key] = tuple(current + sign * value for current, value in zip(deltas[key], _totals(state)))
+
+
+def _upsert_statement(dialect_name):
+    table = StudentBalance.__table__
+    dialect_insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(dialect_name)
+    if dialect_insert is None:
+        return None
+    stmt = dialect_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.student_id, table.c.batch_id],
+        set_={**{name: table.c[name] + stmt.excluded[name] for name in TOTAL_COLUMNS},
+              'updated_at': stmt.excluded.updated_at})
+
+
+def _apply_deltas(deltas):
+    params = [{'student_id': student_id, 'batch_id': batch_id, 'updated_at': datetime.utcnow(),
+               **dict(zip(TOTAL_COLUMNS, values))}
+              for (student_id, batch_id), values in deltas.items() if any(values)]
+    if not params:
+        return
+    upsert = _upsert_statement(db.session.get_bind().dialect.name)
+    if upsert is not None:
+        db.session.execute(upsert, params)
+        return
+    # Portable fallback: increment existing rows, insert the missing ones
+    table = StudentBalance.__table__
+    for row in params:
+        result = db.session.execute(
+            update(table).where(table.c.student_id == row['student_id'], table.c.batch_id == row['batch_id'])
+            .values(updated_at=row['updated_at'], **{name: table.c[name] + row[name] for name in TOTAL_COLUMNS}))
+        if result.rowcount == 0:
+            db.session.execute(insert(table).values(**row))
+
+
+def record_changes(changes):
+    """Apply ``(before, after)`` ``PaymentState`` pairs to the ledger; either side may be None.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    deltas = defaultdict(lambda: (0, 0, 0))
+    for before, after in changes:
+        if before is not None:
+            _add(deltas, before, -1)
+        if after is not None:
+            _add(deltas, after, 1)
+    _apply_deltas(deltas)
+
+
+def record_change(before, after):
+    record_changes([(before, after)])
+
+
+def student_balance(student_id):
+    """Outstanding minor units across all of a student's batches."""
+    return db.session.execute(select(func.coalesce(func.sum(StudentBalance.outstanding_minor), 0))
+                              .where(StudentBalance.student_id == student_id)).scalar_one()
+
+
+def outstanding_by_student(student_ids=None):
+    """Map student id to outstanding minor units (students owing nothing are omitted)."""
+    stmt = select(StudentBalance.student_id, func.sum(StudentBalance.outstanding_minor)) \
+        .where(StudentBalance.outstanding_minor != 0).group_by(StudentBalance.student_id)
+    if student_ids is not None:
+        stmt = stmt.where(StudentBalance.student_id.in_(student_ids))
+    return dict(db.session.execute(stmt).all())
+
+
+def total_outstanding():
+    return db.session.execute(select(func.coalesce(func.sum(StudentBalance.outstanding_minor), 0))).scalar_one()
+
+
+def expected_balances():
+    """Recompute every (student, batch) total from ``payment``, converting each amount exactly once."""
+    expected = defaultdict(lambda: (0, 0, 0))
+    stmt = select(Payment.student_id, Payment.batch_id, Payment.amount, Payment.status) \
+        .execution_options(yield_per=5000)
+    for row in db.session.execute(stmt):
+        _add(expected, PaymentState(*row), 1)
+    return expected
+
+
+def verify():
+    """Compare the ledger with recomputed totals; returns ``[(student_id, batch_id, stored, expected)]``."""
+    expected = expected_balances()
+    stored = {(row.student_id, row.batch_id): (row.billed_minor, row.paid_minor, row.outstanding_minor)
+              for row in db.session.execute(select(StudentBalance.student_id, StudentBalance.batch_id,
+                                                   *(StudentBalance.__table__.c[name] for name in TOTAL_COLUMNS)))}
+    drift = []
+    for key in sorted(set(expected) | set(stored)):
+        have, want = stored.get(key, (0, 0, 0)), expected.get(key, (0, 0, 0))
+        if have != want:
+            drift.append((*key, have, want))
+    return drift
+
+
+def rebuild():
+    """Rewrite ``student_balance`` from ``payment``; returns the number of rows written."""
+    expected = expected_balances()
+    now = datetime.utcnow()
+    db.session.execute(delete(StudentBalance))
+    rows = [{'student_id': student_id, 'batch_id': batch_id, 'updated_at': now, **dict(zip(TOTAL_COLUMNS, values))}
+            for (student_id, batch_id), values in expected.items()]
+    if rows:
+        db.session.execute(insert(StudentBalance), rows)
+    db.session.commit()
+    return len(rows)
+
+
+@click.group('ledger')
+def ledger_command():
+    """Check or rebuild the per-student balance ledger."""
+
+
+@ledger_command.command('verify')
+@with_appcontext
+def verify_command():
+    """Report (student, batch) balances that differ from the payment records."""
+    drift = verify()
+    for student_id, batch_id, have, want in drift:
+        click.echo(f'student {student_id} batch {batch_id}: ledger {have} != payments {want} '
+                   f'(billed, paid, outstanding minor units)')
+    if drift:
+        raise click.ClickException(f'{len(drift)} balance(s) drifted; run `flask ledger rebuild`.')
+    click.echo('Ledger matches payment records.')
+
+
+@ledger_command.command('rebuild')
+@with_appcontext
+def rebuild_command():
+    """Recompute every balance from the payment records."""
+    click.echo(f'Ledger rebuilt: {rebuild()} balance row(s).')
@@ -46,6 +46,9 @@ class Student(db.Model):
     emergency_contact = db.Column(db.String(20))
     class_type = db.Column(db.String(50), nullable=False)  # e.g., 'Hip-Hop', 'Salsa'
     registration_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Change tracking for the incremental change feed (app/changes.py)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
     # profile_picture = db.Column(db.String(200))  # Path to uploaded image, optional
 
     # Relationships
@@ -79,6 +82,8 @@ class Batch(db.Model):
     staff_id = db.Column(db.Integer, db.ForeignKey('staff.id'), nullable=False)
     fee_monthly = db.Column(db.Float, nullable=False)
     fee_quarterly = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
 
     def __repr__(self):
         return f'<Batch {self.name}>'
@@ -89,6 +94,8 @@ class StudentBatch(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
 
     # Unique constraint to prevent duplicate assignments
     __table_args__ = (db.UniqueConstraint('student_id', 'batch_id', name='uix_student_batch'),)
@@ -102,9 +109,11 @@ class Attendance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), nullable=False)
-    date = db.Column(db.Date, default=datetime.utcnow, nullable=False)
+    date = db.Column(db.Date, default=datetime.utcnow, nullable=False, index=True)
     present = db.Column(db.Boolean, default=False, nullable=False)
     notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
 
     # Relationships
     student = db.relationship('Student', backref='attendances')
@@ -116,6 +125,26 @@ class Attendance(db.Model):
     def __repr__(self):
         return f'<Attendance student_id={self.student_id}, batch_id={self.batch_id}, date={self.date}>'
 
+class BatchSlot(db.Model):
+    """Weekly class time of a batch, optionally in a room (see app/timetable.py)."""
+    __tablename__ = 'batch_slot'
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), nullable=False, index=True)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday .. 6 = Sunday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    room = db.Column(db.String(50), index=True)
+
+    # Relationships
+    batch = db.relationship('Batch', backref=db.backref('slots', order_by='[BatchSlot.weekday, BatchSlot.start_time]',
+                                                        cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<BatchSlot batch_id={self.batch_id}, weekday={self.weekday}, {self.start_time}-{self.end_time}>'
+
+# Payment statuses that still count as money owed
+OPEN_PAYMENT_STATUSES = ('unpaid', 'overdue')
+
 class Payment(db.Model):
     """Model for tracking student payments for a batch."""
     __tablename__ = 'payment'
@@ -125,11 +154,82 @@ class Payment(db.Model):
     amount = db.Column(db.Float, nullable=False)
     due_date = db.Column(db.Date, nullable=True)
     paid_date = db.Column(db.Date)
-    status = db.Column(db.String(20), default='unpaid', nullable=False)  # 'paid', 'unpaid', 'partial'
+    status = db.Column(db.String(20), default='unpaid', nullable=False)  # 'paid', 'unpaid', 'partial', 'overdue'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
 
     # Relationships
     student = db.relationship('Student', backref='payments')
     batch = db.relationship('Batch', backref='payments')
 
+    # Composite index so the overdue sweeper can range-scan open payments by due date
+    __table_args__ = (db.Index('ix_payment_status_due_date', 'status', 'due_date'),)
+
+    def __repr__(self):
+        return f'<Payment student_id={self.student_id}, batch_id={self.batch_id}, status={self.status}>'
+
+class JobCheckpoint(db.Model):
+    """Persisted progress marker for background jobs (e.g. the overdue sweeper)."""
+    __tablename__ = 'job_checkpoint'
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.String(255), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<JobCheckpoint {self.name}={self.value}>'
+
+class ReminderLog(db.Model):
+    """Record of a payment reminder that was sent, so the same reminder is never sent twice."""
+    __tablename__ = 'reminder_log'
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # Payment status the reminder was about
+    recipient = db.Column(db.String(120), nullable=False)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # One reminder per payment per status ('unpaid' reminder, then 'overdue' reminder)
+    __table_args__ = (db.UniqueConstraint('payment_id', 'status', name='uix_reminder_payment_status'),)
+
+    def __repr__(self):
+        return f'<ReminderLog payment_id={self.payment_id}, status={self.status}>'
+
+class StudentRiskScore(db.Model):
+    """Nightly snapshot of per-student drop-out risk features (see app/risk.py)."""
+    __tablename__ = 'student_risk_score'
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    computed_on = db.Column(db.Date, nullable=False)  # Date these values last changed
+    attendance_rate = db.Column(db.Float)  # Share of sessions attended in the last 4 weeks, None if no sessions
+    attendance_trend = db.Column(db.Float, nullable=False)  # Change in attendance rate per week
+    consecutive_absences = db.Column(db.Integer, nullable=False)
+    outstanding_balance = db.Column(db.Float, nullable=False)
+    score = db.Column(db.Float, nullable=False, index=True)  # 0 (fine) .. 1 (at risk)
+
+    # Relationships
+    student = db.relationship('Student')
+
+    def __repr__(self):
+        return f'<StudentRiskScore student_id={self.student_id}, score={self.score:.2f}>'
+
+class StudentBalance(db.Model):
+    """Running per-student, per-batch totals in integer minor units (cents/paise), kept by app/ledger.py."""
+    __tablename__ = 'student_balance'
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), primary_key=True)
+    billed_minor = db.Column(db.BigInteger, default=0, nullable=False)  # Every payment record
+    paid_minor = db.Column(db.BigInteger, default=0, nullable=False)  # Status 'paid'
+    outstanding_minor = db.Column(db.BigInteger, default=0, nullable=False)  # Open statuses (unpaid/overdue)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<StudentBalance student_id={self.student_id}, batch_id={self.batch_id}, outstanding={self.outstanding_minor}>'
+
+class DeletedRow(db.Model):
+    """Tombstone of a row deleted from a change-feed table, so warehouse sync can drop it too (see app/changes.py)."""
+    __tablename__ = 'deleted_row'
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
     def __repr__(self):
-        return f'<Payment student_id={self.student_id}, batch_id={self.batch_id}, status={self.status}>'
\ No newline at end of file
+        return f'<DeletedRow {self.table_name}.{self.row_id}>'
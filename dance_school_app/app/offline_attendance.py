@@ -0,0 +1,212 @@
+"""Offline attendance taking with batched sync.
+
+The ``/attendance/offline`` page downloads a roster bundle from
+``/api/attendance/roster`` once. The bundle is a compact JSON document with
+the staff member's batches, their students as ``[id, name]`` pairs, and
+today's marks. It is served with an ETag, so a refresh costs a 304 when
+nothing changed. The page keeps the bundle in ``localStorage`` and records
+marks there too, and a service worker caches the page shell, so attendance
+can be taken with no connection at all.
+
+Queued marks are sent to ``/api/attendance/sync`` in one JSON request and
+written with one read and at most one bulk insert plus one bulk update.
+Records are keyed on ``(student_id, batch_id, date)``:
+
+* the latest mark per key in the request wins;
+* a mark recorded on the device before the server row was last changed
+  (e.g. corrected from another phone after this one went offline) is a
+  conflict: the server row is kept and returned so the page can show it;
+* a mark matching the stored row is ``unchanged``, so a request replayed
+  after a lost response changes nothing;
+* a mark dated more than ``OFFLINE_SYNC_MAX_AGE_DAYS`` ago, or before the
+  archive cutoff, is rejected.
+
+The bundle names its branch, and every sync request sends it back. A request
+for any other branch than the session's is refused (400), so marks queued
+before switching branches never land on the other branch's batch with the
+same id. The page keeps its roster and queue under keys scoped to the user
+and branch, and clears them on logout.
+
+Device clocks are trusted only relative to themselves: each request sends
+the device time it was made (``sent_at``), and ``recorded_at`` times are
+shifted by the difference to the server clock before being compared.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import NamedTuple
+
+from flask import current_app
+from sqlalchemy import insert, select, update
+
+from app import db
+from app.archive import archive_cutoff
+from app.models import Attendance, Batch, Student, StudentBatch
+from app.sharding import current_branch
+
+APPLIED = 'applied'
+UNCHANGED = 'unchanged'
+CONFLICT = 'conflict'
+SUPERSEDED = 'superseded'  # A later mark for the same key in the same request won
+REJECTED = 'rejected'
+
+
+class SyncError(ValueError):
+    """Raised when a sync request is malformed as a whole."""
+
+
+class SyncRecord(NamedTuple):
+    id: str  # Client-side identifier, echoed in the results
+    student_id: int
+    batch_id: int
+    date: date
+    present: bool
+    notes: str
+    recorded_at: datetime  # Server time, after correcting for the device clock
+
+    @property
+    def key(self):
+        return self.student_id, self.batch_id, self.date
+
+
+def allowed_batches(user):
+    """Batches ``user`` may take attendance for: all for admins, their own for staff."""
+    stmt = select(Batch.id, Batch.name).order_by(Batch.name)
+    if user.role != 'admin':
+        stmt = stmt.where(Batch.staff_id == (user.staff.id if user.staff else None))
+    return db.session.execute(stmt).all()
+
+
+def roster_bundle(user, today=None):
+    """Batches, rosters and today's marks for ``user``, in the compact form the offline page stores."""
+    today = today or datetime.utcnow().date()
+    batches = allowed_batches(user)
+    batch_ids = [batch_id for batch_id, _ in batches]
+    students = {batch_id: [] for batch_id in batch_ids}
+    for batch_id, student_id, name in db.session.execute(
+            select(StudentBatch.batch_id, Student.id, Student.full_name)
+            .join(Student, StudentBatch.student_id == Student.id)
+            .where(StudentBatch.batch_id.in_(batch_ids))
+            .order_by(Student.full_name, Student.id)):
+        students[batch_id].append([student_id, name])
+    marks = {str(batch_id): {} for batch_id in batch_ids}
+    for batch_id, student_id, present, notes in db.session.execute(
+            select(Attendance.batch_id, Attendance.student_id, Attendance.present, Attendance.notes)
+            .where(Attendance.batch_id.in_(batch_ids), Attendance.date == today)):
+        marks[str(batch_id)][str(student_id)] = [present, notes or '']
+    return {
+        'branch': current_branch(),
+        'date': today.isoformat(),
+        'batches': [{'id': batch_id, 'name': name, 'students': students[batch_id]} for batch_id, name in batches],
+        'marks': marks,
+    }
+
+
+def _parse_time(value, field):
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise SyncError(f'{field} must be an ISO 8601 timestamp.')
+    if parsed.tzinfo is not None:  # Stored times are naive UTC
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_records(payload, now=None):
+    """``SyncRecord``s from a sync request, and ``(id, reason)`` pairs for records that could not be read."""
+    now = now or datetime.utcnow()
+    if not isinstance(payload, dict) or not isinstance(payload.get('records'), list):
+        raise SyncError('Expected a JSON object with a "records" list.')
+    if payload.get('branch') != current_branch():
+        raise SyncError('These marks were taken in another branch; log in to that branch to sync them.')
+    records = payload['records']
+    if len(records) > current_app.config['OFFLINE_SYNC_MAX_RECORDS']:
+        raise SyncError(f'At most {current_app.config["OFFLINE_SYNC_MAX_RECORDS"]} records per sync.')
+    skew = now - _parse_time(payload['sent_at'], 'sent_at') if payload.get('sent_at') else timedelta(0)
+    latest_day = now.date() + timedelta(days=1)  # Devices east of UTC are a day ahead
+    # Only the hot table is checked for existing rows, so an archived day would be recorded twice
+    earliest_day = max(now.date() - timedelta(days=current_app.config['OFFLINE_SYNC_MAX_AGE_DAYS']),
+                       archive_cutoff(now.date()))
+    parsed, rejected = [], []
+    for index, record in enumerate(records):
+        record_id = str(record.get('id', index)) if isinstance(record, dict) else str(index)
+        try:
+            record_date = date.fromisoformat(record['date'])
+            if record_date > latest_day:
+                raise ValueError('date is in the future')
+            if record_date < earliest_day:
+                raise ValueError('date is too old to sync')
+            recorded_at = min(_parse_time(record['recorded_at'], 'recorded_at') + skew, now)
+            parsed.append(SyncRecord(record_id, int(record['student_id']), int(record['batch_id']), record_date,
+                                     bool(record['present']), str(record.get('notes') or '')[:2000], recorded_at))
+        except (KeyError, TypeError, ValueError) as exc:
+            reason = str(exc) if isinstance(exc, ValueError) else 'missing or invalid field'
+            rejected.append((record_id, reason))
+    return parsed, rejected
+
+
+def _result(record_id, status, **extra):
+    return {'id': record_id, 'status': status, **extra}
+
+
+def _server_state(row):
+    return {'present': row.present, 'notes': row.notes or '', 'updated_at': row.updated_at.isoformat() + 'Z'}
+
+
+def sync(user, records, now=None):
+    """Write the latest mark per key where it is newer than the stored row; the caller commits.
+
+    Returns one result per record, in request order.
+    """
+    now = now or datetime.utcnow()
+    results = {}
+    latest = {}
+    for record in records:
+        current = latest.get(record.key)
+        if current is None or record.recorded_at >= current.recorded_at:
+            if current is not None:
+                results[current.id] = _result(current.id, SUPERSEDED)
+            latest[record.key] = record
+        else:
+            results[record.id] = _result(record.id, SUPERSEDED)
+
+    allowed = {batch_id for batch_id, _ in allowed_batches(user)}
+    candidates = [record for record in latest.values() if record.batch_id in allowed]
+    for record in latest.values():
+        if record.batch_id not in allowed:
+            results[record.id] = _result(record.id, REJECTED, reason='not one of your batches')
+    batch_ids = {record.batch_id for record in candidates}
+    enrolled = set(db.session.execute(select(StudentBatch.student_id, StudentBatch.batch_id)
+                                      .where(StudentBatch.batch_id.in_(batch_ids))).tuples())
+    existing = {}
+    if candidates:
+        for row in db.session.execute(
+                select(Attendance.id, Attendance.student_id, Attendance.batch_id, Attendance.date,
+                       Attendance.present, Attendance.notes, Attendance.updated_at)
+                .where(Attendance.batch_id.in_(batch_ids),
+                       Attendance.student_id.in_({record.student_id for record in candidates}),
+                       Attendance.date.in_({record.date for record in candidates}))):
+            existing[row.student_id, row.batch_id, row.date] = row
+
+    inserts, updates = [], []
+    for record in candidates:
+        row = existing.get(record.key)
+        if row is None and (record.student_id, record.batch_id) not in enrolled:
+            results[record.id] = _result(record.id, REJECTED, reason='student is not in this batch')
+        elif row is None:
+            inserts.append({'student_id': record.student_id, 'batch_id': record.batch_id, 'date': record.date,
+                            'present': record.present, 'notes': record.notes or None,
+                            'created_at': now, 'updated_at': now})
+            results[record.id] = _result(record.id, APPLIED)
+        elif row.present == record.present and (row.notes or '') == record.notes:
+            results[record.id] = _result(record.id, UNCHANGED)
+        elif row.updated_at > record.recorded_at:
+            results[record.id] = _result(record.id, CONFLICT, server=_server_state(row))
+        else:
+            updates.append({'id': row.id, 'present': record.present, 'notes': record.notes or None,
+                            'updated_at': now})
+            results[record.id] = _result(record.id, APPLIED)
+
+    if inserts:
+        db.session.execute(insert(Attendance), inserts)
+    if updates:
+        db.session.execute(update(Attendance), updates)
+    return [results[record.id] for record in records if record.id in results]
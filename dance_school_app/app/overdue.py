@@ -0,0 +1,93 @@
+"""Overdue payment sweeper.
+
+Flips unpaid payments whose due date has passed to 'overdue' with set-based
+UPDATEs. The sweeper keeps a high-water mark (the cutoff date of the previous
+run) in ``job_checkpoint`` so each run only touches the due-date range that
+became overdue since then, served by the ``(status, due_date)`` index.
+
+Run it from cron with ``flask sweep-overdue``.
+"""
+import json
+from datetime import datetime
+
+import click
+from blinker import Namespace
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update
+
+from app import db
+from app.models import Payment, JobCheckpoint
+
+CHECKPOINT_NAME = 'overdue_sweeper'
+
+_signals = Namespace()
+# Sent with ``rows=[(payment_id, student_id, batch_id), ...]`` after each sweep that changed rows
+payments_marked_overdue = _signals.signal('payments-marked-overdue')
+
+
+def _load_high_water_mark():
+    checkpoint = db.session.get(JobCheckpoint, CHECKPOINT_NAME)
+    if checkpoint is None:
+        return None
+    return datetime.strptime(checkpoint.value, '%Y-%m-%d').date()
+
+
+def _store_high_water_mark(cutoff):
+    checkpoint = db.session.get(JobCheckpoint, CHECKPOINT_NAME)
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(name=CHECKPOINT_NAME, value='')
+        db.session.add(checkpoint)
+    checkpoint.value = cutoff.strftime('%Y-%m-%d')
+
+
+def sweep_overdue_payments(today=None, full=False):
+    """Mark newly overdue payments and return ``(payment_id, student_id, batch_id)`` rows.
+
+    Only payments with ``due_date`` in ``[high_water_mark, today)`` are examined.
+    Pass ``full=True`` to ignore the high-water mark, e.g. to pick up payments
+    that were back-dated or reset to 'unpaid' after their range was swept.
+    """
+    cutoff = today or datetime.utcnow().date()
+    high_water_mark = None if full else _load_high_water_mark()
+
+    criteria = [Payment.status == 'unpaid', Payment.due_date < cutoff]
+    if high_water_mark is not None:
+        if high_water_mark >= cutoff:
+            return []
+        criteria.append(Payment.due_date >= high_water_mark)
+
+    stmt = update(Payment).where(*criteria).values(status='overdue') \
+        .execution_options(synchronize_session=False)
+    if db.session.get_bind().dialect.update_returning:
+        result = db.session.execute(stmt.returning(Payment.id, Payment.student_id, Payment.batch_id))
+        rows = [tuple(row) for row in result]
+    else:
+        # No UPDATE ... RETURNING: read the affected keys first, inside the same transaction
+        rows = [tuple(row) for row in db.session.execute(
+            select(Payment.id, Payment.student_id, Payment.batch_id).where(*criteria))]
+        if rows:
+            db.session.execute(update(Payment).where(Payment.id.in_([row[0] for row in rows]))
+                               .values(status='overdue').execution_options(synchronize_session=False))
+
+    _store_high_water_mark(cutoff)
+    db.session.commit()
+
+    if rows:
+        payments_marked_overdue.send(current_app._get_current_object(), rows=rows)
+    return rows
+
+
+@click.command('sweep-overdue')
+@click.option('--full', is_flag=True, help='Ignore the high-water mark and re-examine every past due date.')
+@click.option('--date', 'today', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Treat this date as today (defaults to the current UTC date).')
+@with_appcontext
+def sweep_overdue_command(full, today):
+    """Mark unpaid payments past their due date as overdue."""
+    rows = sweep_overdue_payments(today=today.date() if today else None, full=full)
+    click.echo(json.dumps({
+        'payments': [row[0] for row in rows],
+        'students': sorted({row[1] for row in rows}),
+        'batches': sorted({row[2] for row in rows}),
+    }))
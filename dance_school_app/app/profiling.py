@@ -0,0 +1,286 @@
+"""On-demand request profiling.
+
+A request is profiled when its endpoint is listed in ``PROFILER_ENDPOINTS``,
+when it is picked by ``PROFILER_SAMPLE_RATE`` (1 in N requests), or when a
+logged-in admin sends the ``PROFILER_HEADER`` header (``X-Profile: sample`` or
+``X-Profile: cprofile``; any other value uses ``PROFILER_MODE``). Everything
+else pays one dictionary lookup.
+
+Two profilers are available:
+
+* ``sample``: a background thread records the request thread's stack every
+  ``PROFILER_INTERVAL`` seconds and writes collapsed stacks (``.folded``),
+  which flamegraph.pl, speedscope and similar tools load directly.
+* ``cprofile``: exact call counts and times, written as a ``pstats`` file
+  (``.prof``) for snakeviz or ``python -m pstats``. Only one request per
+  process is cProfiled at a time; overlapping requests are skipped.
+
+Every capture also splits the request's wall time into SQL (cursor execute
+time), template rendering (excluding SQL issued from templates) and the rest
+of the Python time, and is summarised in a ``.json`` file next to the profile.
+Captures go to ``PROFILER_DIR`` (default ``<instance>/profiles``), keeping the
+newest ``PROFILER_KEEP``. ``/admin/profiles`` lists the slowest of them.
+"""
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import before_render_template, g, has_app_context, request, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MODES = ('sample', 'cprofile')
+CAPTURE_NAME = re.compile(r'^[\w.-]+$')
+
+
+class SamplingProfiler:
+    """Counts the request thread's stacks, sampled from a helper thread."""
+
+    suffix = '.folded'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class CallProfiler:
+    """cProfile for the request thread; one at a time per process."""
+
+    suffix = '.prof'
+    _busy = threading.Lock()
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        if not self._busy.acquire(blocking=False):
+            return False
+        self._profile.enable()
+        return True
+
+    def stop(self):
+        self._profile.disable()
+        self._busy.release()
+
+    def write(self, path):
+        self._profile.dump_stats(path)
+
+
+class Capture:
+    """Profiler plus SQL and template timings for one request."""
+
+    def __init__(self, mode, interval):
+        self.mode = mode
+        self.profiler = CallProfiler() if mode == 'cprofile' else SamplingProfiler(interval)
+        self.sql_seconds = self.template_seconds = self.template_sql_seconds = 0.0
+        self.sql_count = 0
+        self._template_starts = []
+        self.started = self.wall_seconds = None
+
+    def start(self):
+        if self.profiler.start() is False:
+            return False
+        self.started = time.perf_counter()
+        return True
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self.started
+        self.profiler.stop()
+
+    def record_sql(self, seconds):
+        self.sql_seconds += seconds
+        self.sql_count += 1
+        if self._template_starts:
+            self.template_sql_seconds += seconds
+
+    def template_started(self):
+        self._template_starts.append(time.perf_counter())
+
+    def template_finished(self):
+        if self._template_starts:
+            started = self._template_starts.pop()
+            if not self._template_starts:  # Nested renders are already inside the outer one
+                self.template_seconds += time.perf_counter() - started
+
+    def summary(self):
+        template = self.template_seconds - self.template_sql_seconds
+        return {
+            'mode': self.mode,
+            'wall_ms': round(self.wall_seconds * 1000, 2),
+            'sql_ms': round(self.sql_seconds * 1000, 2),
+            'sql_count': self.sql_count,
+            'template_ms': round(template * 1000, 2),
+            'python_ms': round((self.wall_seconds - self.sql_seconds - template) * 1000, 2),
+        }
+
+
+class ProfileStore:
+    """Capture files on disk, rotated to the newest ``keep``."""
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, capture, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{meta["endpoint"]}'
+        profile_file = name + capture.profiler.suffix
+        capture.profiler.write(os.path.join(self.directory, profile_file))
+        meta = dict(meta, name=name, profile=profile_file, **capture.summary())
+        with open(os.path.join(self.directory, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        self._rotate()
+        return name
+
+    def _rotate(self):
+        summaries = sorted(entry.name for entry in os.scandir(self.directory) if entry.name.endswith('.json'))
+        for stale in summaries[:max(len(summaries) - self.keep, 0)]:  # Names sort by capture time
+            stem = stale[:-len('.json')]
+            for suffix in ('.json', SamplingProfiler.suffix, CallProfiler.suffix):
+                try:
+                    os.remove(os.path.join(self.directory, stem + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def slowest(self, limit=100):
+        """Capture summaries, slowest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        captures = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    with open(entry.path, encoding='utf-8') as f:
+                        captures.append(json.load(f))
+                except (OSError, ValueError):  # Rotated away or half-written
+                    continue
+        return sorted(captures, key=lambda meta: meta['wall_ms'], reverse=True)[:limit]
+
+    def path(self, filename):
+        """Absolute path of a capture file, or None for anything outside the store."""
+        if not CAPTURE_NAME.match(filename):
+            return None
+        path = os.path.join(self.directory, filename)
+        return path if os.path.isfile(path) else None
+
+
+class Profiler:
+    """Decides which requests to profile and saves their captures."""
+
+    def __init__(self, app):
+        self.endpoints = frozenset(app.config['PROFILER_ENDPOINTS'])
+        self.sample_rate = app.config['PROFILER_SAMPLE_RATE']
+        self.header = app.config['PROFILER_HEADER']
+        self.mode = app.config['PROFILER_MODE']
+        self.interval = app.config['PROFILER_INTERVAL']
+        self.store = ProfileStore(app.config['PROFILER_DIR'] or os.path.join(app.instance_path, 'profiles'),
+                                  app.config['PROFILER_KEEP'])
+
+    def _requested_mode(self):
+        if request.endpoint is None:
+            return None
+        if request.endpoint in self.endpoints or (self.sample_rate and random.randrange(self.sample_rate) == 0):
+            return self.mode
+        value = request.headers.get(self.header) if self.header else None
+        if value and current_user.is_authenticated and current_user.role == 'admin':
+            return value if value in MODES else self.mode
+        return None
+
+    def before_request(self):
+        mode = self._requested_mode()
+        if mode is not None:
+            capture = Capture(mode, self.interval)
+            if capture.start():
+                g.profile_capture = capture
+
+    def after_request(self, response):
+        capture = g.pop('profile_capture', None)
+        if capture is None:
+            return response
+        capture.stop()
+        name = self.store.save(capture, {'endpoint': request.endpoint, 'method': request.method,
+                                         'path': request.full_path.rstrip('?'), 'status': response.status_code,
+                                         'created': datetime.utcnow().isoformat(timespec='seconds')})
+        response.headers['X-Profile-Id'] = name
+        return response
+
+    def teardown_request(self, exc):
+        capture = g.pop('profile_capture', None)  # Still set only if the request failed
+        if capture is not None:
+            capture.stop()
+
+
+def _active_capture():
+    return g.get('profile_capture') if has_app_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_capture() is not None:
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    capture = _active_capture()
+    starts = conn.info.get('profile_query_start')
+    if capture is not None and starts:
+        capture.record_sql(time.perf_counter() - starts.pop())
+
+
+def _template_started(sender, **extra):
+    capture = _active_capture()
+    if capture is not None:
+        capture.template_started()
+
+
+def _template_finished(sender, **extra):
+    capture = _active_capture()
+    if capture is not None:
+        capture.template_finished()
+
+
+def init_app(app):
+    """Register the request hooks, SQL timing events and template signals."""
+    profiler = Profiler(app)
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.extensions['profiler'] = profiler
@@ -0,0 +1,132 @@
+"""Read models for read-only pages, exports and JSON APIs.
+
+Each ``*_rows`` function runs one column-projected query (joins included) and
+returns plain named tuples, so listing pages never hydrate ORM instances: no identity
+map entries, no change tracking and no lazy loads of ``student.user`` or
+``payment.batch`` per row. Records are immutable; routes that edit data keep
+using the models.
+
+The ``*_query`` builders return those statements unexecuted, so the async
+views (``app.async_views``) can run them on the async engine and wrap the rows
+in the same records.
+
+``benchmarks/read_models.py`` compares these against ORM hydration.
+"""
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import func, select
+
+from app import db
+from app.archive import attendance_union
+from app.models import User, Student, Staff, Batch, StudentBatch, Payment
+
+
+class StudentRow(NamedTuple):
+    id: int
+    full_name: str
+    age: int
+    email: str
+    class_type: str
+    contact_number: Optional[str]
+    registration_date: datetime
+
+
+class StaffRow(NamedTuple):
+    id: int
+    name: str
+    email: str
+    phone: Optional[str]
+    specialization: Optional[str]
+    salary: Optional[float]
+    joining_date: datetime
+
+
+class BatchRow(NamedTuple):
+    id: int
+    name: str
+    staff_name: Optional[str]
+    fee_monthly: float
+    fee_quarterly: Optional[float]
+    student_count: int
+
+
+class PaymentRow(NamedTuple):
+    id: int
+    student_id: int
+    student_name: str
+    batch_name: str
+    amount: float
+    due_date: Optional[date]
+    paid_date: Optional[date]
+    status: str
+
+
+class AttendanceRow(NamedTuple):
+    student_id: int
+    student_name: str
+    batch_name: str
+    date: date
+    present: bool
+    notes: Optional[str]
+
+
+def _records(record_type, stmt):
+    return [record_type._make(row) for row in db.session.execute(stmt)]
+
+
+def student_query():
+    return select(Student.id, Student.full_name, Student.age, User.email, Student.class_type,
+                  Student.contact_number, Student.registration_date) \
+        .join(User, Student.user_id == User.id).order_by(Student.id)
+
+
+def student_rows():
+    return _records(StudentRow, student_query())
+
+
+def staff_rows():
+    return _records(StaffRow, select(Staff.id, Staff.name, User.email, Staff.phone, Staff.specialization,
+                                     Staff.salary, Staff.joining_date)
+                    .join(User, Staff.user_id == User.id).order_by(Staff.id))
+
+
+def batch_query(batch_id=None):
+    """Batches with instructor name and enrolment count, optionally just one batch."""
+    counts = select(StudentBatch.batch_id, func.count(StudentBatch.student_id).label('student_count')) \
+        .group_by(StudentBatch.batch_id).subquery()
+    stmt = select(Batch.id, Batch.name, Staff.name, Batch.fee_monthly, Batch.fee_quarterly,
+                  func.coalesce(counts.c.student_count, 0)) \
+        .outerjoin(Staff, Batch.staff_id == Staff.id) \
+        .outerjoin(counts, counts.c.batch_id == Batch.id) \
+        .order_by(Batch.id)
+    if batch_id is not None:
+        stmt = stmt.where(Batch.id == batch_id)
+    return stmt
+
+
+def batch_rows(batch_id=None):
+    return _records(BatchRow, batch_query(batch_id))
+
+
+def payment_rows():
+    return _records(PaymentRow, select(Payment.id, Payment.student_id, Student.full_name, Batch.name, Payment.amount,
+                                       Payment.due_date, Payment.paid_date, Payment.status)
+                    .join(Student, Payment.student_id == Student.id)
+                    .join(Batch, Payment.batch_id == Batch.id)
+                    .order_by(Payment.id))
+
+
+def attendance_query(since=None, until=None):
+    """Attendance across hot and archived months (see ``app.archive``)."""
+    attendance = attendance_union(since, until)
+    return select(attendance.c.student_id, Student.full_name, Batch.name, attendance.c.date,
+                  attendance.c.present, attendance.c.notes) \
+        .select_from(attendance) \
+        .join(Student, attendance.c.student_id == Student.id) \
+        .join(Batch, attendance.c.batch_id == Batch.id) \
+        .order_by(attendance.c.date, attendance.c.id)
+
+
+def attendance_rows(since=None, until=None):
+    return _records(AttendanceRow, attendance_query(since, until))
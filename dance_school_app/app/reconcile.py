@@ -0,0 +1,199 @@
+"""Bank/UPI statement reconciliation.
+
+A statement CSV is matched against open payments in one pass: open payments
+for the months covered by the statement are loaded once into a hash index
+keyed by ``(student_id, amount in minor units, (year, month) of due date)``,
+then every credit is resolved with a dictionary lookup. Confirmed matches are
+applied with a single bulk UPDATE.
+
+Students are identified from the transaction reference/narration, either by
+their student reference (``STU<id>``, e.g. ``STU42``) or by their username.
+"""
+import csv
+import io
+import re
+from collections import defaultdict, deque, namedtuple
+from datetime import datetime
+from decimal import InvalidOperation
+
+from sqlalchemy import bindparam, or_, select, update
+
+from app import db, ledger
+from app.ledger import to_minor
+from app.models import Payment, Student, User, Batch, OPEN_PAYMENT_STATUSES
+
+# Accepted header names (lower-cased) for each statement column
+DATE_COLUMNS = ('date', 'txn date', 'transaction date', 'value date')
+AMOUNT_COLUMNS = ('amount', 'credit', 'credit amount', 'deposit')
+REFERENCE_COLUMNS = ('reference', 'narration', 'description', 'remarks', 'details')
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%d-%b-%Y', '%d %b %Y')
+
+STUDENT_REFERENCE = re.compile(r'\bSTU-?(\d+)\b', re.IGNORECASE)
+TOKEN = re.compile(r'[A-Za-z0-9_.]+')
+
+Transaction = namedtuple('Transaction', 'line date amount_minor reference')
+Match = namedtuple('Match', 'transaction payment_id student_name batch_name due_date')
+Mismatch = namedtuple('Mismatch', 'transaction reason')
+
+
+class StatementError(ValueError):
+    """Raised when an uploaded statement cannot be read."""
+
+
+def _find_column(header, candidates):
+    for index, name in enumerate(header):
+        if name.strip().lower() in candidates:
+            return index
+    return None
+
+
+def _parse_date(value):
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_statement(stream):
+    """Read credits from a statement CSV; returns ``(transactions, mismatches)``."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace')
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if not header:
+        raise StatementError('The statement file is empty.')
+    date_col = _find_column(header, DATE_COLUMNS)
+    amount_col = _find_column(header, AMOUNT_COLUMNS)
+    reference_col = _find_column(header, REFERENCE_COLUMNS)
+    if date_col is None or amount_col is None or reference_col is None:
+        raise StatementError('The statement needs date, amount and reference/narration columns.')
+
+    transactions, mismatches = [], []
+    width = max(date_col, amount_col, reference_col)
+    for line, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) <= width:
+            mismatches.append(Mismatch(Transaction(line, None, None, ' '.join(row)), 'Incomplete row'))
+            continue
+        txn_date = _parse_date(row[date_col])
+        try:
+            amount_minor = to_minor(row[amount_col].replace(',', '').strip())
+        except InvalidOperation:
+            amount_minor = None
+        txn = Transaction(line, txn_date, amount_minor, row[reference_col].strip())
+        if txn_date is None or amount_minor is None:
+            mismatches.append(Mismatch(txn, 'Unreadable date or amount'))
+        elif amount_minor <= 0:
+            continue  # Debits are not student payments
+        else:
+            transactions.append(txn)
+    return transactions, mismatches
+
+
+def _previous_month(month):
+    year, mon = month
+    return (year - 1, 12) if mon == 1 else (year, mon - 1)
+
+
+def build_payment_index(months):
+    """Hash open payments due in ``months`` by ``(student_id, amount_minor, (year, month))``.
+
+    Each key maps to a queue of payments ordered by due date, so two identical
+    fees in the same month are matched one after the other.
+    """
+    first_year, first_month = min(months)
+    last_year, last_month = max(months)
+    start = datetime(first_year, first_month, 1).date()
+    end = datetime(last_year + (last_month == 12), last_month % 12 + 1, 1).date()
+
+    stmt = select(Payment.id, Payment.student_id, Payment.amount, Payment.due_date,
+                  Student.full_name, Batch.name.label('batch_name')) \
+        .join(Student, Payment.student_id == Student.id) \
+        .join(Batch, Payment.batch_id == Batch.id) \
+        .where(Payment.status.in_(OPEN_PAYMENT_STATUSES), Payment.due_date >= start, Payment.due_date < end) \
+        .order_by(Payment.due_date, Payment.id)
+    index = defaultdict(deque)
+    for row in db.session.execute(stmt):
+        key = (row.student_id, to_minor(row.amount), (row.due_date.year, row.due_date.month))
+        index[key].append(row)
+    return index
+
+
+def _student_lookup():
+    """Map usernames to student ids for references that quote a username instead of STU<id>."""
+    rows = db.session.execute(select(User.username, Student.id).join(Student, Student.user_id == User.id))
+    return {username.lower(): student_id for username, student_id in rows}
+
+
+def _resolve_student(reference, usernames):
+    found = STUDENT_REFERENCE.search(reference)
+    if found:
+        return int(found.group(1))
+    for token in TOKEN.findall(reference):
+        student_id = usernames.get(token.lower())
+        if student_id is not None:
+            return student_id
+    return None
+
+
+def match_transactions(transactions):
+    """Match statement credits to open payments in a single pass; returns ``(matches, mismatches)``.
+
+    A credit matches a payment of the same student and amount due in the
+    transaction's month, or failing that the month before (fees paid late).
+    """
+    if not transactions:
+        return [], []
+    months = {(t.date.year, t.date.month) for t in transactions}
+    months |= {_previous_month(month) for month in months}
+    index = build_payment_index(months)
+    usernames = _student_lookup()
+
+    matches, mismatches = [], []
+    for txn in transactions:
+        student_id = _resolve_student(txn.reference, usernames)
+        if student_id is None:
+            mismatches.append(Mismatch(txn, 'No student reference found'))
+            continue
+        month = (txn.date.year, txn.date.month)
+        candidates = index.get((student_id, txn.amount_minor, month)) \
+            or index.get((student_id, txn.amount_minor, _previous_month(month)))
+        if not candidates:
+            mismatches.append(Mismatch(txn, 'No open payment for this student, amount and month'))
+            continue
+        payment = candidates.popleft()
+        matches.append(Match(txn, payment.id, payment.full_name, payment.batch_name, payment.due_date))
+    return matches, mismatches
+
+
+def apply_matches(confirmed):
+    """Mark confirmed ``(payment_id, paid_date)`` pairs as paid with one bulk UPDATE; returns the row count.
+
+    Payments that were settled by someone else since the review screen was
+    rendered are left untouched. The balance ledger is updated in the same
+    transaction.
+    """
+    if not confirmed:
+        return 0
+    paid_dates = dict(confirmed)
+    # Lock the still-open payments so the ledger deltas match exactly the rows updated below
+    open_rows = db.session.execute(
+        select(Payment.id, Payment.student_id, Payment.batch_id, Payment.amount, Payment.status)
+        .where(Payment.id.in_(paid_dates), Payment.status.in_(OPEN_PAYMENT_STATUSES))
+        .with_for_update()).all()
+    if not open_rows:
+        return 0
+    payments = Payment.__table__
+    stmt = update(payments) \
+        .where(payments.c.id == bindparam('payment_id'),
+               # executemany cannot expand IN (...), so the open-status guard is spelled out
+               or_(*(payments.c.status == status for status in OPEN_PAYMENT_STATUSES))) \
+        .values(status='paid', paid_date=bindparam('paid'))
+    result = db.session.execute(stmt, [{'payment_id': row.id, 'paid': paid_dates[row.id]} for row in open_rows])
+    before = [ledger.PaymentState(row.student_id, row.batch_id, row.amount, row.status) for row in open_rows]
+    ledger.record_changes([(state, state._replace(status='paid')) for state in before])
+    db.session.commit()
+    return result.rowcount
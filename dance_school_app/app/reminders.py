@@ -0,0 +1,238 @@
+"""Batched payment reminder mailer.
+
+Open payments that have not been reminded about yet are selected in a single
+query, grouped per student and rendered from ``templates/email``. Rendered
+messages are split into batches and handed to a small thread pool; each worker
+keeps one SMTP connection open and reuses it for every message it sends. A
+shared rate limiter caps the overall send rate. Transient SMTP failures (lost
+connections and 4xx replies such as greylisting) are retried with backoff;
+5xx replies fail the message at once. The delivered reminders of each batch
+are written to ``reminder_log`` and committed as soon as the batch finishes,
+so a run that is interrupted part-way does not send them again.
+
+For local testing point ``MAIL_SERVER``/``MAIL_PORT`` at a stand-in such as
+``python -m aiosmtpd -n -l localhost:8025`` and set ``MAIL_USE_TLS=False``.
+"""
+import smtplib
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.message import EmailMessage
+
+import click
+from flask import current_app, render_template
+from flask.cli import with_appcontext
+from sqlalchemy import and_, select
+
+from app import db, ledger
+from app.models import Payment, Student, User, Batch, ReminderLog, OPEN_PAYMENT_STATUSES
+
+# Lost connections: reconnect and retry
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, socket.timeout)
+
+
+def _reply_codes(exc):
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return [code for code, _ in exc.recipients.values()]
+    return [exc.smtp_code] if isinstance(exc, smtplib.SMTPResponseException) else []
+
+
+def _is_transient(exc):
+    """True for lost connections and 4xx replies (greylisting, mailbox full); 5xx and anything else are final."""
+    if isinstance(exc, CONNECTION_ERRORS):
+        return True
+    codes = _reply_codes(exc)
+    return bool(codes) and all(400 <= code < 500 for code in codes)
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing ``rate`` acquisitions per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SMTPConnectionPool:
+    """Hands every worker thread its own long-lived SMTP connection."""
+
+    def __init__(self, server, port, use_tls=False, username=None, password=None, timeout=30):
+        self.server = server
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                conn.starttls()
+            if self.username:
+                conn.login(self.username, self.password)
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+            raise
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    def discard(self):
+        """Drop the calling thread's connection after an error so the next send reconnects."""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            try:
+                conn.close()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.quit()
+            except (smtplib.SMTPException, OSError):
+                conn.close()
+
+
+def pending_reminders(student_ids=None):
+    """Return open payments without a reminder for their current status, grouped per student.
+
+    A single query anti-joins ``reminder_log`` so already-reminded payments are
+    filtered out in the database. Returns an ordered mapping of student id to a
+    dict with the student's name, email, list of payment rows and ledger balance.
+    """
+    stmt = select(Payment.id, Payment.amount, Payment.due_date, Payment.status,
+                  Student.id.label('student_id'), Student.full_name, User.email, Batch.name.label('batch_name')) \
+        .join(Student, Payment.student_id == Student.id) \
+        .join(User, Student.user_id == User.id) \
+        .join(Batch, Payment.batch_id == Batch.id) \
+        .outerjoin(ReminderLog, and_(ReminderLog.payment_id == Payment.id, ReminderLog.status == Payment.status)) \
+        .where(Payment.status.in_(OPEN_PAYMENT_STATUSES), User.active.is_(True), ReminderLog.id.is_(None)) \
+        .order_by(Student.id, Payment.due_date)
+    if student_ids:
+        stmt = stmt.where(Student.id.in_(student_ids))
+
+    grouped = OrderedDict()
+    for row in db.session.execute(stmt):
+        entry = grouped.setdefault(row.student_id, {'name': row.full_name, 'email': row.email, 'payments': []})
+        entry['payments'].append(row)
+    balances = ledger.outstanding_by_student(list(grouped))
+    for student_id, entry in grouped.items():
+        entry['balance'] = ledger.from_minor(balances.get(student_id, 0))
+    return grouped
+
+
+def build_message(student, sender):
+    """Render the reminder email for one student from the text and HTML templates."""
+    total = student['balance']  # Everything owed, including payments already reminded about
+    context = {'student_name': student['name'], 'payments': student['payments'], 'total': total}
+    message = EmailMessage()
+    message['Subject'] = 'Payment reminder from Dance School'
+    message['From'] = sender
+    message['To'] = student['email']
+    message.set_content(render_template('email/payment_reminder.txt', **context))
+    message.add_alternative(render_template('email/payment_reminder.html', **context), subtype='html')
+    return message
+
+
+def _send_batch(batch, pool, limiter, max_retries):
+    """Send a batch of ``(student_id, message)`` pairs on the worker's connection."""
+    results = []
+    for student_id, message in batch:
+        error = None
+        for attempt in range(max_retries):
+            limiter.acquire()
+            try:
+                pool.get().send_message(message)
+                error = None
+                break
+            except (smtplib.SMTPException, OSError) as exc:
+                error = exc
+                if not _is_transient(exc):
+                    break
+                if isinstance(exc, CONNECTION_ERRORS):
+                    pool.discard()
+                if attempt + 1 < max_retries:
+                    time.sleep(min(2 ** attempt, 30))
+        results.append((student_id, error))
+    return results
+
+
+def send_payment_reminders(student_ids=None, dry_run=False):
+    """Send one reminder email per student with open payments; returns ``(sent, failed)`` counts."""
+    config = current_app.config
+    pending = pending_reminders(student_ids)
+    if not pending:
+        return 0, 0
+
+    messages = [(student_id, build_message(student, config['MAIL_DEFAULT_SENDER']))
+                for student_id, student in pending.items()]
+    if dry_run:
+        return len(messages), 0
+
+    batch_size = config['REMINDER_BATCH_SIZE']
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+    pool = SMTPConnectionPool(config['MAIL_SERVER'], config['MAIL_PORT'], use_tls=config['MAIL_USE_TLS'],
+                              username=config['MAIL_USERNAME'], password=config['MAIL_PASSWORD'],
+                              timeout=config['MAIL_TIMEOUT'])
+    limiter = RateLimiter(config['REMINDER_RATE_LIMIT'])
+    sent = failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=config['REMINDER_WORKERS']) as executor:
+            futures = [executor.submit(_send_batch, batch, pool, limiter, config['REMINDER_MAX_RETRIES'])
+                       for batch in batches]
+            # Log each batch as it finishes; the session is only touched from this thread
+            for future in as_completed(futures):
+                for student_id, error in future.result():
+                    if error is not None:
+                        failed += 1
+                        current_app.logger.warning('Payment reminder to student %s failed: %s', student_id, error)
+                        continue
+                    sent += 1
+                    student = pending[student_id]
+                    db.session.add_all([ReminderLog(payment_id=p.id, status=p.status, recipient=student['email'])
+                                        for p in student['payments']])
+                db.session.commit()
+    finally:
+        pool.close_all()
+    return sent, failed
+
+
+@click.command('send-reminders')
+@click.option('--student', 'student_ids', type=int, multiple=True,
+              help='Only remind this student (repeatable), e.g. the ids reported by sweep-overdue.')
+@click.option('--dry-run', is_flag=True, help='Render the reminders without sending or logging them.')
+@with_appcontext
+def send_reminders_command(student_ids, dry_run):
+    """Email payment reminders for unpaid and overdue payments."""
+    sent, failed = send_payment_reminders(student_ids=student_ids or None, dry_run=dry_run)
+    click.echo(f'{"Rendered" if dry_run else "Sent"} {sent} reminder(s), {failed} failed.')
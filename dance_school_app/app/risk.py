@@ -0,0 +1,193 @@
+"""At-risk student report.
+
+Attendance for the trailing trend window and open payments are loaded as
+column arrays, and every per-student feature is computed with NumPy group
+reductions (``bincount``/``ufunc.at``) over a dense student index, so the cost
+does not grow with a Python loop per student:
+
+* ``attendance_rate`` - share of sessions attended in the last 4 weeks
+* ``attendance_trend`` - least-squares slope of attendance over the trend
+  window, in attendance-rate change per week (negative means drifting away)
+* ``consecutive_absences`` - absences since the student's last attended session
+* ``outstanding_balance`` - amount owed, from the balance ledger
+
+Results are kept in ``student_risk_score`` and refreshed nightly by
+``flask compute-risk``. Each run only reads the trailing window of attendance
+(via the attendance date index) and only writes rows whose values changed.
+"""
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+import pandas as pd
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, select, update
+
+from app import db
+from app.archive import attendance_union
+from app.models import Student, StudentBatch, Batch, Staff, StudentRiskScore, JobCheckpoint, \
+    StudentBalance
+
+CHECKPOINT_NAME = 'risk_scores'
+
+RATE_WINDOW_DAYS = 28
+TREND_WINDOW_DAYS = 56
+
+# Weights of each feature in the 0..1 risk score
+WEIGHT_ABSENCE = 0.4  # 1 - attendance rate
+WEIGHT_TREND = 0.2  # Falling attendance, saturating at -25% per week
+WEIGHT_STREAK = 0.3  # Consecutive absences, saturating at 4
+WEIGHT_BALANCE = 0.1  # Any money owed
+TREND_SATURATION = 0.25
+STREAK_SATURATION = 4
+
+FEATURE_COLUMNS = ('attendance_rate', 'attendance_trend', 'consecutive_absences', 'outstanding_balance', 'score')
+
+
+def _read_frame(stmt):
+    return pd.read_sql(stmt, db.session.connection())
+
+
+def compute_risk_features(today=None):
+    """Compute risk features for every student; returns a DataFrame indexed by student id."""
+    today = today or datetime.utcnow().date()
+    trend_start = today - timedelta(days=TREND_WINDOW_DAYS)
+    rate_start_day = TREND_WINDOW_DAYS - RATE_WINDOW_DAYS
+
+    student_ids = _read_frame(select(Student.id))['id'].to_numpy()
+    student_ids.sort()
+    n = len(student_ids)
+
+    window = attendance_union(since=trend_start, until=today)  # Hot table only unless the window reaches archives
+    attendance = _read_frame(select(window.c.student_id, window.c.date, window.c.present))
+    # Dense 0..n-1 position of each row's student, and the day offset inside the trend window
+    idx = np.searchsorted(student_ids, attendance['student_id'].to_numpy())
+    day = (pd.to_datetime(attendance['date']).to_numpy().astype('datetime64[D]')
+           - np.datetime64(trend_start, 'D')).astype(np.int64)
+    present = attendance['present'].to_numpy().astype(np.float64)
+
+    # Rolling 4-week attendance rate
+    recent = day > rate_start_day
+    sessions = np.bincount(idx[recent], minlength=n)
+    attended = np.bincount(idx[recent], weights=present[recent], minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = np.where(sessions > 0, attended / sessions, np.nan)
+
+    # Least-squares slope of presence against time (in weeks) over the trend window
+    weeks = day / 7.0
+    count = np.bincount(idx, minlength=n).astype(np.float64)
+    sum_x = np.bincount(idx, weights=weeks, minlength=n)
+    sum_y = np.bincount(idx, weights=present, minlength=n)
+    sum_xx = np.bincount(idx, weights=weeks * weeks, minlength=n)
+    sum_xy = np.bincount(idx, weights=weeks * present, minlength=n)
+    denominator = count * sum_xx - sum_x * sum_x
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trend = np.where(denominator > 0, (count * sum_xy - sum_x * sum_y) / denominator, 0.0)
+
+    # Trailing absences: rows after each student's last attended session (rows sorted by student, day)
+    order = np.lexsort((day, idx))
+    sorted_idx = idx[order]
+    position = np.arange(len(order))
+    last_row = np.full(n, -1)
+    np.maximum.at(last_row, sorted_idx, position)
+    last_present = np.full(n, -1)
+    attended_rows = present[order] > 0
+    np.maximum.at(last_present, sorted_idx[attended_rows], position[attended_rows])
+    first_row = np.full(n, len(order))
+    np.minimum.at(first_row, sorted_idx, position)
+    streak_start = np.maximum(last_present, first_row - 1)
+    streak = np.where(last_row >= 0, last_row - streak_start, 0)
+
+    owed = _read_frame(select(StudentBalance.student_id, StudentBalance.outstanding_minor)
+                       .where(StudentBalance.outstanding_minor != 0))
+    balance = np.bincount(np.searchsorted(student_ids, owed['student_id'].to_numpy()),
+                          weights=owed['outstanding_minor'].to_numpy(), minlength=n) / 100
+
+    score = (WEIGHT_ABSENCE * (1 - np.nan_to_num(rate, nan=1.0))
+             + WEIGHT_TREND * np.clip(-trend / TREND_SATURATION, 0, 1)
+             + WEIGHT_STREAK * np.minimum(streak / STREAK_SATURATION, 1)
+             + WEIGHT_BALANCE * (balance > 0))
+
+    return pd.DataFrame({
+        'attendance_rate': rate,
+        'attendance_trend': np.round(trend, 4),
+        'consecutive_absences': streak.astype(np.int64),
+        'outstanding_balance': np.round(balance, 2),
+        'score': np.round(score, 4),
+    }, index=pd.Index(student_ids, name='student_id'))
+
+
+def refresh_risk_scores(today=None):
+    """Recompute features and write only new or changed rows to ``student_risk_score``.
+
+    Returns ``(inserted, updated, deleted)`` row counts.
+    """
+    today = today or datetime.utcnow().date()
+    features = compute_risk_features(today)
+    stored = _read_frame(select(StudentRiskScore.student_id, *(getattr(StudentRiskScore, c) for c in FEATURE_COLUMNS))) \
+        .set_index('student_id')
+
+    new_ids = features.index.difference(stored.index)
+    gone_ids = stored.index.difference(features.index)
+    common = features.index.intersection(stored.index)
+    before, after = stored.loc[common, list(FEATURE_COLUMNS)], features.loc[common, list(FEATURE_COLUMNS)]
+    changed_mask = ~((before == after) | (before.isna() & after.isna())).all(axis=1)
+    changed_ids = common[changed_mask.to_numpy()]
+
+    def records(ids):
+        frame = features.loc[ids].astype(object).where(features.loc[ids].notna(), None)
+        return [{'student_id': int(student_id), 'computed_on': today, **row}
+                for student_id, row in zip(ids, frame.to_dict('records'))]
+
+    if len(new_ids):
+        db.session.execute(insert(StudentRiskScore), records(new_ids))
+    if len(changed_ids):
+        db.session.execute(update(StudentRiskScore), records(changed_ids))
+    if len(gone_ids):
+        db.session.execute(delete(StudentRiskScore).where(StudentRiskScore.student_id.in_(gone_ids.tolist())))
+    checkpoint = db.session.get(JobCheckpoint, CHECKPOINT_NAME) or JobCheckpoint(name=CHECKPOINT_NAME, value='')
+    checkpoint.value = today.strftime('%Y-%m-%d')
+    db.session.add(checkpoint)
+    db.session.commit()
+    return len(new_ids), len(changed_ids), len(gone_ids)
+
+
+def last_refreshed():
+    """Date of the last snapshot refresh, or None if it has never run."""
+    checkpoint = db.session.get(JobCheckpoint, CHECKPOINT_NAME)
+    return datetime.strptime(checkpoint.value, '%Y-%m-%d').date() if checkpoint else None
+
+
+def at_risk_rankings(staff_id=None, limit=10):
+    """Rank students by risk score per batch and per staff member from the cached snapshot.
+
+    Builds the snapshot first if it has never been built. Returns
+    ``(by_batch, by_staff)``; each maps a batch or staff name to its top ``limit`` rows.
+    """
+    if last_refreshed() is None:
+        refresh_risk_scores()
+
+    stmt = select(StudentRiskScore.student_id, Student.full_name, Batch.id.label('batch_id'),
+                  Batch.name.label('batch_name'), Staff.id.label('staff_id'), Staff.name.label('staff_name'),
+                  *(getattr(StudentRiskScore, c) for c in FEATURE_COLUMNS)) \
+        .join(Student, StudentRiskScore.student_id == Student.id) \
+        .join(StudentBatch, StudentBatch.student_id == Student.id) \
+        .join(Batch, StudentBatch.batch_id == Batch.id) \
+        .join(Staff, Batch.staff_id == Staff.id)
+    if staff_id is not None:
+        stmt = stmt.where(Batch.staff_id == staff_id)
+    frame = _read_frame(stmt).sort_values('score', ascending=False, kind='stable')
+    frame['attendance_rate'] = frame['attendance_rate'].astype(object).where(frame['attendance_rate'].notna(), None)
+
+    by_batch = {name: group.head(limit).to_dict('records') for name, group in frame.groupby('batch_name', sort=True)}
+    per_staff = frame.drop_duplicates(['staff_id', 'student_id'])
+    by_staff = {name: group.head(limit).to_dict('records') for name, group in per_staff.groupby('staff_name', sort=True)}
+    return by_batch, by_staff
+
+
+@click.command('compute-risk')
+@with_appcontext
+def compute_risk_command():
+    """Refresh the at-risk student snapshot (run nightly)."""
+    inserted, updated, deleted = refresh_risk_scores()
+    click.echo(f'Risk scores refreshed: {inserted} new, {updated} changed, {deleted} removed.')
@@ -1,9 +1,13 @@
-from flask import render_template, redirect, url_for, flash, request, send_file, jsonify, abort
+from flask import render_template, redirect, url_for, flash, request, send_file, jsonify, abort, current_app, session, g, Response, stream_with_context
 from flask_login import login_user, logout_user, current_user, login_required 
 from app import db
-from app.models import User, Student, Staff, Batch, Attendance, Payment, StudentBatch
-from app.forms import LoginForm, StudentRegistrationForm, StaffRegistrationForm, AttendanceForm, PaymentForm , BatchForm, AssignStudentForm, PublicStudentRegistrationForm
-from sqlalchemy import func
+from app.models import User, Student, Staff, Batch, BatchSlot, Attendance, Payment, StudentBatch
+from app.forms import LoginForm, StudentRegistrationForm, StaffRegistrationForm, AttendanceForm, PaymentForm , BatchForm, AssignStudentForm, EnrollBatchesForm, TransferRosterForm, PublicStudentRegistrationForm, StatementUploadForm, ReconcileConfirmForm
+from app.reconcile import parse_statement, match_transactions, apply_matches, StatementError
+from app.risk import at_risk_rankings, last_refreshed
+from app import attendance_matrix, changes, charts, checkin, enrollment, ledger, offline_attendance, read_models, sharding, timetable
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from io import BytesIO
 import pandas as pd
 from datetime import datetime, date, timedelta
@@ -14,7 +18,7 @@ import os
 bp = Blueprint('main', __name__)
 
 def role_required(roles):
-    """Decorator to restrict access to specific roles."""
+    """Decorator to restrict access to specific roles (works on sync and async views)."""
     from functools import wraps
     def decorator(f):
         @wraps(f)
@@ -22,7 +26,7 @@ def role_required(roles):
             if current_user.role not in roles:
                 flash('Access denied.', 'danger')
                 return redirect(url_for('main.dashboard'))
-            return f(*args, **kwargs)
+            return current_app.ensure_sync(f)(*args, **kwargs)
         return decorated_function
     return decorator
 # Authentication Routes
@@ -31,9 +35,14 @@ def login():
     if current_user.is_authenticated:
         return redirect(url_for('main.dashboard'))
     form = LoginForm()
+    form.branch.choices = [(code, code.title()) for code in sharding.branch_codes()]
     if form.validate_on_submit():
+        # Users belong to a branch: look them up in the branch's database and keep it for the session
+        branch = form.branch.data if form.branch.data in sharding.branch_codes() else current_app.config['PRIMARY_BRANCH']
+        g.branch = branch
         user = User.query.filter_by(username=form.username.data).first()
         if user and user.check_password(form.password.data) and user.active:
+            session['branch'] = branch
             login_user(user)
             flash('Login successful!', 'success')
             return redirect(url_for('main.dashboard'))
@@ -64,30 +73,14 @@ def dashboard():
 @login_required
 @role_required(['admin'])
 def admin_dashboard():
-    total_students = Student.query.count()
-    total_staff = Staff.query.count()
-    total_batches = Batch.query.count()
-    unpaid_payments = Payment.query.filter_by(status='unpaid').count()
-
-    # Chart Data: Students by Class Type
-    students_by_class = db.session.query(Student.class_type, func.count(Student.id)) \
-        .group_by(Student.class_type).all()
-    class_labels = [row[0] for row in students_by_class]
-    class_counts = [row[1] for row in students_by_class]
-
-    # Chart Data: Payments by Status
-    payments_status = db.session.query(Payment.status, func.count(Payment.id)) \
-        .group_by(Payment.status).all()
-    status_labels = [row[0] for row in payments_status]
-    status_counts = [row[1] for row in payments_status]
-
-    return render_template('admin_dashboard.html', 
-                         total_students=total_students, 
-                         total_staff=total_staff, 
-                         total_batches=total_batches, 
-                         unpaid_payments=unpaid_payments,
-                         class_labels=class_labels, class_counts=class_counts,
-                         status_labels=status_labels, status_counts=status_counts)
+    def summary_counts():
+        # Called from inside the cached summary fragment, so the counts only run on a cache miss
+        counts = charts.run_counts(charts.admin_counts())
+        counts['outstanding'] = ledger.from_minor(counts.pop('outstanding_minor'))
+        return counts
+
+    # Chart panels are fetched by the browser from the /api/charts/* endpoints
+    return render_template('admin_dashboard.html', summary_counts=summary_counts)
 
 @bp.route('/admin/staff/register', methods=['GET', 'POST'])
 @login_required
@@ -117,8 +110,66 @@ def staff_list():
     if current_user.role != 'admin':
         flash('Access denied.', 'danger')
         return redirect(url_for('main.dashboard'))
-    staff_members = Staff.query.all()
-    return render_template('staff_list.html', staff_members=staff_members)
+    # The cached fragment calls the loader, so the query only runs on a cache miss
+    return render_template('staff_list.html', staff_rows=read_models.staff_rows)
+
+@bp.route('/admin/profiles')
+@login_required
+@role_required(['admin'])
+def profiles():
+    """Slowest profiled requests, with their SQL / template / Python split."""
+    profiler = current_app.extensions['profiler']
+    return render_template('profiles.html', captures=profiler.store.slowest(), profiler=profiler)
+
+@bp.route('/admin/profiles/<filename>')
+@login_required
+@role_required(['admin'])
+def profile_file(filename):
+    path = current_app.extensions['profiler'].store.path(filename)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='application/json' if filename.endswith('.json') else 'application/octet-stream',
+                     as_attachment=True, download_name=filename)
+
+@bp.route('/admin/slow-queries')
+@login_required
+@role_required(['admin'])
+def slow_queries():
+    """Statements over the slow-query threshold in this worker, by fingerprint."""
+    slow_log = current_app.extensions.get('slow_queries')
+    return render_template('slow_queries.html', entries=slow_log.report() if slow_log else [],
+                           threshold_ms=current_app.config['SLOW_QUERY_THRESHOLD_MS'])
+
+@bp.route('/admin/compression-stats')
+@login_required
+@role_required(['admin'])
+def compression_stats():
+    """Per-endpoint response compression totals since the worker started."""
+    middleware = current_app.extensions.get('compression')
+    return jsonify({'endpoints': middleware.stats.snapshot() if middleware else {}})
+
+def branch_summaries():
+    """Admin counts from every branch database in parallel, plus their totals and the unreachable branches."""
+    per_branch, failures = sharding.fan_out(lambda: charts.run_counts(charts.admin_counts()))
+    totals = sharding.merge_counts(per_branch)
+    for counts in (*per_branch.values(), totals):
+        counts['outstanding'] = ledger.from_minor(counts.pop('outstanding_minor', 0))
+    return per_branch, totals, sorted(failures)
+
+@bp.route('/admin/branches')
+@login_required
+@role_required(['admin'])
+def branch_overview():
+    """Students, staff, batches and dues per branch and across all branches."""
+    per_branch, totals, failed = branch_summaries()
+    return render_template('branches.html', per_branch=per_branch, totals=totals, failed=failed)
+
+@bp.route('/api/branches/summary')
+@login_required
+@role_required(['admin'])
+def branches_summary():
+    per_branch, totals, failed = branch_summaries()
+    return jsonify({'branches': per_branch, 'totals': totals, 'failed': failed})
 
 # Student Routes
 @bp.route('/student/register', methods=['GET', 'POST'])
@@ -160,8 +211,7 @@ def register_student():
 @login_required
 @role_required(['admin', 'staff'])
 def student_list():
-    students = Student.query.filter_by().all()
-    return render_template('student_list.html', students=students)
+    return render_template('student_list.html', student_rows=read_models.student_rows)
 
 @bp.route('/student/edit/<int:student_id>', methods=['GET', 'POST'])
 @login_required
@@ -202,34 +252,11 @@ def staff_dashboard():
     staff = current_user.staff
     assigned_batches = Batch.query.filter_by(staff_id=staff.id).all()
 
-    # Get IDs of batches assigned to the staff
-    assigned_batch_ids = [b.id for b in assigned_batches]
-
-    # Summary card data
-    total_batches = len(assigned_batches)
-    # Count unique students across all assigned batches
-    total_students = db.session.query(func.count(func.distinct(StudentBatch.student_id)))\
-        .filter(StudentBatch.batch_id.in_(assigned_batch_ids)).scalar() or 0
-    # Count unpaid payments for assigned batches
-    unpaid_payments = Payment.query.filter(Payment.batch_id.in_(assigned_batch_ids), Payment.status == 'unpaid').count()
-
-    # Chart Data: Students per Batch
-    batch_student_counts = db.session.query(Batch.name, func.count(StudentBatch.student_id)) \
-        .join(StudentBatch).filter(Batch.staff_id == staff.id).group_by(Batch.name).all()
-    batch_labels = [row[0] for row in batch_student_counts]
-    batch_counts = [row[1] for row in batch_student_counts]
-
-    # Chart Data: Attendance Summary (Present vs Absent)
-    attendance_summary = db.session.query(Attendance.present, func.count(Attendance.id)) \
-        .join(Batch).filter(Batch.staff_id == staff.id).group_by(Attendance.present).all()
-    attendance_labels = ['Present' if row[0] else 'Absent' for row in attendance_summary]
-    attendance_counts = [row[1] for row in attendance_summary]
-
-    return render_template('staff_dashboard.html', 
-                           total_students=total_students, total_batches=total_batches, unpaid_payments=unpaid_payments,
-                           batches=assigned_batches, 
-                           batch_labels=batch_labels, batch_counts=batch_counts,
-                           attendance_labels=attendance_labels, attendance_counts=attendance_counts)
+    # Summary card data: unique students, batches and open payments across assigned batches
+    counts = charts.run_counts(charts.staff_counts(staff.id))
+
+    # Chart panels are fetched by the browser from the /api/charts/* endpoints
+    return render_template('staff_dashboard.html', batches=assigned_batches, **counts)
 
 # Batch Routes
 @bp.route('/batch/create', methods=['GET', 'POST'])
@@ -239,8 +266,24 @@ def create_batch():
     form = BatchForm()  # Assume a BatchForm with name, staff_id, fee_monthly, fee_quarterly
     form.staff_id.choices = [(s.id, s.name) for s in Staff.query.all()]
     if form.validate_on_submit():
+        staff = db.session.get(Staff, form.staff_id.data)
+        slots = [timetable.SlotRow(None, None, form.name.data, form.staff_id.data, staff.name if staff else None,
+                                   entry.weekday.data, entry.start_time.data, entry.end_time.data,
+                                   timetable.normalize_room(entry.room.data))
+                 for entry in form.slots if entry.start_time.data is not None]
+        # Only this instructor's and these rooms' slots can clash with the new batch
+        clashes = timetable.Timetable.load(staff_id=form.staff_id.data,
+                                           rooms=[slot.room for slot in slots if slot.room]).check(slots)
+        if clashes:
+            for clash in clashes:
+                taken_by = 'Instructor' if clash.kind == 'staff' else 'Room'
+                flash(f'{taken_by} {clash.resource} is already booked: {clash.first.describe()} '
+                      f'overlaps {clash.second.describe()}.', 'danger')
+            return render_template('create_batch.html', form=form)
         batch = Batch(name=form.name.data, staff_id=form.staff_id.data, 
                       fee_monthly=form.fee_monthly.data, fee_quarterly=form.fee_quarterly.data)
+        batch.slots = [BatchSlot(weekday=slot.weekday, start_time=slot.start_time, end_time=slot.end_time,
+                                 room=slot.room) for slot in slots]
         db.session.add(batch)
         db.session.commit()
         flash('Batch created successfully.', 'success')
@@ -251,24 +294,98 @@ def create_batch():
 @login_required
 @role_required(['admin', 'staff'])
 def batch_list():
-    batches = Batch.query.all()
-    return render_template('batch_list.html', batches=batches)
+    return render_template('batch_list.html', batch_rows=read_models.batch_rows)
+
+@bp.route('/admin/timetable/conflicts')
+@login_required
+@role_required(['admin'])
+def timetable_conflicts():
+    """Every pair of batch slots that double-books an instructor or a room."""
+    return render_template('timetable_conflicts.html', conflicts=timetable.Timetable.load().conflicts(),
+                           weekdays=timetable.WEEKDAYS)
+
+@bp.route('/api/timetable')
+@login_required
+@role_required(['admin', 'staff'])
+def timetable_calendar():
+    """Weekly calendar events, optionally for one instructor (staff_id) or room, dated for ?week=YYYY-MM-DD."""
+    week_start = None
+    if request.args.get('week'):
+        try:
+            week = date.fromisoformat(request.args['week'])
+        except ValueError:
+            abort(400)
+        week_start = week - timedelta(days=week.weekday())
+    events = timetable.calendar(staff_id=request.args.get('staff_id', type=int), room=request.args.get('room'),
+                                week_start=week_start)
+    return jsonify({'week_start': week_start.isoformat() if week_start else None, 'events': events})
+
+@bp.route('/api/timetable/conflicts')
+@login_required
+@role_required(['admin'])
+def timetable_conflicts_json():
+    return jsonify({'conflicts': [{'kind': conflict.kind, 'resource': conflict.resource,
+                                   'slots': [conflict.first.id, conflict.second.id],
+                                   'batches': [conflict.first.batch_id, conflict.second.batch_id],
+                                   'description': f'{conflict.first.describe()} overlaps {conflict.second.describe()}'}
+                                  for conflict in timetable.Timetable.load().conflicts()]})
+
+def _choices(stmt):
+    """(id, label) select choices from a two-column query, without loading ORM objects."""
+    return [tuple(row) for row in db.session.execute(stmt)]
 
 @bp.route('/batch/assign_student/<int:batch_id>', methods=['GET', 'POST'])
 @login_required
 @role_required(['admin', 'staff'])
 def assign_student_to_batch(batch_id):
+    """Enroll any number of students in a batch with one statement."""
     batch = Batch.query.get_or_404(batch_id)
-    form = AssignStudentForm()  # Assume form with student_id
-    form.student_id.choices = [(s.id, s.full_name) for s in Student.query.all()]
+    form = AssignStudentForm()
+    enrolled = select(StudentBatch.student_id).where(StudentBatch.batch_id == batch_id)
+    form.student_ids.choices = _choices(select(Student.id, Student.full_name).where(Student.id.not_in(enrolled))
+                                        .order_by(Student.full_name))
     if form.validate_on_submit():
-        student_batch = StudentBatch(student_id=form.student_id.data, batch_id=batch_id)
-        db.session.add(student_batch)
+        summary = enrollment.enroll(form.student_ids.data, [batch_id])
         db.session.commit()
-        flash('Student assigned to batch.', 'success')
+        flash(summary.message(), 'success')
         return redirect(url_for('main.batch_list'))
     return render_template('assign_student.html', form=form, batch=batch)
 
+@bp.route('/student/<int:student_id>/enroll', methods=['GET', 'POST'])
+@login_required
+@role_required(['admin', 'staff'])
+def enroll_student(student_id):
+    """Enroll one student in several batches with one statement."""
+    student = Student.query.get_or_404(student_id)
+    form = EnrollBatchesForm()
+    enrolled = select(StudentBatch.batch_id).where(StudentBatch.student_id == student_id)
+    form.batch_ids.choices = _choices(select(Batch.id, Batch.name).where(Batch.id.not_in(enrolled)).order_by(Batch.name))
+    if form.validate_on_submit():
+        summary = enrollment.enroll([student_id], form.batch_ids.data)
+        db.session.commit()
+        flash(summary.message(), 'success')
+        return redirect(url_for('main.student_list'))
+    return render_template('enroll_student.html', form=form, student=student)
+
+@bp.route('/batch/<int:batch_id>/transfer', methods=['GET', 'POST'])
+@login_required
+@role_required(['admin'])
+def transfer_roster(batch_id):
+    """Move or copy a batch's roster, or part of it, to another batch in one transaction."""
+    batch = Batch.query.get_or_404(batch_id)
+    form = TransferRosterForm()
+    form.target_batch_id.choices = _choices(select(Batch.id, Batch.name).where(Batch.id != batch_id).order_by(Batch.name))
+    form.student_ids.choices = _choices(select(Student.id, Student.full_name)
+                                        .join(StudentBatch, StudentBatch.student_id == Student.id)
+                                        .where(StudentBatch.batch_id == batch_id).order_by(Student.full_name))
+    if form.validate_on_submit():
+        summary = enrollment.transfer(batch_id, form.target_batch_id.data, student_ids=form.student_ids.data or None,
+                                      copy=form.copy.data)
+        db.session.commit()
+        flash(summary.message(), 'success')
+        return redirect(url_for('main.batch_list'))
+    return render_template('transfer_roster.html', form=form, batch=batch)
+
 # Attendance Routes
 @bp.route('/attendance/mark/<int:batch_id>', methods=['GET', 'POST'])
 @login_required
@@ -278,19 +395,170 @@ def mark_attendance(batch_id):
     students = Student.query.join(StudentBatch).filter(StudentBatch.batch_id == batch_id).all()
     forms = {student.id: AttendanceForm(prefix=str(student.id)) for student in students}
     if request.method == 'POST':
+        today = datetime.utcnow().date()
+        # Marking the same batch again today corrects the existing records
+        marked = {a.student_id: a for a in Attendance.query.filter_by(batch_id=batch_id, date=today)}
         for student in students:
             form = forms[student.id]
             if form.validate_on_submit():
-                attendance = Attendance(student_id=student.id, batch_id=batch_id, 
-                                       date=datetime.utcnow().date(), 
-                                       present=form.present.data, 
-                                       notes=form.notes.data)
-                db.session.add(attendance)
+                attendance = marked.get(student.id)
+                if attendance is None:
+                    attendance = Attendance(student_id=student.id, batch_id=batch_id, date=today)
+                    db.session.add(attendance)
+                attendance.present = form.present.data
+                attendance.notes = form.notes.data
         db.session.commit()
         flash('Attendance marked successfully.', 'success')
         return redirect(url_for('main.batch_list'))
     return render_template('attendance.html', forms=forms, students=students, batch=batch)
 
+# Monthly attendance matrix
+def _matrix_batch_month(batch_id):
+    """The batch (staff only see their own) and the requested ``?month=YYYY-MM``, this month by default."""
+    batch = Batch.query.get_or_404(batch_id)
+    if current_user.role == 'staff' and batch.staff_id != current_user.staff.id:
+        abort(403)
+    month = request.args.get('month')
+    try:
+        month = datetime.strptime(month, '%Y-%m').date() if month else datetime.utcnow().date().replace(day=1)
+    except ValueError:
+        abort(400)
+    return batch, month
+
+@bp.route('/batch/<int:batch_id>/attendance/matrix')
+@login_required
+@role_required(['admin', 'staff'])
+def attendance_matrix_view(batch_id):
+    batch, month = _matrix_batch_month(batch_id)
+    matrix = attendance_matrix.cached(batch.id, month)
+    previous_month = (month - timedelta(days=1)).replace(day=1)
+    next_month = attendance_matrix.month_end(month) + timedelta(days=1)
+    return render_template('attendance_matrix.html', batch=batch, month=month, matrix=matrix,
+                           previous_month=previous_month, next_month=next_month,
+                           xlsx_available=attendance_matrix.Workbook is not None)
+
+@bp.route('/api/batches/<int:batch_id>/attendance-matrix')
+@login_required
+@role_required(['admin', 'staff'])
+def attendance_matrix_json(batch_id):
+    batch, month = _matrix_batch_month(batch_id)
+    return jsonify(attendance_matrix.cached(batch.id, month).to_dict())
+
+@bp.route('/batch/<int:batch_id>/attendance/matrix.<any(csv, xlsx):fmt>')
+@login_required
+@role_required(['admin', 'staff'])
+def attendance_matrix_export(batch_id, fmt):
+    batch, month = _matrix_batch_month(batch_id)
+    matrix = attendance_matrix.cached(batch.id, month)
+    filename = f'attendance_{batch.id}_{month:%Y-%m}.{fmt}'
+    if fmt == 'csv':
+        return Response(stream_with_context(matrix.iter_csv()), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+    workbook = matrix.to_xlsx()
+    if workbook is None:
+        flash('XLSX export needs openpyxl installed; download the CSV instead.', 'warning')
+        return redirect(url_for('main.attendance_matrix_view', batch_id=batch.id, month=f'{month:%Y-%m}'))
+    return send_file(BytesIO(workbook), download_name=filename, as_attachment=True,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+# Offline attendance
+@bp.route('/attendance/offline')
+@login_required
+@role_required(['admin', 'staff'])
+def offline_attendance_page():
+    """Attendance page that works without a connection and syncs queued marks in one request."""
+    return render_template('attendance_offline.html')
+
+@bp.route('/attendance/offline-sw.js')
+def offline_attendance_worker():
+    """Service worker for the offline page; served from /attendance/ so its scope covers the page."""
+    response = send_file(os.path.join(current_app.static_folder, 'js', 'attendance_sw.js'),
+                         mimetype='text/javascript', max_age=0)
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/api/attendance/roster')
+@login_required
+@role_required(['admin', 'staff'])
+def offline_attendance_roster():
+    """Roster bundle for the offline page, revalidated by ETag."""
+    response = jsonify(offline_attendance.roster_bundle(current_user))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+@bp.route('/api/attendance/sync', methods=['POST'])
+@login_required
+@role_required(['admin', 'staff'])
+def offline_attendance_sync():
+    """Apply queued offline marks in one transaction; safe to retry."""
+    if not request.is_json:
+        return jsonify({'error': 'Expected a JSON request.'}), 415
+    try:
+        records, unreadable = offline_attendance.parse_records(request.get_json(silent=True))
+    except offline_attendance.SyncError as exc:
+        return jsonify({'error': str(exc)}), 400
+    try:
+        results = offline_attendance.sync(current_user, records)
+        db.session.commit()
+    except IntegrityError:
+        # Another request inserted one of these keys first; a retry sees the row and resolves against it
+        db.session.rollback()
+        return jsonify({'error': 'Attendance changed while syncing; retry.'}), 409
+    results += [{'id': record_id, 'status': offline_attendance.REJECTED, 'reason': reason}
+                for record_id, reason in unreadable]
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return jsonify({'results': results, 'counts': counts})
+
+# Self check-in API
+@bp.route('/api/batches/<int:batch_id>/checkin-session')
+@login_required
+@role_required(['admin', 'staff'])
+def checkin_session(batch_id):
+    """Check-in code for today's class of a batch, to show on a kiosk or as a QR code."""
+    batch = Batch.query.get_or_404(batch_id)
+    if current_user.role == 'staff' and batch.staff_id != current_user.staff.id:
+        abort(403)
+    return jsonify({
+        'batch_id': batch.id,
+        'date': datetime.utcnow().date().isoformat(),
+        'token': checkin.session_token(current_app, batch.id),
+        'expires_in': current_app.config['CHECKIN_SESSION_MAX_AGE']
+    })
+
+@bp.route('/api/students/<int:student_id>/checkin-token')
+@login_required
+def student_checkin_token(student_id):
+    """Personal check-in token for a student card; students may only fetch their own."""
+    if current_user.role == 'student' and current_user.student.id != student_id:
+        abort(403)
+    student = Student.query.get_or_404(student_id)
+    return jsonify({'student_id': student.id, 'token': checkin.student_token(current_app, student.id)})
+
+@bp.route('/api/checkin', methods=['POST'])
+def api_checkin():
+    """Queue a check-in from a session code plus a student token or a logged-in student."""
+    payload = request.get_json(silent=True) or {}
+    try:
+        branch, batch_id, session_date = checkin.read_session_token(current_app, payload.get('session'))
+        if payload.get('student'):
+            student_branch, student_id = checkin.read_student_token(current_app, payload['student'])
+        elif current_user.is_authenticated and current_user.role == 'student':
+            student_branch, student_id = sharding.current_branch(), current_user.student.id
+        else:
+            raise checkin.CheckinError('A student token or a student login is required.')
+        if student_branch != branch:
+            raise checkin.CheckinError('This check-in code belongs to another branch.')
+        checkin.check_enrolled(branch, student_id, batch_id)
+    except checkin.CheckinError as exc:
+        return jsonify({'error': str(exc)}), 400
+    queued = current_app.extensions['checkin'].add(branch, student_id, batch_id, session_date)
+    return jsonify({'status': 'queued' if queued else 'duplicate', 'student_id': student_id,
+                    'batch_id': batch_id}), 202
+
 # Payment Routes
 @bp.route('/payment/update/<int:student_id>', methods=['GET', 'POST'])
 @login_required
@@ -326,11 +594,13 @@ def update_payment(student_id):
 
         if payment:
             # Update existing payment
+            before = ledger.PaymentState.of(payment)
             payment.batch_id = batch_id
             payment.amount = amount
             payment.due_date = datetime.strptime(due_date_str, '%Y-%m-%d').date() if due_date_str else None
             payment.paid_date = datetime.strptime(paid_date_str, '%Y-%m-%d').date() if paid_date_str else None
             payment.status = status
+            ledger.record_change(before, ledger.PaymentState.of(payment))
             flash('Payment updated successfully.', 'success')
         else:
             # Create new payment
@@ -347,6 +617,7 @@ def update_payment(student_id):
                 status=status
             )
             db.session.add(new_payment)
+            ledger.record_change(None, ledger.PaymentState.of(new_payment))
             flash('Payment created successfully.', 'success')
 
         db.session.commit()
@@ -364,8 +635,44 @@ def payment_list():
     if current_user.role not in ['admin', 'staff']:
         flash('Access denied.', 'danger')
         return redirect(url_for('main.dashboard'))
-    payments = Payment.query.all()
-    return render_template('payment_list.html', payments=payments)
+    return render_template('payment_list.html', payment_rows=read_models.payment_rows)
+
+@bp.route('/payment/reconcile', methods=['GET', 'POST'])
+@login_required
+@role_required(['admin', 'staff'])
+def reconcile_payments():
+    """Match a bank/UPI statement against open payments and show the review screen."""
+    form = StatementUploadForm()
+    if form.validate_on_submit():
+        try:
+            transactions, mismatches = parse_statement(form.statement.data.stream)
+        except StatementError as exc:
+            flash(str(exc), 'danger')
+            return render_template('reconcile.html', form=form)
+        matches, unmatched = match_transactions(transactions)
+        return render_template('reconcile.html', form=form, confirm_form=ReconcileConfirmForm(),
+                               matches=matches, mismatches=mismatches + unmatched, reviewed=True)
+    return render_template('reconcile.html', form=form)
+
+@bp.route('/payment/reconcile/apply', methods=['POST'])
+@login_required
+@role_required(['admin', 'staff'])
+def apply_reconciliation():
+    """Mark the matches confirmed on the review screen as paid."""
+    form = ReconcileConfirmForm()
+    if not form.validate_on_submit():
+        flash('The review form expired. Please upload the statement again.', 'danger')
+        return redirect(url_for('main.reconcile_payments'))
+    confirmed = []
+    for value in request.form.getlist('match'):
+        payment_id, _, paid_date = value.partition('|')
+        try:
+            confirmed.append((int(payment_id), datetime.strptime(paid_date, '%Y-%m-%d').date()))
+        except ValueError:
+            continue
+    updated = apply_matches(confirmed)
+    flash(f'{updated} payment(s) marked as paid.', 'success')
+    return redirect(url_for('main.payment_list'))
 
 # Student Dashboard
 @bp.route('/student/dashboard')
@@ -373,51 +680,35 @@ def payment_list():
 @role_required(['student'])
 def student_dashboard():
     student = current_user.student
-    attendances = Attendance.query.filter_by(student_id=student.id).order_by(Attendance.date.desc()).all()
+    attendances = Attendance.query.filter_by(student_id=student.id).order_by(Attendance.date.desc()).limit(10).all()
     payments = Payment.query.filter_by(student_id=student.id).all()
     batches = Batch.query.join(StudentBatch).filter(StudentBatch.student_id == student.id).all()
 
-    # Summary card data
-    total_batches = len(batches)
-    unpaid_payments = Payment.query.filter_by(student_id=student.id, status='unpaid').count()
-    
-    # Chart Data: Attendance Over Last 30 Days
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    recent_attendances = Attendance.query.filter(Attendance.student_id == student.id, Attendance.date >= thirty_days_ago) \
-        .order_by(Attendance.date).all()
-    
-    # For summary card
-    recent_attendance = sum(1 for att in recent_attendances if att.present)
-    
-    # For chart
-    attendance_dates = [att.date.strftime('%Y-%m-%d') for att in recent_attendances]
-    attendance_status = [1 if att.present else 0 for att in recent_attendances]  # 1 for present, 0 for absent
-
-    # Chart Data: Payments by Status
-    student_payments_status = db.session.query(Payment.status, func.count(Payment.id)) \
-        .filter(Payment.student_id == student.id).group_by(Payment.status).all()
-    student_status_labels = [row[0] for row in student_payments_status]
-    student_status_counts = [row[1] for row in student_payments_status]
+    # Summary card data, including present days over the last 30 days
+    counts = charts.run_counts(charts.student_counts(student.id))
+    balance_due = ledger.from_minor(counts.pop('balance_minor'))
 
+    # Chart panels are fetched by the browser from the /api/charts/* endpoints
     return render_template('student_dashboard.html', 
                            student=student, attendances=attendances, payments=payments, batches=batches,
-                           total_batches=total_batches, unpaid_payments=unpaid_payments, recent_attendance=recent_attendance,
-                           attendance_dates=attendance_dates, attendance_status=attendance_status,
-                           student_status_labels=student_status_labels, student_status_counts=student_status_counts)
+                           balance_due=balance_due, **counts)
 
 # Reports Export
 @bp.route('/reports/students')
 @login_required
 @role_required(['admin'])
 def export_students():
-    students = Student.query.all()
+    return students_csv(read_models.student_rows())
+
+def students_csv(students):
+    """CSV download of ``StudentRow`` records (shared with the async view)."""
     df = pd.DataFrame([{
         'ID': s.id,
         'Name': s.full_name,
         'Age': s.age,
         'Class': s.class_type,
         'Contact': s.contact_number,
-        'Email': s.user.email
+        'Email': s.email
     } for s in students])
     output = BytesIO()
     df.to_csv(output, index=False)
@@ -428,11 +719,14 @@ def export_students():
 @login_required
 @role_required(['admin'])
 def export_attendance():
-    attendances = Attendance.query.all()
+    return attendance_csv(read_models.attendance_rows())
+
+def attendance_csv(attendances):
+    """CSV download of ``AttendanceRow`` records (shared with the async view)."""
     df = pd.DataFrame([{
         'Student ID': a.student_id,
-        'Student Name': a.student.full_name,
-        'Batch': a.batch.name,
+        'Student Name': a.student_name,
+        'Batch': a.batch_name,
         'Date': a.date,
         'Present': 'Yes' if a.present else 'No',
         'Notes': a.notes
@@ -442,6 +736,15 @@ def export_attendance():
     output.seek(0)
     return send_file(output, mimetype='text/csv', download_name='attendance_report.csv', as_attachment=True)
 
+@bp.route('/reports/at-risk')
+@login_required
+@role_required(['admin', 'staff'])
+def at_risk_report():
+    """Students most at risk of dropping out, ranked per batch and per instructor."""
+    staff_id = current_user.staff.id if current_user.role == 'staff' else None
+    by_batch, by_staff = at_risk_rankings(staff_id=staff_id)
+    return render_template('at_risk.html', by_batch=by_batch, by_staff=by_staff, refreshed_on=last_refreshed())
+
 @bp.route('/register', methods=['GET', 'POST'])
 def public_register():
     """Public registration page for students."""
@@ -485,7 +788,11 @@ def public_register():
 @login_required
 def get_batch_fee(batch_id):
     """Get fee information for a batch."""
-    batch = Batch.query.get_or_404(batch_id)
+    return batch_fee_json(next(iter(read_models.batch_rows(batch_id)), None))
+
+def batch_fee_json(batch):
+    if batch is None:
+        abort(404)
     return jsonify({
         'fee_monthly': batch.fee_monthly,
         'fee_quarterly': batch.fee_quarterly
@@ -495,8 +802,9 @@ def get_batch_fee(batch_id):
 @login_required
 def get_all_batches():
     """Get all batches."""
-    batches = Batch.query.all()
-    
+    return batches_json(read_models.batch_rows())
+
+def batches_json(batches):
     return jsonify({
         'batches': [{
             'id': batch.id,
@@ -505,3 +813,86 @@ def get_all_batches():
             'fee_quarterly': batch.fee_quarterly
         } for batch in batches]
     })
+
+@bp.route('/api/dashboard/summary')
+@login_required
+def dashboard_summary():
+    """The logged-in user's dashboard summary cards (money in integer minor units)."""
+    return jsonify(charts.run_counts(charts.counts_for(current_user)))
+
+@bp.route('/api/changes')
+@login_required
+@role_required(['admin'])
+def api_changes():
+    """Rows changed since a cursor, for incremental warehouse sync."""
+    page_size = current_app.config['CHANGE_FEED_PAGE_SIZE']
+    limit = min(request.args.get('limit', page_size, type=int), page_size)
+    try:
+        rows, cursor, has_more = changes.changes_since(request.args.get('since'), max(limit, 1))
+    except changes.CursorError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify({'changes': rows, 'cursor': cursor, 'has_more': has_more})
+
+def chart_response(payload):
+    """JSON chart data the browser may cache briefly and revalidate by ETag."""
+    response = jsonify(payload)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['CHART_CACHE_SECONDS']
+    response.add_etag()
+    return response.make_conditional(request)
+
+# Each chart endpoint picks its query for the current user here; the async views reuse these
+def students_by_class_query():
+    if current_user.role != 'admin':
+        abort(403)
+    return charts.students_by_class()
+
+def payments_by_status_query():
+    """All payments for admins, an instructor's batches for staff, own payments for students."""
+    if current_user.role == 'admin':
+        return charts.payments_by_status()
+    elif current_user.role == 'staff':
+        return charts.payments_by_status(staff_id=current_user.staff.id)
+    return charts.payments_by_status(student_id=current_user.student.id)
+
+def students_per_batch_query():
+    if current_user.role not in ['admin', 'staff']:
+        abort(403)
+    staff_id = current_user.staff.id if current_user.role == 'staff' else None
+    return charts.students_per_batch(staff_id=staff_id)
+
+def attendance_summary_query():
+    if current_user.role not in ['admin', 'staff']:
+        abort(403)
+    staff_id = current_user.staff.id if current_user.role == 'staff' else None
+    return charts.attendance_summary(staff_id=staff_id)
+
+def attendance_30_days_query():
+    if current_user.role != 'student':
+        abort(403)
+    return charts.attendance_last_30_days(current_user.student.id)
+
+@bp.route('/api/charts/students-by-class')
+@login_required
+def chart_students_by_class():
+    return chart_response(charts.run(students_by_class_query()))
+
+@bp.route('/api/charts/payments-by-status')
+@login_required
+def chart_payments_by_status():
+    return chart_response(charts.run(payments_by_status_query()))
+
+@bp.route('/api/charts/students-per-batch')
+@login_required
+def chart_students_per_batch():
+    return chart_response(charts.run(students_per_batch_query()))
+
+@bp.route('/api/charts/attendance-summary')
+@login_required
+def chart_attendance_summary():
+    return chart_response(charts.run(attendance_summary_query()))
+
+@bp.route('/api/charts/attendance-30-days')
+@login_required
+def chart_attendance_30_days():
+    return chart_response(charts.run(attendance_30_days_query()))
@@ -0,0 +1,167 @@
+"""Branches (studios), each with its own database.
+
+Every branch keeps its students, batches, enrolments, attendance, payments and
+everything derived from them in a separate database with the full schema.
+Users and staff are per branch as well, since those rows reference them. The
+primary branch (``PRIMARY_BRANCH``) lives in ``SQLALCHEMY_DATABASE_URI``;
+further branches are listed in ``BRANCH_DATABASES`` (``code=url,...``) and
+become Flask-SQLAlchemy binds named ``branch_<code>``.
+
+``BranchSession.get_bind`` routes every statement to the current branch's
+engine. The current branch is:
+- inside a request, ``g.branch``, chosen at login and kept in the session
+  cookie;
+- for CLI commands and background threads, ``BRANCH``
+  (``BRANCH=north flask sweep-overdue``);
+- otherwise the primary branch.
+
+Use ``use_branch(code)`` to switch explicitly.
+
+Cross-branch admin reports call ``fan_out``. It runs a function once per
+branch, in parallel threads with their own app context and session, and
+returns each branch's result for merging (``merge_counts``).
+
+Branch databases are created and migrated only by ``flask shards upgrade``,
+which applies the Alembic migrations to every branch database, passing
+``-x shard=<code>`` to ``migrations/env.py``. Run it after adding a branch to
+``BRANCH_DATABASES`` and after every deploy with new revisions.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import click
+from flask import current_app, g, has_app_context, session
+from flask.cli import with_appcontext
+from flask_sqlalchemy.session import Session
+
+BIND_PREFIX = 'branch_'
+
+
+def configure(app):
+    """Add a bind per extra branch; call before ``db.init_app`` creates the engines."""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for code, url in app.config['BRANCH_DATABASES'].items():
+        if code == app.config['PRIMARY_BRANCH']:
+            raise ValueError(f'Branch {code!r} is the primary branch; it uses SQLALCHEMY_DATABASE_URI.')
+        binds[BIND_PREFIX + code] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def branch_codes(app=None):
+    """Primary branch first, then the others in configuration order."""
+    config = (app or current_app).config
+    return [config['PRIMARY_BRANCH'], *config['BRANCH_DATABASES']]
+
+
+def current_branch():
+    primary = current_app.config['PRIMARY_BRANCH']
+    return g.get('branch') or current_app.config['BRANCH'] or primary
+
+
+def engine_for(code):
+    engines = current_app.extensions['sqlalchemy'].engines
+    if code == current_app.config['PRIMARY_BRANCH']:
+        return engines[None]
+    try:
+        return engines[BIND_PREFIX + code]
+    except KeyError:
+        raise LookupError(f'Unknown branch {code!r}.') from None
+
+
+def database_url(code):
+    return engine_for(code).url
+
+
+class BranchSession(Session):
+    """Session that sends every statement to the current branch's database."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and current_branch() != current_app.config['PRIMARY_BRANCH']:
+            return engine_for(current_branch())
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def use_branch(code):
+    """Route this app context's queries to ``code`` for the duration of the block."""
+    engine_for(code)  # Fail fast on an unknown branch
+    previous = g.get('branch')
+    g.branch = code
+    try:
+        yield
+    finally:
+        g.branch = previous
+
+
+def fan_out(fn, codes=None):
+    """Run ``fn()`` once per branch in parallel; returns ``(results, failures)`` keyed by branch code."""
+    app = current_app._get_current_object()
+    codes = list(codes or branch_codes(app))
+
+    def run(code):
+        with app.app_context():  # Own session per thread, removed at teardown
+            g.branch = code
+            try:
+                return code, fn(), None
+            except Exception as exc:
+                app.logger.exception('Branch %s failed during fan-out', code)
+                return code, None, exc
+
+    results, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(codes), app.config['SHARD_FANOUT_WORKERS']))) as pool:
+        for code, result, error in pool.map(run, codes):
+            if error is None:
+                results[code] = result
+            else:
+                failures[code] = error
+    return results, failures
+
+
+def merge_counts(per_branch):
+    """Sum ``{branch: {name: number}}`` into ``{name: total}``."""
+    totals = {}
+    for counts in per_branch.values():
+        for name, value in counts.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def select_branch():
+    """``before_request`` hook: route the request to the branch stored in the session."""
+    code = session.get('branch')
+    g.branch = code if code in branch_codes() else current_app.config['PRIMARY_BRANCH']
+
+
+def init_app(app):
+    """Route requests by session branch; branch schemas come from ``flask shards upgrade``."""
+    app.before_request(select_branch)
+
+    @app.context_processor
+    def branch_context():
+        return {'branch_codes': branch_codes(app), 'current_branch': current_branch()}
+
+
+@click.group('shards')
+def shards_command():
+    """List branch databases or migrate all of them."""
+
+
+@shards_command.command('list')
+@with_appcontext
+def list_command():
+    """Show each branch and its database."""
+    for code in branch_codes():
+        click.echo(f'{code}: {engine_for(code).url.render_as_string(hide_password=True)}')
+
+
+@shards_command.command('upgrade')
+@click.option('--revision', default='head', help='Target revision (default head).')
+@click.option('--branch', 'codes', multiple=True, help='Only these branches (default all).')
+@with_appcontext
+def upgrade_command(revision, codes):
+    """Apply Alembic migrations to every branch database in turn."""
+    from flask_migrate import upgrade
+    for code in codes or branch_codes():
+        engine_for(code)
+        click.echo(f'Upgrading branch {code} to {revision}')
+        upgrade(revision=revision, x_arg=[f'shard={code}'])
@@ -0,0 +1,204 @@
+"""Slow-query log.
+
+Times every statement with SQLAlchemy's ``before_cursor_execute`` /
+``after_cursor_execute`` events on the app's engines. Statements slower than
+``SLOW_QUERY_THRESHOLD_MS`` are logged (logger ``app.slow_queries``, and as
+JSON Lines to ``SLOW_QUERY_LOG_FILE`` when set) with the Flask endpoint that
+issued them, redacted parameters, the driver's row count and the query plan.
+
+Slow statements are aggregated per worker by fingerprint: the statement with
+literals removed and ``IN`` lists collapsed, so the same query from the same
+code path always lands in one entry. Each entry keeps per-day counts and mean
+durations, so a query that degrades as the tables grow shows a rising trend on
+``/admin/slow-queries``. The plan (``EXPLAIN QUERY PLAN`` on SQLite,
+``EXPLAIN`` on PostgreSQL, SELECTs only) is captured the first time a
+fingerprint is slow and refreshed at most every
+``SLOW_QUERY_EXPLAIN_INTERVAL`` seconds.
+
+Parameters are redacted: strings and bytes are replaced by their type and
+length; numbers, booleans, dates and NULLs are kept.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import date, datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = 14
+EXPLAIN_PREFIX = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'\?|%\(\w+\)s|%s|(?<!:):\w+|\$\d+')  # Not PostgreSQL ::casts
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(statement):
+    """The statement with literals and placeholders replaced by ``?`` and ``IN`` lists collapsed."""
+    text = _STRING.sub('?', statement)
+    text = _PLACEHOLDER.sub('?', text)
+    text = _NUMBER.sub('?', text)
+    text = _IN_LIST.sub('IN (?)', text)
+    return _SPACE.sub(' ', text).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+def _redact_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return f'<{type(value).__name__}:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def redact(parameters):
+    if isinstance(parameters, dict):
+        return {key: _redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) if isinstance(value, (dict, list, tuple)) else _redact_value(value)
+                for value in parameters]
+    return _redact_value(parameters)
+
+
+def _origin():
+    if has_request_context():
+        return request.endpoint or '<unmatched>'
+    return f'<{threading.current_thread().name}>'
+
+
+def explain(cursor, dialect_name, statement, parameters):
+    """Plan for a SELECT as text lines, run on the statement's own DBAPI connection; None if not applicable."""
+    prefix = EXPLAIN_PREFIX.get(dialect_name)
+    if prefix is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    raw = cursor.connection.cursor()
+    postgres = dialect_name == 'postgresql'
+    try:
+        if postgres:  # A failed EXPLAIN must not abort the caller's transaction
+            raw.execute('SAVEPOINT slow_query_explain')
+        raw.execute(prefix + statement, parameters)
+        plan = [str(row[-1]) for row in raw.fetchall()]  # The detail column of SQLite's plan rows
+        if postgres:
+            raw.execute('RELEASE SAVEPOINT slow_query_explain')
+        return plan
+    except Exception as exc:
+        if postgres:
+            raw.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+        return [f'EXPLAIN failed: {exc}']
+    finally:
+        raw.close()
+
+
+class SlowQueryLog:
+    """Per-process aggregate of slow statements by fingerprint (least recently seen evicted first)."""
+
+    def __init__(self, threshold_ms, explain=True, explain_interval=3600, max_fingerprints=500, log_file=None):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.max_fingerprints = max_fingerprints
+        self.log_file = log_file
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('slow_query_start')
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+        if seconds >= self.threshold:
+            self.record(conn, cursor, statement, parameters, executemany, seconds)
+
+    def _wants_plan(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is None or entry['explained_at'] is None or now - entry['explained_at'] >= self.explain_interval
+
+    def record(self, conn, cursor, statement, parameters, executemany, seconds):
+        normalized = normalize(statement)
+        key = fingerprint(normalized)
+        now = time.time()
+        plan = None
+        if self.explain and not executemany and self._wants_plan(key, now):
+            plan = explain(cursor, conn.dialect.name, statement, parameters)
+        rowcount = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        origin = _origin()
+        sample = {'fingerprint': key, 'ms': round(seconds * 1000, 2), 'endpoint': origin, 'rowcount': rowcount,
+                  'parameters': redact(parameters), 'statement': normalized,
+                  'at': datetime.utcnow().isoformat(timespec='seconds')}
+        self._aggregate(key, normalized, sample, plan, now)
+        logger.warning('Slow query %s (%.1f ms, %s): %s', key, sample['ms'], origin, normalized[:200])
+        if self.log_file:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(sample, plan=plan)) + '\n')
+
+    def _aggregate(self, key, normalized, sample, plan, now):
+        today = sample['at'][:10]
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = {'fingerprint': key, 'statement': normalized, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                         'endpoints': Counter(), 'daily': OrderedDict(), 'plan': None, 'explained_at': None}
+            entry['count'] += 1
+            entry['total_ms'] += sample['ms']
+            entry['max_ms'] = max(entry['max_ms'], sample['ms'])
+            entry['endpoints'][sample['endpoint']] += 1
+            entry['last'] = sample
+            day = entry['daily'].setdefault(today, [0, 0.0])
+            day[0] += 1
+            day[1] += sample['ms']
+            while len(entry['daily']) > HISTORY_DAYS:
+                entry['daily'].popitem(last=False)
+            if plan is not None:
+                entry['plan'], entry['explained_at'] = plan, now
+            self._entries[key] = entry
+            while len(self._entries) > self.max_fingerprints:
+                self._entries.popitem(last=False)
+
+    def report(self):
+        """Aggregated entries, most total time first, with ``mean_ms`` and a per-day ``trend``."""
+        with self._lock:
+            entries = [dict(entry, endpoints=entry['endpoints'].most_common(), daily=dict(entry['daily']))
+                       for entry in self._entries.values()]
+        for entry in entries:
+            entry['mean_ms'] = round(entry['total_ms'] / entry['count'], 2)
+            entry['trend'] = [(day, count, round(total / count, 2)) for day, (count, total) in entry['daily'].items()]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def attach(self, engine):
+        if not event.contains(engine, 'before_cursor_execute', self.before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+
+def init_app(app):
+    """Time statements on every engine of ``app`` when ``SLOW_QUERY_THRESHOLD_MS`` is positive."""
+    if app.config['SLOW_QUERY_THRESHOLD_MS'] <= 0:
+        return
+    slow_log = SlowQueryLog(app.config['SLOW_QUERY_THRESHOLD_MS'], explain=app.config['SLOW_QUERY_EXPLAIN'],
+                            explain_interval=app.config['SLOW_QUERY_EXPLAIN_INTERVAL'],
+                            max_fingerprints=app.config['SLOW_QUERY_MAX_FINGERPRINTS'],
+                            log_file=app.config['SLOW_QUERY_LOG_FILE'])
+    with app.app_context():
+        for engine in db.engines.values():
+            slow_log.attach(engine)
+    app.extensions['slow_queries'] = slow_log
@@ -0,0 +1,320 @@
+// Offline attendance: the roster bundle and queued marks live in localStorage and are synced in one request
+(function () {
+    const root = document.getElementById('offline-attendance');
+    if (!root) {
+        return;
+    }
+
+    // Per user and branch, so a shared phone never mixes rosters or syncs marks into another branch
+    const ROSTER_KEY = `attendance.${root.dataset.storageScope}.roster`;
+    const QUEUE_KEY = `attendance.${root.dataset.storageScope}.queue`;
+    const SYNC_DELAY = 2000; // ms after the last mark before syncing while online
+    const SYNC_BATCH = 500; // Marks per request; the server accepts up to OFFLINE_SYNC_MAX_RECORDS
+
+    const statusBox = document.getElementById('offline-status');
+    const conflictBox = document.getElementById('offline-conflicts');
+    const batchSelect = document.getElementById('offline-batch');
+    const dateInput = document.getElementById('offline-date');
+    const studentList = document.getElementById('offline-students');
+    const syncButton = document.getElementById('offline-sync');
+
+    let roster = load(ROSTER_KEY, null);
+    let queue = load(QUEUE_KEY, {}); // "student:batch:date" -> latest unsynced mark
+    let syncing = false;
+    let syncTimer = null;
+
+    function load(key, fallback) {
+        try {
+            const value = localStorage.getItem(key);
+            return value ? JSON.parse(value) : fallback;
+        } catch (error) {
+            return fallback;
+        }
+    }
+
+    function save(key, value) {
+        localStorage.setItem(key, JSON.stringify(value));
+    }
+
+    function recordKey(studentId, batchId, day) {
+        return `${studentId}:${batchId}:${day}`;
+    }
+
+    function localToday() {
+        const now = new Date();
+        now.setMinutes(now.getMinutes() - now.getTimezoneOffset());
+        return now.toISOString().slice(0, 10);
+    }
+
+    function updateStatus(extra) {
+        const pending = Object.keys(queue).length;
+        let message = navigator.onLine ? 'Online. ' : 'Offline. ';
+        message += pending ? `${pending} mark(s) waiting to sync.` : 'Everything is synced.';
+        if (extra) {
+            message += ' ' + extra;
+        }
+        statusBox.className = 'alert alert-' + (!pending ? 'success' : navigator.onLine ? 'info' : 'warning');
+        statusBox.textContent = message;
+    }
+
+    // Queued marks first, then the server's marks (the bundle carries the server's date only)
+    function markFor(studentId, batchId, day) {
+        const queued = queue[recordKey(studentId, batchId, day)];
+        if (queued) {
+            return [queued.present, queued.notes];
+        }
+        if (roster && roster.date === day) {
+            return (roster.marks[String(batchId)] || {})[String(studentId)] || null;
+        }
+        return null;
+    }
+
+    function rememberServerMark(record, present, notes) {
+        if (!roster || roster.date !== record.date) {
+            return;
+        }
+        const marks = roster.marks[String(record.batch_id)] = roster.marks[String(record.batch_id)] || {};
+        marks[String(record.student_id)] = [present, notes];
+    }
+
+    function studentName(record) {
+        const batch = roster && roster.batches.find(b => b.id === record.batch_id);
+        const student = batch && batch.students.find(s => s[0] === record.student_id);
+        return student ? student[1] : `Student ${record.student_id}`;
+    }
+
+    function render() {
+        if (!roster) {
+            return;
+        }
+        const selected = batchSelect.value;
+        batchSelect.innerHTML = '';
+        roster.batches.forEach(batch => {
+            const option = document.createElement('option');
+            option.value = batch.id;
+            option.textContent = batch.name;
+            batchSelect.appendChild(option);
+        });
+        if (roster.batches.some(batch => String(batch.id) === selected)) {
+            batchSelect.value = selected;
+        }
+        renderStudents();
+    }
+
+    function renderStudents() {
+        studentList.innerHTML = '';
+        const batch = roster && roster.batches.find(b => String(b.id) === batchSelect.value);
+        if (!batch || !batch.students.length) {
+            const empty = document.createElement('p');
+            empty.className = 'text-muted';
+            empty.textContent = batch ? 'No students in this batch.' : 'No batches to take attendance for.';
+            studentList.appendChild(empty);
+            return;
+        }
+        const day = dateInput.value;
+        batch.students.forEach(([studentId, name]) => {
+            const mark = markFor(studentId, batch.id, day);
+            const card = document.createElement('div');
+            card.className = 'card mb-2';
+            card.innerHTML = `
+                <div class="card-body py-2">
+                    <div class="row align-items-center">
+                        <div class="col-md-4">
+                            <div class="form-check">
+                                <input class="form-check-input" type="checkbox" id="present-${studentId}">
+                                <label class="form-check-label" for="present-${studentId}"></label>
+                            </div>
+                        </div>
+                        <div class="col-md-8">
+                            <input type="text" class="form-control form-control-sm" placeholder="Notes" maxlength="2000">
+                        </div>
+                    </div>
+                </div>`;
+            const checkbox = card.querySelector('input[type="checkbox"]');
+            const notes = card.querySelector('input[type="text"]');
+            card.querySelector('label').textContent = name;
+            checkbox.checked = mark ? mark[0] : false;
+            notes.value = mark ? mark[1] : '';
+            if (queue[recordKey(studentId, batch.id, day)]) {
+                card.classList.add('border-warning');
+            }
+            const record = () => {
+                queueMark(studentId, batch.id, day, checkbox.checked, notes.value);
+                card.classList.add('border-warning');
+            };
+            checkbox.addEventListener('change', record);
+            notes.addEventListener('change', record);
+            studentList.appendChild(card);
+        });
+    }
+
+    function queueMark(studentId, batchId, day, present, notes) {
+        const key = recordKey(studentId, batchId, day);
+        const recordedAt = new Date().toISOString();
+        queue[key] = {
+            id: `${key}@${recordedAt}`, // Changes with every edit, so a reply only clears the mark it was sent for
+            student_id: studentId,
+            batch_id: batchId,
+            date: day,
+            present: present,
+            notes: notes,
+            recorded_at: recordedAt
+        };
+        save(QUEUE_KEY, queue);
+        updateStatus();
+        scheduleSync();
+    }
+
+    function scheduleSync() {
+        clearTimeout(syncTimer);
+        if (navigator.onLine) {
+            syncTimer = setTimeout(sync, SYNC_DELAY);
+        }
+    }
+
+    function showProblems(problems) {
+        conflictBox.innerHTML = '';
+        if (!problems.length) {
+            conflictBox.classList.add('d-none');
+            return;
+        }
+        const heading = document.createElement('p');
+        heading.textContent = 'Some marks were not saved:';
+        const list = document.createElement('ul');
+        list.className = 'mb-0';
+        problems.forEach(([record, result]) => {
+            const item = document.createElement('li');
+            item.textContent = result.status === 'conflict'
+                ? `${studentName(record)} (${record.date}): changed by someone else since; kept ${result.server.present ? 'present' : 'absent'}.`
+                : `${studentName(record)} (${record.date}): ${result.reason}.`;
+            list.appendChild(item);
+        });
+        conflictBox.append(heading, list);
+        conflictBox.classList.remove('d-none');
+    }
+
+    function applyResults(results) {
+        const byId = {};
+        results.forEach(result => {
+            byId[result.id] = result;
+        });
+        const problems = [];
+        Object.keys(queue).forEach(key => {
+            const record = queue[key];
+            const result = byId[record.id];
+            if (!result) {
+                return; // Marked again while the request was in flight
+            }
+            delete queue[key];
+            if (result.status === 'conflict') {
+                rememberServerMark(record, result.server.present, result.server.notes);
+                problems.push([record, result]);
+            } else if (result.status === 'rejected') {
+                problems.push([record, result]);
+            } else {
+                rememberServerMark(record, record.present, record.notes);
+            }
+        });
+        save(QUEUE_KEY, queue);
+        save(ROSTER_KEY, roster);
+        return problems;
+    }
+
+    async function sync() {
+        clearTimeout(syncTimer);
+        if (syncing || !Object.keys(queue).length) {
+            updateStatus();
+            return;
+        }
+        syncing = true;
+        syncButton.disabled = true;
+        const problems = [];
+        try {
+            let records = Object.values(queue);
+            while (records.length) {
+                const response = await fetch(root.dataset.syncUrl, {
+                    method: 'POST',
+                    credentials: 'same-origin',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Accept': 'application/json'
+                    },
+                    body: JSON.stringify({
+                        branch: roster.branch,
+                        sent_at: new Date().toISOString(),
+                        records: records.slice(0, SYNC_BATCH)
+                    })
+                });
+                if (response.redirected || !(response.headers.get('Content-Type') || '').includes('application/json')) {
+                    updateStatus('Log in again to sync.');
+                    return;
+                }
+                const data = await response.json();
+                if (!response.ok) {
+                    updateStatus(data.error || 'Sync failed.');
+                    if (response.status === 409) {
+                        scheduleSync();
+                    }
+                    return;
+                }
+                problems.push(...applyResults(data.results));
+                records = records.slice(SYNC_BATCH);
+            }
+            updateStatus();
+        } catch (error) {
+            updateStatus('Marks will sync when the connection is back.');
+        } finally {
+            syncing = false;
+            syncButton.disabled = false;
+            showProblems(problems);
+            renderStudents();
+        }
+    }
+
+    async function refreshRoster() {
+        try {
+            const response = await fetch(root.dataset.rosterUrl, {
+                credentials: 'same-origin',
+                headers: { 'Accept': 'application/json' }
+            });
+            if (response.ok && !response.redirected) {
+                roster = await response.json();
+                save(ROSTER_KEY, roster);
+                render();
+            }
+        } catch (error) {
+            // Offline: keep using the stored bundle
+        }
+        if (roster) {
+            updateStatus();
+        } else {
+            statusBox.className = 'alert alert-warning';
+            statusBox.textContent = 'Connect once to download the roster for your batches.';
+        }
+    }
+
+    dateInput.value = localToday();
+    render();
+    updateStatus();
+    batchSelect.addEventListener('change', renderStudents);
+    dateInput.addEventListener('change', renderStudents);
+    syncButton.addEventListener('click', sync);
+    window.addEventListener('online', sync);
+    window.addEventListener('offline', () => updateStatus());
+    refreshRoster().then(sync);
+
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register(root.dataset.workerUrl)
+            .then(() => navigator.serviceWorker.ready)
+            .then(registration => {
+                // Keep this page and its scripts and stylesheets (fingerprinted or from a CDN) for offline loads
+                const urls = [
+                    location.href,
+                    ...Array.from(document.querySelectorAll('script[src]'), script => script.src),
+                    ...Array.from(document.querySelectorAll('link[rel="stylesheet"]'), link => link.href)
+                ];
+                registration.active.postMessage({ type: 'precache', urls: urls });
+            })
+            .catch(error => console.error('Service worker registration failed:', error));
+    }
+})();
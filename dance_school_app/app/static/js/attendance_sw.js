@@ -0,0 +1,62 @@
+// Service worker for /attendance/offline: keeps the page and its assets available without a connection.
+// Served from /attendance/offline-sw.js so its scope is /attendance/.
+const CACHE_NAME = 'attendance-offline-v1';
+const PAGE_PATH = new URL('offline', self.registration.scope).pathname;
+
+self.addEventListener('install', () => {
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys
+                .filter(key => key.startsWith('attendance-offline-') && key !== CACHE_NAME)
+                .map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+// The page posts the URLs it loaded, since fingerprinted asset names are only known to the page
+self.addEventListener('message', event => {
+    if (!event.data || event.data.type !== 'precache') {
+        return;
+    }
+    event.waitUntil(caches.open(CACHE_NAME).then(cache => Promise.all(event.data.urls.map(url => {
+        const sameOrigin = new URL(url).origin === self.location.origin;
+        return fetch(url, { mode: sameOrigin ? 'same-origin' : 'cors', credentials: sameOrigin ? 'same-origin' : 'omit' })
+            .then(response => {
+                if (response.ok && !response.redirected) {
+                    return cache.put(url, response);
+                }
+                return null;
+            })
+            .catch(() => null);
+    }))));
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return; // Syncs go straight to the network
+    }
+    const url = new URL(request.url);
+    if (request.mode === 'navigate') {
+        if (url.pathname !== PAGE_PATH) {
+            return;
+        }
+        // Network first so the page stays current; the cached copy when offline
+        event.respondWith(fetch(request)
+            .then(response => {
+                if (response.ok && !response.redirected) {
+                    const copy = response.clone();
+                    caches.open(CACHE_NAME).then(cache => cache.put(PAGE_PATH, copy));
+                }
+                return response;
+            })
+            .catch(() => caches.match(PAGE_PATH).then(cached => cached || Response.error())));
+        return;
+    }
+    // Assets the page precached: cached copy first, network for everything else
+    event.respondWith(caches.match(request).then(cached => cached || fetch(request)));
+});
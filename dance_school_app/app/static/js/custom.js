@@ -1,4 +1,17 @@
 document.addEventListener('DOMContentLoaded', function () {
+    // Logging out forgets offline attendance rosters and unsynced marks (phones are often shared)
+    const logoutLink = document.getElementById('logout-link');
+    if (logoutLink) {
+        logoutLink.addEventListener('click', function () {
+            try {
+                Object.keys(localStorage).filter(key => key.startsWith('attendance.'))
+                    .forEach(key => localStorage.removeItem(key));
+            } catch (error) {
+                // Storage unavailable (private mode): nothing was kept
+            }
+        });
+    }
+
     // Real-time form validation feedback
     const forms = document.querySelectorAll('form');
     forms.forEach(form => {
@@ -165,4 +178,32 @@ document.addEventListener('DOMContentLoaded', function () {
             });
         });
     }
-});
\ No newline at end of file
+});
+
+// Lazy dashboard panels: fetch a chart's JSON data and draw it once it arrives.
+// Every panel starts its request immediately, so slow panels don't hold up fast ones.
+function loadChartPanel(canvasId, buildConfig) {
+    const canvas = document.getElementById(canvasId);
+    if (!canvas || typeof Chart === 'undefined') return;
+    const container = canvas.parentElement;
+    container.dataset.state = 'loading';
+
+    fetch(canvas.dataset.src, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } })
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(payload => {
+            container.dataset.state = payload.labels.length ? 'ready' : 'empty';
+            if (!payload.labels.length) {
+                container.insertAdjacentHTML('beforeend', '<p class="text-muted chart-message">No data yet.</p>');
+                return;
+            }
+            new Chart(canvas.getContext('2d'), buildConfig(payload));
+        })
+        .catch(error => {
+            console.error(`Error loading ${canvasId}:`, error);
+            container.dataset.state = 'error';
+            container.insertAdjacentHTML('beforeend', '<p class="text-danger chart-message">Could not load this chart.</p>');
+        });
+}
@@ -0,0 +1,209 @@
+"""Weekly batch timetable and clash detection.
+
+Each ``BatchSlot`` is a half-open interval ``[start, end)`` in minutes from
+Monday 00:00. A ``Timetable`` groups the slots by resource (the batch's
+instructor, and the room when one is set; room names compare
+case-insensitively) and keeps an ``IntervalIndex`` per resource: intervals
+sorted by start with a running maximum of their ends. An overlap query then
+bisects to the last interval starting before the new one ends and walks back
+only while the running maximum still reaches past the new start. That costs
+O(log n) plus the overlaps found, so checking a new batch's slots against
+thousands of existing ones stays cheap. It stays correct even when the
+stored timetable already contains clashes.
+
+``Timetable.conflicts`` reports every clashing pair across the timetable with
+one sweep per resource (O(n log n) plus the pairs found), and ``calendar``
+lays the week out for ``/api/timetable``.
+"""
+import heapq
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+from itertools import accumulate
+from typing import NamedTuple, Optional
+
+from sqlalchemy import func, or_, select
+
+from app import db
+from app.models import Batch, BatchSlot, Staff
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+MINUTES_PER_DAY = 24 * 60
+
+
+def week_minute(weekday, time):
+    return weekday * MINUTES_PER_DAY + time.hour * 60 + time.minute
+
+
+def normalize_room(room):
+    """Room as stored: surrounding and repeated whitespace removed; None when blank."""
+    room = ' '.join((room or '').split())
+    return room or None
+
+
+class SlotRow(NamedTuple):
+    id: Optional[int]  # None for a slot that is not saved yet
+    batch_id: Optional[int]
+    batch_name: str
+    staff_id: int
+    staff_name: Optional[str]
+    weekday: int
+    start_time: object
+    end_time: object
+    room: Optional[str]
+
+    @property
+    def start(self):
+        return week_minute(self.weekday, self.start_time)
+
+    @property
+    def end(self):
+        return week_minute(self.weekday, self.end_time)
+
+    def resources(self):
+        """``('staff', id)`` and, with a room, ``('room', name)`` keys this slot occupies."""
+        keys = [('staff', self.staff_id)]
+        if self.room:
+            keys.append(('room', self.room.lower()))
+        return keys
+
+    def describe(self):
+        where = f' in {self.room}' if self.room else ''
+        return f'{self.batch_name} ({WEEKDAYS[self.weekday]} {self.start_time:%H:%M}-{self.end_time:%H:%M}{where})'
+
+
+class Conflict(NamedTuple):
+    kind: str  # 'staff' or 'room'
+    resource: str  # Instructor name or room
+    first: SlotRow
+    second: SlotRow
+
+
+class IntervalIndex:
+    """Half-open intervals ``(start, end, value)`` sorted by start, with prefix-maximum ends."""
+
+    def __init__(self, intervals=()):
+        self._items = sorted(intervals, key=lambda item: (item[0], item[1]))
+        self._starts = [item[0] for item in self._items]
+        self._max_ends = list(accumulate((item[1] for item in self._items), max))
+
+    def add(self, start, end, value):
+        position = bisect_left(self._starts, start)
+        self._starts.insert(position, start)
+        self._items.insert(position, (start, end, value))
+        previous = self._max_ends[position - 1] if position else end
+        self._max_ends.insert(position, max(previous, end))
+        for i in range(position + 1, len(self._max_ends)):  # Stops as soon as the running maximum is unchanged
+            if self._max_ends[i] >= self._max_ends[i - 1]:
+                break
+            self._max_ends[i] = self._max_ends[i - 1]
+
+    def overlapping(self, start, end):
+        """Values of the intervals overlapping ``[start, end)``, in start order; O(log n) when there are none."""
+        found = []
+        i = bisect_left(self._starts, end) - 1
+        while i >= 0 and self._max_ends[i] > start:
+            if self._items[i][1] > start:
+                found.append(self._items[i][2])
+            i -= 1
+        found.reverse()
+        return found
+
+    def overlapping_pairs(self):
+        """Every pair of overlapping intervals, by a sweep over the sorted starts."""
+        active = []  # Heap of (end, position) for intervals still open at the sweep position
+        for position, (start, end, value) in enumerate(self._items):
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            for _, other in active:
+                yield self._items[other][2], value
+            heapq.heappush(active, (end, position))
+
+
+class Timetable:
+    """Slots indexed per instructor and per room."""
+
+    def __init__(self, rows=()):
+        self.rows = []
+        self._indexes = defaultdict(IntervalIndex)
+        for row in rows:
+            self.add(row)
+
+    @classmethod
+    def load(cls, staff_id=None, rooms=None):
+        """All slots, or only those of ``staff_id`` and of ``rooms`` (enough to check one batch)."""
+        stmt = slot_query()
+        if staff_id is not None or rooms:
+            criteria = []
+            if staff_id is not None:
+                criteria.append(Batch.staff_id == staff_id)
+            if rooms:
+                criteria.append(func.lower(BatchSlot.room).in_({room.lower() for room in rooms}))
+            stmt = stmt.where(or_(*criteria))
+        return cls(SlotRow._make(row) for row in db.session.execute(stmt))
+
+    def add(self, row):
+        self.rows.append(row)
+        for key in row.resources():
+            self._indexes[key].add(row.start, row.end, row)
+
+    def clashes(self, row):
+        """Conflicts between ``row`` and the indexed slots."""
+        found = []
+        for kind, name in row.resources():
+            for other in self._indexes[kind, name].overlapping(row.start, row.end):
+                found.append(Conflict(kind, row.staff_name if kind == 'staff' else row.room, other, row))
+        return found
+
+    def check(self, rows):
+        """Conflicts of new ``rows`` with the timetable and with each other; adds them to the index."""
+        found = []
+        for row in rows:
+            found.extend(self.clashes(row))
+            self.add(row)
+        return found
+
+    def conflicts(self):
+        """Every clashing pair of slots in the timetable."""
+        found = []
+        for (kind, name), index in self._indexes.items():
+            for first, second in index.overlapping_pairs():
+                found.append(Conflict(kind, first.staff_name if kind == 'staff' else first.room, first, second))
+        return sorted(found, key=lambda conflict: (conflict.first.start, conflict.kind, conflict.resource or ''))
+
+
+def slot_query():
+    return select(BatchSlot.id, BatchSlot.batch_id, Batch.name, Batch.staff_id, Staff.name, BatchSlot.weekday,
+                  BatchSlot.start_time, BatchSlot.end_time, BatchSlot.room) \
+        .join(Batch, BatchSlot.batch_id == Batch.id) \
+        .outerjoin(Staff, Batch.staff_id == Staff.id) \
+        .order_by(BatchSlot.weekday, BatchSlot.start_time, BatchSlot.id)
+
+
+def _event(row, clashing, week_start):
+    event = {
+        'slot_id': row.id,
+        'batch_id': row.batch_id,
+        'batch': row.batch_name,
+        'staff_id': row.staff_id,
+        'staff': row.staff_name,
+        'room': row.room,
+        'weekday': row.weekday,
+        'day': WEEKDAYS[row.weekday],
+        'start': row.start_time.strftime('%H:%M'),
+        'end': row.end_time.strftime('%H:%M'),
+        'conflict': row.id in clashing,
+    }
+    if week_start is not None:
+        event['date'] = (week_start + timedelta(days=row.weekday)).isoformat()
+    return event
+
+
+def calendar(staff_id=None, room=None, week_start=None):
+    """The week's slots as calendar events, flagged when they clash; dated when ``week_start`` (a Monday) is given."""
+    timetable = Timetable.load()
+    clashing = {slot.id for conflict in timetable.conflicts() for slot in (conflict.first, conflict.second)}
+    rows = [row for row in timetable.rows
+            if (staff_id is None or row.staff_id == staff_id)
+            and (room is None or (row.room or '').lower() == room.lower())]
+    return [_event(row, clashing, week_start) for row in rows]
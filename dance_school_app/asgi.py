@@ -0,0 +1,20 @@
+"""ASGI entry point.
+
+Wraps the Flask app for ASGI servers, with the async views enabled::
+
+    uvicorn asgi:app --workers 4
+
+Run from ``dance_school_app``; needs ``flask[async]`` plus ``aiosqlite`` or
+``asyncpg`` for the configured database. ``FLASK_ENV`` defaults to
+``production`` and ``ASYNC_VIEWS`` to ``true`` here.
+"""
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+
+os.environ.setdefault('FLASK_ENV', 'production')
+os.environ.setdefault('ASYNC_VIEWS', 'true')
+
+from app import create_app  # Config reads the environment set above
+
+app = WsgiToAsgi(create_app())
@@ -0,0 +1,150 @@
+"""Compare sync and async views under concurrent load.
+
+Seeds a throwaway SQLite database with ``--students`` students (one payment
+per month each over the last year, plus daily attendance) and serves the app
+twice on a threaded local server: once with the sync views and once with
+``ASYNC_VIEWS`` enabled. Each run logs ``--concurrency`` clients in as the
+admin and has them fetch ``--path`` (default ``/api/dashboard/summary``, whose
+card counts the async view runs concurrently) ``--requests`` times in total.
+Reports throughput and p50/p95 latency for each mode.
+
+Needs ``flask[async]`` and ``aiosqlite`` for the async run (without
+``aiosqlite`` the async views fall back to threads, which is measured too).
+
+Usage (from ``dance_school_app``)::
+
+    python benchmarks/async_views.py --students 20000 --concurrency 16 --requests 800
+"""
+import argparse
+import http.cookiejar
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(db, students):
+    from werkzeug.security import generate_password_hash
+    from app import ledger
+    from app.models import User, Student, Staff, Batch, StudentBatch, Attendance, Payment
+    now, today = datetime.utcnow(), date.today()
+    db.session.execute(User.__table__.insert(), [
+        {'id': 1, 'username': 'admin', 'email': 'admin@example.com', 'role': 'admin', 'active': True,
+         'password_hash': generate_password_hash('benchmark')},
+        {'id': 2, 'username': 'instructor', 'email': 'instructor@example.com', 'role': 'staff', 'active': True,
+         'password_hash': 'x'}])
+    db.session.execute(Staff.__table__.insert(), [{'id': 1, 'user_id': 2, 'name': 'Instructor', 'joining_date': now}])
+    db.session.execute(Batch.__table__.insert(), [
+        {'id': i, 'name': f'Batch {i}', 'staff_id': 1, 'fee_monthly': 50.0} for i in range(1, 11)])
+    db.session.execute(User.__table__.insert(), [
+        {'id': i + 2, 'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': 'x',
+         'role': 'student', 'active': True} for i in range(1, students + 1)])
+    db.session.execute(Student.__table__.insert(), [
+        {'id': i, 'user_id': i + 2, 'full_name': f'Student {i}', 'age': 10 + i % 30, 'class_type': 'Salsa',
+         'registration_date': now} for i in range(1, students + 1)])
+    db.session.execute(StudentBatch.__table__.insert(), [
+        {'student_id': i, 'batch_id': i % 10 + 1} for i in range(1, students + 1)])
+    db.session.execute(Payment.__table__.insert(), [
+        {'student_id': i, 'batch_id': i % 10 + 1, 'amount': 50.0, 'due_date': today - timedelta(days=30 * month),
+         'status': 'paid' if month else 'unpaid'} for i in range(1, students + 1) for month in range(12)])
+    for day in range(30):
+        db.session.execute(Attendance.__table__.insert(), [
+            {'student_id': i, 'batch_id': i % 10 + 1, 'date': today - timedelta(days=day), 'present': (i + day) % 4 != 0}
+            for i in range(1, students + 1)])
+    db.session.commit()
+    ledger.rebuild()
+
+
+def serve(app):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # No per-request access log
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def client(base_url):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    body = urllib.parse.urlencode({'username': 'admin', 'password': 'benchmark'}).encode()
+    opener.open(base_url + '/login', body).read()
+    return opener
+
+
+def load(base_url, path, concurrency, requests):
+    """Fire ``requests`` GETs from ``concurrency`` logged-in clients; returns ``(seconds, latencies)``."""
+    openers = [client(base_url) for _ in range(concurrency)]
+    per_client = requests // concurrency
+
+    def run(opener):
+        latencies = []
+        for _ in range(per_client):
+            started = time.perf_counter()
+            with opener.open(base_url + path) as response:
+                response.read()
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = [latency for result in pool.map(run, openers) for latency in result]
+    return time.perf_counter() - started, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=800)
+    parser.add_argument('--path', default='/api/dashboard/summary')
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['FLASK_ENV'] = 'production'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    results = {}
+    try:
+        from app import async_views, create_app, db
+        app = create_app()
+        with app.app_context():
+            seed(db, args.students)
+        for mode in ('sync', 'async'):
+            app = create_app()
+            app.config.update(WTF_CSRF_ENABLED=False, SESSION_COOKIE_SECURE=False,
+                              FRAGMENT_CACHE_ENABLED=False, COMPRESSION_ENABLED=False)
+            if mode == 'async':
+                app.config['ASYNC_VIEWS'] = True
+                async_views.init_app(app)
+                if app.view_functions['main.dashboard_summary'] is not async_views.dashboard_summary:
+                    sys.exit('Async views are unavailable; install flask[async] (and aiosqlite).')
+            server = serve(app)
+            try:
+                base_url = f'http://127.0.0.1:{server.server_port}'
+                load(base_url, args.path, args.concurrency, args.concurrency)  # Warm up
+                results[mode] = load(base_url, args.path, args.concurrency, args.requests)
+            finally:
+                server.shutdown()
+    finally:
+        os.remove(path)
+
+    print(f'{args.path} with {args.concurrency} concurrent clients, {args.students} students')
+    print(f'{"mode":<8}{"requests":>10}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}')
+    for mode, (seconds, latencies) in results.items():
+        p50, p95 = statistics.quantiles(latencies, n=100)[49], statistics.quantiles(latencies, n=100)[94]
+        print(f'{mode:<8}{len(latencies):>10}{len(latencies) / seconds:>10.1f}{p50 * 1000:>10.1f}{p95 * 1000:>10.1f}')
+    sync, concurrent = results['sync'], results['async']
+    print(f'async: {len(concurrent[1]) / concurrent[0] / (len(sync[1]) / sync[0]):.2f}x the sync throughput')
+
+
+if __name__ == '__main__':
+    main()
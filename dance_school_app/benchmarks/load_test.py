@@ -0,0 +1,419 @@
+"""Role-based load test against a locally running instance.
+
+Simulates admins, staff and students as asyncio virtual users (standard
+library only). Each virtual user logs in through the real ``/login`` form,
+CSRF token included, keeps its own keep-alive connection and session cookie,
+and then replays weighted scenarios for its role with random think time:
+
+* admin: dashboard plus chart panels, student/payment/batch lists, CSV export
+* staff: dashboard plus chart panels, marking attendance for one of their
+  batches (form GET then POST), student list
+* student: dashboard plus chart panels, summary cards, batch list
+
+Concurrency ramps through ``--stages`` (``users:seconds`` pairs); users are
+added or retired at each stage boundary. For every stage the report lists
+requests, throughput, error rate and p50/p95/p99 latency per route (URLs with
+ids are grouped, e.g. ``POST /attendance/mark/<id>``). Responses with status
+400 or above, redirects back to the login page, timeouts and connection errors
+count as errors.
+
+Start the app first (e.g. ``python serve.py --bind 127.0.0.1:8000``) with
+users to log in as; ``create_test_data.py`` creates ``admin``, ``staff_user``
+and ``student_user`` with password ``password``, which are the defaults here.
+Only loopback addresses are accepted.
+
+Usage (from ``dance_school_app``)::
+
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --stages 10:30,50:60,100:60 \\
+        --mix admin=1,staff=4,student=15 --user staff:staff2:secret
+"""
+import argparse
+import asyncio
+import gzip
+import ipaddress
+import json
+import math
+import random
+import re
+import socket
+import sys
+import time
+from collections import defaultdict
+from html.parser import HTMLParser
+from urllib.parse import urlencode, urlsplit
+
+ROLES = ('admin', 'staff', 'student')
+DEFAULT_USERS = {'admin': [('admin', 'password')], 'staff': [('staff_user', 'password')],
+                 'student': [('student_user', 'password')]}
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+class FormParser(HTMLParser):
+    """Collects the inputs of the first POST form on a page."""
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+        self._state = 'before'  # before -> inside -> after
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form' and self._state == 'before' and (attrs.get('method') or '').lower() == 'post':
+            self._state = 'inside'
+        elif tag == 'input' and self._state == 'inside' and attrs.get('name'):
+            if attrs.get('type') in ('checkbox', 'radio') and 'checked' not in attrs:
+                return
+            self.fields[attrs['name']] = attrs.get('value') or ''
+
+    def handle_endtag(self, tag):
+        if tag == 'form' and self._state == 'inside':
+            self._state = 'after'
+
+
+def form_fields(html):
+    parser = FormParser()
+    parser.feed(html)
+    return parser.fields
+
+
+class Connection:
+    """Minimal HTTP/1.1 client over one keep-alive connection, with a cookie jar."""
+
+    def __init__(self, host, port, timeout):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.cookies = {}
+        self._reader = self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._reader = self._writer = None
+
+    async def request(self, method, path, form=None):
+        """Send a request; returns ``(status, headers, body_text)``. Reconnects once on a dropped connection."""
+        for attempt in (1, 2):
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                return await asyncio.wait_for(self._exchange(method, path, form), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                if attempt == 2:
+                    raise
+            except BaseException:
+                await self.close()
+                raise
+
+    async def _exchange(self, method, path, form):
+        body = urlencode(form).encode() if form is not None else b''
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', 'Accept-Encoding: gzip',
+                 'User-Agent: dance-school-load-test']
+        if self.cookies:
+            lines.append('Cookie: ' + '; '.join(f'{name}={value}' for name, value in self.cookies.items()))
+        if form is not None:
+            lines += ['Content-Type: application/x-www-form-urlencoded', f'Content-Length: {len(body)}']
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await self._reader.readuntil(b'\r\n')).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name, value = name.strip().lower(), value.strip()
+            if name == 'set-cookie':
+                cookie_name, _, cookie_value = value.split(';', 1)[0].partition('=')
+                self.cookies[cookie_name.strip()] = cookie_value.strip()
+            else:
+                headers[name] = value
+
+        if method == 'HEAD' or status in (204, 304):
+            data = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = b''
+            while True:
+                size = int((await self._reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunk = await self._reader.readexactly(size + 2)  # Each chunk ends with CRLF
+                if size == 0:
+                    break
+                data += chunk[:-2]
+        elif 'content-length' in headers:
+            data = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            data = await self._reader.read()
+            headers['connection'] = 'close'
+        if headers.get('connection', '').lower() == 'close' or status_line.startswith(b'HTTP/1.0'):
+            await self.close()
+        if headers.get('content-encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return status, headers, data.decode('utf-8', 'replace')
+
+
+class Stats:
+    """Latencies and errors per route for one stage."""
+
+    def __init__(self, users, seconds):
+        self.users, self.seconds = users, seconds
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    def record(self, route, seconds, ok):
+        self.latencies[route].append(seconds)
+        if not ok:
+            self.errors[route] += 1
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+class VirtualUser:
+    def __init__(self, runner, role, username, password):
+        self.runner, self.role = runner, role
+        self.username, self.password = username, password
+        self.connection = Connection(runner.host, runner.port, runner.timeout)
+        self.batch_ids = []
+
+    async def call(self, method, path, form=None, expect_login=False):
+        """Issue one request and record it; returns the response, or None if it failed."""
+        route = f'{method} {ID_SEGMENT.sub("/<id>", path.split("?", 1)[0])}'
+        started = time.perf_counter()
+        try:
+            status, headers, body = await self.connection.request(method, path, form)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            self.runner.stats.record(route, time.perf_counter() - started, False)
+            return None
+        logged_out = not expect_login and status in (301, 302, 303) and '/login' in headers.get('location', '')
+        ok = status < 400 and not logged_out
+        self.runner.stats.record(route, time.perf_counter() - started, ok)
+        return (status, headers, body) if ok else None
+
+    async def login(self):
+        page = await self.call('GET', '/login')
+        if page is None:
+            return False
+        form = form_fields(page[2])
+        form.update(username=self.username, password=self.password)
+        response = await self.call('POST', '/login', form, expect_login=True)
+        return response is not None and response[0] in (302, 303) and '/login' not in response[1].get('location', '')
+
+    async def get_all(self, *paths):
+        for path in paths:
+            await self.call('GET', path)
+
+    # Scenarios ------------------------------------------------------------
+
+    async def admin_dashboard(self):
+        await self.get_all('/admin/dashboard', '/api/charts/students-by-class', '/api/charts/payments-by-status',
+                           '/api/charts/students-per-batch', '/api/charts/attendance-summary')
+
+    async def admin_lists(self):
+        await self.get_all(random.choice(['/student/list', '/payment/list', '/batch/list', '/admin/staff/list']))
+
+    async def admin_export(self):
+        await self.get_all('/reports/students')
+
+    async def staff_dashboard(self):
+        await self.get_all('/staff/dashboard', '/api/charts/payments-by-status', '/api/charts/students-per-batch',
+                           '/api/charts/attendance-summary')
+
+    async def staff_mark_attendance(self):
+        if not self.batch_ids:
+            page = await self.call('GET', '/batch/list')
+            self.batch_ids = sorted(set(re.findall(r'/attendance/mark/(\d+)', page[2]))) if page else []
+            if not self.batch_ids:
+                return
+        path = f'/attendance/mark/{random.choice(self.batch_ids)}'
+        page = await self.call('GET', path)
+        if page is None:
+            return
+        form = form_fields(page[2])
+        for name in [name for name in form if name.endswith('-csrf_token')]:
+            if random.random() < 0.85:  # Most students are present
+                form[name[:-len('csrf_token')] + 'present'] = 'y'
+        await self.call('POST', path, form)
+
+    async def staff_students(self):
+        await self.get_all('/student/list')
+
+    async def student_dashboard(self):
+        await self.get_all('/student/dashboard', '/api/charts/attendance-30-days', '/api/charts/payments-by-status')
+
+    async def student_summary(self):
+        await self.get_all('/api/dashboard/summary')
+
+    async def student_batches(self):
+        await self.get_all('/api/batches')
+
+    SCENARIOS = {
+        'admin': [('admin_dashboard', 4), ('admin_lists', 5), ('admin_export', 1)],
+        'staff': [('staff_dashboard', 4), ('staff_mark_attendance', 4), ('staff_students', 2)],
+        'student': [('student_dashboard', 6), ('student_summary', 3), ('student_batches', 1)],
+    }
+
+    async def run(self):
+        try:
+            if not await self.login():
+                self.runner.login_failures += 1
+                return
+            names, weights = zip(*self.SCENARIOS[self.role])
+            while True:
+                await getattr(self, random.choices(names, weights)[0])()
+                await asyncio.sleep(random.uniform(0, 2 * self.runner.think))
+        finally:
+            await self.connection.close()
+
+
+class Runner:
+    def __init__(self, url, stages, mix, users, think, timeout):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.stages, self.think, self.timeout = stages, think, timeout
+        self.mix, self.users = mix, users
+        self.stats = None
+        self.login_failures = 0
+        self._spawned = 0
+        self._spawned_by_role = defaultdict(int)
+
+    def _next_user(self):
+        """Assign roles in proportion to the mix, cycling through each role's credentials."""
+        role = self._role_for(self._spawned)
+        credentials = self.users[role]
+        username, password = credentials[self._spawned_by_role[role] % len(credentials)]
+        self._spawned += 1
+        self._spawned_by_role[role] += 1
+        return VirtualUser(self, role, username, password)
+
+    def _role_for(self, index):
+        total = sum(self.mix.values())
+        slot = index % total
+        for role in ROLES:
+            if slot < self.mix.get(role, 0):
+                return role
+            slot -= self.mix.get(role, 0)
+
+    async def run(self):
+        tasks, results = [], []
+        try:
+            for users, seconds in self.stages:
+                self.stats = Stats(users, seconds)
+                while len(tasks) < users:
+                    tasks.append(asyncio.create_task(self._next_user().run()))
+                while len(tasks) > users:
+                    tasks.pop().cancel()
+                await asyncio.sleep(seconds)
+                self.stats.elapsed = time.perf_counter() - self.stats.started
+                results.append(self.stats)
+                print(f'stage {len(results)}: {users} users, {len(tasks)} running, '
+                      f'{sum(map(len, self.stats.latencies.values()))} requests', file=sys.stderr)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return results
+
+
+def summarize(stats):
+    rows = {}
+    for route, latencies in sorted(stats.latencies.items()):
+        ordered = sorted(latencies)
+        rows[route] = {'requests': len(ordered), 'rps': round(len(ordered) / stats.elapsed, 2),
+                       'error_rate': round(stats.errors[route] / len(ordered), 4),
+                       'p50_ms': round(percentile(ordered, 0.50) * 1000, 1),
+                       'p95_ms': round(percentile(ordered, 0.95) * 1000, 1),
+                       'p99_ms': round(percentile(ordered, 0.99) * 1000, 1)}
+    everything = sorted(latency for latencies in stats.latencies.values() for latency in latencies)
+    if everything:
+        errors = sum(stats.errors.values())
+        rows['TOTAL'] = {'requests': len(everything), 'rps': round(len(everything) / stats.elapsed, 2),
+                         'error_rate': round(errors / len(everything), 4),
+                         'p50_ms': round(percentile(everything, 0.50) * 1000, 1),
+                         'p95_ms': round(percentile(everything, 0.95) * 1000, 1),
+                         'p99_ms': round(percentile(everything, 0.99) * 1000, 1)}
+    return rows
+
+
+def print_report(results):
+    for number, stats in enumerate(results, 1):
+        print(f'\nStage {number}: {stats.users} users for {stats.seconds:g}s')
+        print(f'{"route":<40}{"requests":>9}{"req/s":>9}{"errors":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}')
+        for route, row in summarize(stats).items():
+            print(f'{route:<40}{row["requests"]:>9}{row["rps"]:>9.1f}{row["error_rate"]:>9.1%}'
+                  f'{row["p50_ms"]:>9.1f}{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}')
+
+
+def parse_stages(value):
+    stages = []
+    for part in value.split(','):
+        users, _, seconds = part.partition(':')
+        stages.append((int(users), float(seconds or 30)))
+    return stages
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        role, _, weight = part.partition('=')
+        if role not in ROLES:
+            raise argparse.ArgumentTypeError(f'unknown role {role!r}')
+        mix[role] = int(weight or 1)
+    return mix
+
+
+def is_loopback(host):
+    try:
+        return all(ipaddress.ip_address(info[4][0]).is_loopback for info in socket.getaddrinfo(host, None))
+    except (OSError, ValueError):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--stages', type=parse_stages, default=parse_stages('10:30,25:30,50:30'),
+                        help='Comma-separated users:seconds stages (default 10:30,25:30,50:30).')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('admin=1,staff=4,student=15'),
+                        help='Relative share of each role (default admin=1,staff=4,student=15).')
+    parser.add_argument('--user', action='append', default=[], metavar='ROLE:USERNAME:PASSWORD',
+                        help='Credentials to log in with; repeat for more users (default: create_test_data.py users).')
+    parser.add_argument('--think', type=float, default=1.0, help='Mean think time between scenarios, seconds.')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout, seconds.')
+    parser.add_argument('--json', type=argparse.FileType('w'), help='Also write the per-stage report as JSON here.')
+    args = parser.parse_args()
+
+    parts = urlsplit(args.url)
+    if parts.scheme != 'http' or not parts.hostname or not is_loopback(parts.hostname):
+        parser.error('only plain http:// URLs on a loopback address are supported')
+    users = {role: [] for role in ROLES}
+    for spec in args.user:
+        role, _, credentials = spec.partition(':')
+        username, _, password = credentials.partition(':')
+        if role not in ROLES or not username:
+            parser.error(f'--user expects ROLE:USERNAME:PASSWORD, got {spec!r}')
+        users[role].append((username, password))
+    for role in ROLES:
+        if args.mix.get(role) and not users[role]:
+            users[role] = DEFAULT_USERS[role]
+
+    runner = Runner(args.url, args.stages, args.mix, users, args.think, args.timeout)
+    results = asyncio.run(runner.run())
+    print_report(results)
+    if runner.login_failures:
+        print(f'\n{runner.login_failures} virtual user(s) could not log in', file=sys.stderr)
+    if args.json:
+        json.dump([{'users': stats.users, 'seconds': stats.seconds, 'routes': summarize(stats)} for stats in results],
+                  args.json, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Compare read-model projection against ORM hydration for the student list.
+
+Seeds a throwaway SQLite database with ``--rows`` students (each with a user)
+and loads the student list twice: as ORM instances with ``student.user.email``
+(what ``student_list`` used to do) and through ``read_models.student_rows()``.
+Reports wall time and the peak Python memory of each, overall and per row.
+
+Usage (from ``dance_school_app``)::
+
+    python benchmarks/read_models.py --rows 100000
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(db, rows):
+    from app.models import User, Student
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': 'x',
+         'role': 'student', 'active': True} for i in range(1, rows + 1)])
+    db.session.execute(Student.__table__.insert(), [
+        {'id': i, 'user_id': i, 'full_name': f'Student {i}', 'age': 10 + i % 30, 'class_type': 'Salsa',
+         'contact_number': '555-0100', 'registration_date': now} for i in range(1, rows + 1)])
+    db.session.commit()
+
+
+def measure(load):
+    """Run ``load`` on a fresh session; returns ``(seconds, peak_bytes, rows)``."""
+    from app import db
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(result)
+    del result
+    db.session.remove()
+    return elapsed, peak, count
+
+
+def orm_students():
+    from app.models import Student
+    students = Student.query.all()
+    for student in students:
+        student.user.email  # Printed by the template; loads each student's user
+    return students
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['FLASK_ENV'] = 'production'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    try:
+        from app import create_app, db, read_models
+        app = create_app()
+        with app.app_context():
+            seed(db, args.rows)
+            results = {'orm': measure(orm_students), 'read model': measure(read_models.student_rows)}
+    finally:
+        os.remove(path)
+
+    print(f'{"loader":<12}{"rows":>10}{"seconds":>10}{"peak MiB":>10}{"us/row":>10}{"bytes/row":>11}')
+    for name, (seconds, peak, count) in results.items():
+        print(f'{name:<12}{count:>10}{seconds:>10.3f}{peak / 2 ** 20:>10.1f}'
+              f'{seconds * 1e6 / count:>10.2f}{peak / count:>11.0f}')
+    orm, projected = results['orm'], results['read model']
+    print(f'read model: {orm[0] / projected[0]:.1f}x faster, {orm[1] / projected[1]:.1f}x less memory')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,9 @@ from flask import current_app
 
 from alembic import context
 
+from app.archive import is_archive_table
+from app.sharding import engine_for
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -14,8 +17,13 @@ config = context.config
 fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
+# `flask shards upgrade` passes -x shard=<branch code> to migrate one branch's database
+shard = context.get_x_argument(as_dictionary=True).get('shard')
+
 
 def get_engine():
+    if shard:
+        return engine_for(shard)
     try:
         # this works with Flask-SQLAlchemy<3 and Alchemical
         return current_app.extensions['migrate'].db.get_engine()
@@ -90,9 +98,16 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # attendance archive tables are created at runtime by `flask archive-attendance`
+    def include_name(name, type_, parent_names):
+        return not (type_ == 'table' and is_archive_table(name))
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_name", include_name)
+    # Backfill revisions commit chunk by chunk (app/backfill.py); keep every other revision atomic on its own
+    conf_args.setdefault("transaction_per_migration", True)
 
     connectable = get_engine()
 
@@ -0,0 +1,35 @@
+"""Change feed tombstones
+
+Revision ID: a9e3f7c2d5b8
+Revises: f2c6d8a4b1e7
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9e3f7c2d5b8'
+down_revision = 'f2c6d8a4b1e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('deleted_row',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('deleted_row', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_deleted_row_deleted_at'), ['deleted_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('deleted_row', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_deleted_row_deleted_at'))
+
+    op.drop_table('deleted_row')
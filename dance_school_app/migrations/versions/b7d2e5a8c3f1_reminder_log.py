@@ -0,0 +1,33 @@
+"""Payment reminder sent-log
+
+Revision ID: b7d2e5a8c3f1
+Revises: a1c4e7d2f9b0
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e5a8c3f1'
+down_revision = 'a1c4e7d2f9b0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('reminder_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('payment_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('recipient', sa.String(length=120), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['payment_id'], ['payment.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('payment_id', 'status', name='uix_reminder_payment_status')
+    )
+
+
+def downgrade():
+    op.drop_table('reminder_log')
@@ -0,0 +1,44 @@
+"""At-risk report: attendance date index and student risk snapshot
+
+Revision ID: c3f8a1d6e2b4
+Revises: b7d2e5a8c3f1
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f8a1d6e2b4'
+down_revision = 'b7d2e5a8c3f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_attendance_date'), ['date'], unique=False)
+
+    op.create_table('student_risk_score',
+    sa.Column('student_id', sa.Integer(), nullable=False),
+    sa.Column('computed_on', sa.Date(), nullable=False),
+    sa.Column('attendance_rate', sa.Float(), nullable=True),
+    sa.Column('attendance_trend', sa.Float(), nullable=False),
+    sa.Column('consecutive_absences', sa.Integer(), nullable=False),
+    sa.Column('outstanding_balance', sa.Float(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['student_id'], ['student.id'], ),
+    sa.PrimaryKeyConstraint('student_id')
+    )
+    with op.batch_alter_table('student_risk_score', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_student_risk_score_score'), ['score'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('student_risk_score', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_student_risk_score_score'))
+
+    op.drop_table('student_risk_score')
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_attendance_date'))
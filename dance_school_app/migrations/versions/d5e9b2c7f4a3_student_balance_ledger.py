@@ -0,0 +1,46 @@
+"""Per-student balance ledger
+
+Revision ID: d5e9b2c7f4a3
+Revises: c3f8a1d6e2b4
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e9b2c7f4a3'
+down_revision = 'c3f8a1d6e2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('student_balance',
+    sa.Column('student_id', sa.Integer(), nullable=False),
+    sa.Column('batch_id', sa.Integer(), nullable=False),
+    sa.Column('billed_minor', sa.BigInteger(), nullable=False),
+    sa.Column('paid_minor', sa.BigInteger(), nullable=False),
+    sa.Column('outstanding_minor', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['batch_id'], ['batch.id'], ),
+    sa.ForeignKeyConstraint(['student_id'], ['student.id'], ),
+    sa.PrimaryKeyConstraint('student_id', 'batch_id')
+    )
+
+    # Seed balances from existing payments; `flask ledger verify` confirms them afterwards
+    op.execute("""
+        INSERT INTO student_balance (student_id, batch_id, billed_minor, paid_minor, outstanding_minor, updated_at)
+        SELECT student_id, batch_id,
+               SUM(CAST(ROUND(amount * 100) AS BIGINT)),
+               SUM(CASE WHEN status = 'paid' THEN CAST(ROUND(amount * 100) AS BIGINT) ELSE 0 END),
+               SUM(CASE WHEN status IN ('unpaid', 'overdue') THEN CAST(ROUND(amount * 100) AS BIGINT) ELSE 0 END),
+               CURRENT_TIMESTAMP
+        FROM payment
+        GROUP BY student_id, batch_id
+    """)
+
+
+def downgrade():
+    op.drop_table('student_balance')
@@ -0,0 +1,37 @@
+"""Change tracking timestamps for the change feed
+
+Revision ID: e8a4c1f6b2d9
+Revises: d5e9b2c7f4a3
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a4c1f6b2d9'
+down_revision = 'd5e9b2c7f4a3'
+branch_labels = None
+depends_on = None
+
+TABLES = ('student', 'batch', 'student_batch', 'attendance', 'payment')
+
+
+def upgrade():
+    for table in TABLES:
+        # Existing rows are stamped with the migration time, so the first feed pull returns everything
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=False,
+                                          server_default=sa.func.current_timestamp()))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                          server_default=sa.func.current_timestamp()))
+            batch_op.create_index(batch_op.f(f'ix_{table}_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_updated_at'))
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('created_at')
@@ -0,0 +1,40 @@
+"""Batch timetable slots
+
+Revision ID: f2c6d8a4b1e7
+Revises: e8a4c1f6b2d9
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6d8a4b1e7'
+down_revision = 'e8a4c1f6b2d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('batch_slot',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('batch_id', sa.Integer(), nullable=False),
+    sa.Column('weekday', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.Time(), nullable=False),
+    sa.Column('end_time', sa.Time(), nullable=False),
+    sa.Column('room', sa.String(length=50), nullable=True),
+    sa.ForeignKeyConstraint(['batch_id'], ['batch.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('batch_slot', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_batch_slot_batch_id'), ['batch_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_batch_slot_room'), ['room'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('batch_slot', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_batch_slot_room'))
+        batch_op.drop_index(batch_op.f('ix_batch_slot_batch_id'))
+
+    op.drop_table('batch_slot')
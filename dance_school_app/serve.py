@@ -0,0 +1,351 @@
+"""Pre-fork production server.
+
+Loads the app once in a master process, binds the listening socket, and forks
+``--workers`` processes that all accept on that shared socket, each serving
+requests with a pool of ``--threads`` threads (Werkzeug's HTTP server
+underneath). Put a reverse proxy such as nginx in front for TLS and slow
+clients.
+
+* Worker recycling: a worker exits after ``--max-requests`` requests (plus a
+  random jitter so workers do not restart together) and the master replaces
+  it, capping slow memory growth.
+* Health: every worker writes a heartbeat file once a second. The master kills
+  and replaces a worker whose heartbeat is older than ``--timeout``.
+  ``GET /-/health`` on any worker returns the state of all workers (503 if any
+  heartbeat is stale).
+* Signals to the master: ``SIGTERM``/``SIGINT`` stop gracefully (in-flight
+  requests finish), ``SIGHUP`` reloads gracefully (the master re-executes
+  itself on the same socket, loads the new code, starts new workers, then
+  retires the old ones), and ``SIGTTIN``/``SIGTTOU`` add or remove a worker.
+
+Usage (from ``dance_school_app``)::
+
+    python serve.py --bind 0.0.0.0:8000 --workers 4 --threads 8
+
+Defaults come from the ``SERVER_*`` settings in ``app/config.py``.
+``FLASK_ENV`` defaults to ``production`` here.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+HEARTBEAT_INTERVAL = 1.0
+LISTEN_FD_ENV = 'SERVE_LISTEN_FD'  # Passed across a SIGHUP re-exec
+OLD_WORKERS_ENV = 'SERVE_OLD_WORKERS'
+HEARTBEAT_DIR_ENV = 'SERVE_HEARTBEAT_DIR'
+
+
+class WorkerRequestHandler(WSGIRequestHandler):
+    # One request per connection: keep-alive would pin a pool thread to an idle client
+    protocol_version = 'HTTP/1.0'
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server on an inherited socket, handling requests on a bounded thread pool.
+
+    A connection is only accepted once a pool thread is free, so a busy worker
+    leaves new connections in the shared listen queue for its idle siblings.
+    """
+
+    def __init__(self, app, address, fd, threads):
+        self.multithread = threads > 1
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request') if threads > 1 else None
+        self._free_threads = threading.BoundedSemaphore(threads)
+        super().__init__(address[0], address[1], app, handler=WorkerRequestHandler, fd=fd)
+
+    def get_request(self):
+        if self._pool is None:
+            return super().get_request()
+        self._free_threads.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self._free_threads.release()
+            raise
+
+    def process_request(self, request, client_address):
+        if self._pool is None:
+            return super().process_request(request, client_address)
+        self._pool.submit(self._process_in_thread, request, client_address)
+
+    def _process_in_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def shutdown_request(self, request):
+        # Every accepted connection ends here, whether it was served, rejected or failed to queue
+        try:
+            super().shutdown_request(request)
+        finally:
+            if self._pool is not None:
+                self._free_threads.release()
+
+    def drain(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+
+class Worker:
+    """Runs in a forked child: serves until told to stop or its request budget is spent."""
+
+    def __init__(self, app, sock, threads, max_requests, heartbeat_dir, health_path):
+        self.app = app
+        self.sock = sock
+        self.threads = threads
+        self.max_requests = max_requests
+        self.heartbeat_path = os.path.join(heartbeat_dir, f'worker-{os.getpid()}.json')
+        self.heartbeat_dir = heartbeat_dir
+        self.health_path = health_path
+        self.requests = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.server = None
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == self.health_path:
+            return self._health(start_response)
+        with self._lock:
+            self.requests += 1
+            spent = self.max_requests and self.requests >= self.max_requests
+        if spent:
+            self.stop()  # Finishes this request, then the master starts a fresh worker
+        return self.app(environ, start_response)
+
+    def _health(self, start_response):
+        workers = read_heartbeats(self.heartbeat_dir)
+        stale = [w for w in workers if w['age'] > HEARTBEAT_INTERVAL * 5]
+        body = json.dumps({'master_pid': os.getppid(), 'workers': workers}).encode('utf-8')
+        start_response('503 Service Unavailable' if stale else '200 OK',
+                       [('Content-Type', 'application/json'), ('Content-Length', str(len(body))),
+                        ('Cache-Control', 'no-store')])
+        return [body]
+
+    def _beat(self):
+        while not self._stopping.is_set():
+            state = {'pid': os.getpid(), 'requests': self.requests, 'started': self.started, 'heartbeat': time.time()}
+            tmp_path = self.heartbeat_path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.heartbeat_path)
+            except OSError:
+                pass
+            self._stopping.wait(HEARTBEAT_INTERVAL)
+
+    def stop(self, *_):
+        if not self._stopping.is_set():
+            self._stopping.set()
+            # shutdown() waits for serve_forever to return, so it cannot run on the serving thread
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C reaches the master, which stops workers in order
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.server = PooledWSGIServer(self, self.sock.getsockname()[:2], self.sock.fileno(), self.threads)
+        threading.Thread(target=self._beat, daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.drain()
+            queue = self.app.extensions.get('checkin')
+            if queue is not None:
+                queue.flush()  # os._exit skips atexit, so flush queued check-ins here
+
+
+def read_heartbeats(heartbeat_dir):
+    now = time.time()
+    workers = []
+    for name in sorted(os.listdir(heartbeat_dir)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(heartbeat_dir, name), encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        state['age'] = round(now - state['heartbeat'], 3)
+        state['uptime'] = round(now - state['started'], 1)
+        workers.append(state)
+    return workers
+
+
+class Master:
+    def __init__(self, options):
+        self.options = options
+        self.workers = {}  # pid -> spawn time
+        self.retiring = set()  # Workers from before a reload, stopped once replacements run
+        self.retire_sent = False
+        self.target = options.workers
+        self.signals = []
+        self.stopping = False
+
+    def load(self):
+        os.environ.setdefault('FLASK_ENV', 'production')
+        from app import create_app, db
+        self.app = create_app()
+        with self.app.app_context():
+            # Never hand pooled connections across fork(); one engine per branch
+            for engine in db.engines.values():
+                engine.dispose()
+        self.db = db
+
+    def bind(self):
+        inherited = os.environ.pop(LISTEN_FD_ENV, None)
+        if inherited is not None:
+            self.sock = socket.socket(fileno=int(inherited))
+        else:
+            host, _, port = self.options.bind.rpartition(':')
+            self.sock = socket.create_server((host or '0.0.0.0', int(port)), backlog=self.options.backlog)
+        old = os.environ.pop(OLD_WORKERS_ENV, '')
+        self.retiring = {int(pid) for pid in old.split(',') if pid}
+        self.heartbeat_dir = os.environ.get(HEARTBEAT_DIR_ENV) or tempfile.mkdtemp(prefix='dance-school-serve-')
+        os.environ[HEARTBEAT_DIR_ENV] = self.heartbeat_dir
+
+    def spawn(self):
+        max_requests = self.options.max_requests
+        if max_requests:
+            max_requests += random.randint(0, self.options.max_requests_jitter)
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return
+        # Child
+        code = 0
+        try:
+            with self.app.app_context():
+                for engine in self.db.engines.values():
+                    engine.dispose(close=False)
+            Worker(self.app, self.sock, self.options.threads, max_requests,
+                   self.heartbeat_dir, self.options.health_path).run()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _on_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.workers.pop(pid, None)
+            self.retiring.discard(pid)
+            try:
+                os.unlink(os.path.join(self.heartbeat_dir, f'worker-{pid}.json'))
+            except OSError:
+                pass
+
+    def check_heartbeats(self):
+        now = time.time()
+        for state in read_heartbeats(self.heartbeat_dir):
+            pid = state['pid']
+            if pid in self.workers and now - state['heartbeat'] > self.options.timeout:
+                print(f'[serve] worker {pid} missed its heartbeat for {self.options.timeout}s; killing it',
+                      file=sys.stderr)
+                self._kill(pid, signal.SIGKILL)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def reload(self):
+        """Re-exec this master on the same socket; the new one retires the current workers once it is up."""
+        print('[serve] reloading', file=sys.stderr)
+        os.set_inheritable(self.sock.fileno(), True)
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in (*self.workers, *self.retiring))
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def stop(self):
+        self.stopping = True
+        for pid in (*self.workers, *self.retiring):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.options.graceful_timeout
+        while (self.workers or self.retiring) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in (*self.workers, *self.retiring):
+            self._kill(pid, signal.SIGKILL)
+        self.reap()
+        self.sock.close()
+        shutil.rmtree(self.heartbeat_dir, ignore_errors=True)
+
+    def run(self):
+        self.load()
+        self.bind()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, self._on_signal)
+        print(f'[serve] master {os.getpid()} on {self.sock.getsockname()} with {self.target} worker(s) x '
+              f'{self.options.threads} thread(s)', file=sys.stderr)
+
+        while True:
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop()
+                    return
+                if signum == signal.SIGHUP:
+                    self.reload()
+                elif signum == signal.SIGTTIN:
+                    self.target += 1
+                elif signum == signal.SIGTTOU and self.target > 1:
+                    self.target -= 1
+                    self._kill(max(self.workers, key=self.workers.get), signal.SIGTERM)
+
+            self.reap()
+            while len(self.workers) < self.target:
+                self.spawn()
+            if self.retiring and not self.retire_sent and len(self.workers) >= self.target:
+                for pid in self.retiring:
+                    self._kill(pid, signal.SIGTERM)
+                self.retire_sent = True
+            self.check_heartbeats()
+            time.sleep(0.2)
+
+
+def parse_args(argv=None):
+    # Defaults live in the app config so deployments configure the server like everything else
+    from app.config import Config
+    parser = argparse.ArgumentParser(description='Pre-fork production server for the dance school app.')
+    parser.add_argument('--bind', default=Config.SERVER_BIND, help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=Config.SERVER_WORKERS)
+    parser.add_argument('--threads', type=int, default=Config.SERVER_THREADS, help='Request threads per worker')
+    parser.add_argument('--max-requests', type=int, default=Config.SERVER_MAX_REQUESTS,
+                        help='Recycle a worker after this many requests (0 disables)')
+    parser.add_argument('--max-requests-jitter', type=int, default=Config.SERVER_MAX_REQUESTS_JITTER)
+    parser.add_argument('--timeout', type=float, default=Config.SERVER_TIMEOUT,
+                        help='Seconds without a heartbeat before a worker is killed')
+    parser.add_argument('--graceful-timeout', type=float, default=Config.SERVER_GRACEFUL_TIMEOUT)
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--health-path', default='/-/health')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    Master(parse_args()).run()